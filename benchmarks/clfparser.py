@@ -0,0 +1,125 @@
+"""Measure the throughput of the nginx/apache log line parser.
+
+Usage::
+
+    $ python benchmarks/clfparser.py
+    $ python benchmarks/clfparser.py --runs 5 /var/log/nginx/access.log*
+
+Parses every line of the logfiles (by default the test fixtures in
+``serverscripts/tests/example_geoserver_logs/``) with the previous
+implementation (included below) and with the current one and prints the
+number of lines per second. It also checks that both give the same result.
+
+"""
+from datetime import datetime
+from serverscripts import clfparser
+
+import argparse
+import glob
+import gzip
+import os
+import re
+import time
+
+
+FIXTURES = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "serverscripts",
+    "tests",
+    "example_geoserver_logs",
+    "access.log*",
+)
+
+
+class PreviousCLFParser:
+    """The parser as it was before serverscripts 2.12, for comparison"""
+
+    commonLogFormat = r'(?P<h>([^ ]*)) (?P<l>([^ ]*)) (?P<u>([^ ]*)) (?P<t>\[([^]]*)\]) (?P<r>"([^"]*)") (?P<s>([^ ]*)) (?P<b>([^ ]*))'  # noqa: E501
+    combinedLogFormat = r'(?P<h>([^ ]*)) (?P<l>([^ ]*)) (?P<u>([^ ]*)) (?P<t>\[([^]]*)\]) (?P<r>"([^"]*)") (?P<s>([^ ]*)) (?P<b>([^ ]*)) (?P<Referer>"([^"]*)") (?P<Useragent>"([^"]*)")'  # noqa: E501
+
+    nullRec = {
+        "h": "",
+        "l": "",
+        "u": "",
+        "t": "",
+        "r": "",
+        "s": "",
+        "b": "",
+        "Referer": "",
+        "Useragent": "",
+        "time": "",
+        "timezone": "",
+    }
+
+    def __init__(self, rec):
+        for p in (self.combinedLogFormat, self.commonLogFormat):
+            m = re.match(p, rec)
+            if m:
+                self.clfDict = m.groupdict()
+                if p == self.commonLogFormat:
+                    self.clfDict.update({"Referer": "", "Useragent": ""})
+                self.clfDict.update(
+                    {
+                        "time": datetime.strptime(
+                            self.clfDict["t"][1:21], "%d/%b/%Y:%H:%M:%S"
+                        ),
+                        "timezone": (self.clfDict["t"])[22:27],
+                    }
+                )
+                break
+        else:
+            self.clfDict = self.nullRec
+
+    @classmethod
+    def logDict(cls, rec):
+        return cls(rec).clfDict
+
+
+def read_lines(patterns):
+    lines = []
+    for pattern in patterns:
+        for filename in sorted(glob.glob(pattern)):
+            opener = gzip.open if filename.endswith(".gz") else open
+            with opener(filename, "rt") as f:
+                lines.extend(f)
+    return lines
+
+
+def lines_per_second(function, lines, runs):
+    """Return the best lines/second of a couple of runs"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        for line in lines:
+            function(line)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return len(lines) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logfiles", nargs="*", default=[FIXTURES])
+    parser.add_argument("--runs", type=int, default=3)
+    options = parser.parse_args()
+
+    lines = read_lines(options.logfiles)
+    print("%d lines" % len(lines))
+    for line in lines:
+        expected = PreviousCLFParser.logDict(line)
+        if clfparser.CLFParser.logDict(line) != expected:
+            print("Different result for %r" % line)
+
+    previous = lines_per_second(PreviousCLFParser.logDict, lines, options.runs)
+    print("previous CLFParser.logDict(): %10d lines/s" % previous)
+    compatible = lines_per_second(clfparser.CLFParser.logDict, lines, options.runs)
+    print("current CLFParser.logDict():  %10d lines/s" % compatible)
+    current = lines_per_second(clfparser.parse, lines, options.runs)
+    print("current parse():              %10d lines/s" % current)
+    print("parse() speedup: %.1fx" % (current / previous))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Measure the throughput of extracting workspace/referer from geoserver logs.
+
+Usage::
+
+    $ python benchmarks/geoserver_extract.py
+    $ python benchmarks/geoserver_extract.py --runs 5 /var/log/nginx/access.log*
+
+Takes the GetMap lines of the logfiles (by default the test fixtures in
+``serverscripts/tests/example_geoserver_logs/``), just like geoserver-info's
+prefilter does, and extracts the workspace and referer from them with
+``extract_from_line()`` (decoding the line first) and with the binary
+``extract_from_bytes()``. It prints the number of lines per second and checks
+that both give the same result.
+
+"""
+from serverscripts import geoserver
+
+import argparse
+import glob
+import gzip
+import os
+import time
+
+
+FIXTURES = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "serverscripts",
+    "tests",
+    "example_geoserver_logs",
+    "access.log*",
+)
+
+
+def read_lines(patterns):
+    lines = []
+    for pattern in patterns:
+        for filename in sorted(glob.glob(pattern)):
+            opener = gzip.open if filename.endswith(".gz") else open
+            with opener(filename, "rb") as f:
+                lines.extend(
+                    line for line in f if b"/geoserver/" in line and b"GetMap" in line
+                )
+    return lines
+
+
+def decode_and_extract(line):
+    return geoserver.extract_from_line(line.decode("utf-8", "replace"))
+
+
+def lines_per_second(function, lines, runs):
+    """Return the best lines/second of a couple of runs"""
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        for line in lines:
+            function(line)
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+    return len(lines) / best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("logfiles", nargs="*", default=[FIXTURES])
+    parser.add_argument("--runs", type=int, default=3)
+    options = parser.parse_args()
+
+    lines = read_lines(options.logfiles)
+    print("%d GetMap lines" % len(lines))
+    fallbacks = 0
+    for line in lines:
+        if geoserver._fast_extract(line) is geoserver.FALLBACK:
+            fallbacks += 1
+        if geoserver.extract_from_bytes(line) != decode_and_extract(line):
+            print("Different result for %r" % line)
+    print("%d lines didn't fit the fast path" % fallbacks)
+
+    previous = lines_per_second(decode_and_extract, lines, options.runs)
+    print("extract_from_line():  %10d lines/s" % previous)
+    current = lines_per_second(geoserver.extract_from_bytes, lines, options.runs)
+    print("extract_from_bytes(): %10d lines/s" % current)
+    print("speedup: %.1fx" % (current / previous))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Measure the import cost of gather-all-info with ``python -X importtime``.
+
+Usage::
+
+    $ python benchmarks/importtime.py
+    $ python benchmarks/importtime.py --module serverscripts.agent --runs 10
+
+Prints the median cumulative import time of the module (microseconds) plus the
+most expensive imports. With ``--max-microseconds`` it exits with an error if
+the median is above the budget, which makes it usable as a guard in CI.
+
+Needs python 3.7+ (for ``-X importtime``).
+
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+def import_times(module):
+    """Return {imported module: cumulative microseconds} for one import"""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    result = {}
+    for line in process.stderr.split("\n"):
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_time, cumulative, name = line[len("import time:") :].split("|")
+        result[name.strip()] = int(cumulative)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="serverscripts.script")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--max-microseconds", type=int, default=None)
+    options = parser.parse_args()
+
+    runs = [import_times(options.module) for _ in range(options.runs)]
+    totals = [run[options.module] for run in runs]
+    median = statistics.median(totals)
+    print(
+        "%s: median %d us (min %d, max %d) over %d runs"
+        % (options.module, median, min(totals), max(totals), options.runs)
+    )
+    last_run = runs[-1]
+    print("Most expensive imports (cumulative, last run):")
+    for name, cumulative in sorted(last_run.items(), key=lambda item: -item[1])[
+        : options.top
+    ]:
+        print("  %8d us  %s" % (cumulative, name))
+
+    if options.max_microseconds and median > options.max_microseconds:
+        print("Over budget: %d > %d us" % (median, options.max_microseconds))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,11 @@
-import pkg_resources
+try:
+    from importlib.metadata import version
+except ImportError:  # Python < 3.8
+    # Note: pkg_resources is a lot slower to import.
+    import pkg_resources
 
+    def version(distribution_name):
+        return pkg_resources.get_distribution(distribution_name).version
 
-__version__ = pkg_resources.get_distribution("serverscripts").version
+
+__version__ = version("serverscripts")
@@ -0,0 +1,179 @@
+"""Long-running alternative for the gather-all-info and cifsfixer cronjobs.
+
+Cron starts a fresh python for every run, which imports everything again and
+recomputes facts that hardly ever change. The agent keeps running, keeps the
+collectors imported and runs every collector on its own interval: cifsfixer
+every minute, checkouts every hour, geoserver once a day and so on.
+
+Every run still happens in a separate (forked) process, just like with
+gather-all-info, so the fact and zabbix files are the same as with the
+cronjobs. A collector module is imported in the agent itself the first time it
+is needed, so the forked processes get it for free.
+
+"""
+from serverscripts import script
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import serverscripts
+import signal
+import sys
+import time
+
+
+CONFIG_DIR = "/etc/serverscripts"
+CONFIG_FILE = os.path.join(CONFIG_DIR, "agent.json")
+COLLECTORS = script.COLLECTORS + [
+    ("cifsfixer", "serverscripts.cifsfixer", "/etc/fstab"),
+]
+INTERVALS = {
+    # Seconds between the start of two runs of a collector.
+    "apache": 5 * 60,
+    "checkouts": 60 * 60,
+    "cifsfixer": 60,
+    "database": 5 * 60,
+    "docker": 5 * 60,
+    "geoserver": 24 * 60 * 60,
+    "haproxy": 5 * 60,
+    "nginx": 5 * 60,
+}
+DEFAULT_INTERVAL = 5 * 60
+
+
+logger = logging.getLogger(__name__)
+
+
+def load_config(config_file_path):
+    """Return {collector name: interval} from the optional config file
+
+    The config file looks like ``{"checkouts": 1800, "geoserver": 3600}``,
+    collectors that aren't mentioned keep their default interval.
+
+    """
+    intervals = dict(INTERVALS)
+    if not os.path.exists(config_file_path):
+        return intervals
+    with open(config_file_path, "r") as config_file:
+        try:
+            content = json.loads(config_file.read())
+        except:  # noqa: E722
+            logger.exception("Faulty config file %s", config_file_path)
+            return intervals
+    for name, interval in content.items():
+        if name not in intervals:
+            logger.error("Unknown collector %s in %s", name, config_file_path)
+            continue
+        intervals[name] = int(interval)
+    return intervals
+
+
+def run_schedule(
+    collectors, intervals, max_workers=script.MAX_WORKERS, timeouts=None, until=None
+):
+    """Run every collector on its own interval, return {name: number of runs}
+
+    A collector that is still running when it is due again is not started a
+    second time. A collector that isn't available (see
+    ``script.is_available()``) is checked again at its next interval. After
+    every finished run, collectors.fact is updated.
+
+    ``until`` is a timestamp at which to stop; normally we run forever.
+
+    """
+    if timeouts is None:
+        timeouts = script.TIMEOUTS
+    verbose = logger.getEffectiveLevel() <= logging.DEBUG
+    next_runs = {name: time.time() for name, module_name, probe_path in collectors}
+    num_runs = {name: 0 for name, module_name, probe_path in collectors}
+    running = {}  # {name: process}
+    collectors_info = {}
+    try:
+        while until is None or time.time() < until:
+            now = time.time()
+            for name, module_name, probe_path in collectors:
+                if name in running or next_runs[name] > now:
+                    continue
+                if len(running) >= max_workers:
+                    break
+                next_runs[name] = now + intervals.get(name, DEFAULT_INTERVAL)
+                if not script.is_available(probe_path):
+                    logger.debug("Skipping %s: %s doesn't exist", name, probe_path)
+                    continue
+                # Import it here to keep it loaded for the next runs.
+                importlib.import_module(module_name)
+                running[name] = script.start_collector(
+                    name, module_name, verbose=verbose
+                )
+                num_runs[name] += 1
+
+            moments = [until] if until else []
+            if len(running) < max_workers:
+                # Otherwise we first have to wait for a collector to finish.
+                moments += [
+                    next_runs[name]
+                    for name, module_name, probe_path in collectors
+                    if name not in running
+                ]
+            wake_up = min(moments) if moments else None
+            if not running:
+                time.sleep(max(0, wake_up - time.time()))
+                continue
+            finished = script.wait_for_collectors(running, timeouts, until=wake_up)
+            if finished:
+                collectors_info.update(finished)
+                script.write_collectors_info(collectors_info)
+    finally:
+        for process in running.values():
+            script.kill_collector(process)
+    return num_runs
+
+
+def _stop(signum, frame):
+    logger.info("Received signal %s, stopping", signum)
+    sys.exit()
+
+
+def main():
+    """Installed as bin/serverscripts-agent"""
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        default=False,
+        help="Verbose output",
+    )
+    parser.add_argument(
+        "-V",
+        "--version",
+        action="store_true",
+        dest="print_version",
+        default=False,
+        help="Print version",
+    )
+    parser.add_argument(
+        "-j",
+        "--max-workers",
+        type=int,
+        dest="max_workers",
+        default=script.MAX_WORKERS,
+        help="Number of collectors to run at the same time (default: %s)"
+        % script.MAX_WORKERS,
+    )
+    options = parser.parse_args()
+    if options.print_version:
+        print(serverscripts.__version__)
+        sys.exit()
+    if options.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.WARN
+    logging.basicConfig(level=loglevel, format="%(asctime)s %(levelname)s: %(message)s")
+
+    signal.signal(signal.SIGTERM, _stop)
+    intervals = load_config(CONFIG_FILE)
+    run_schedule(COLLECTORS, intervals, max_workers=max(1, options.max_workers))
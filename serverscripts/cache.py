@@ -0,0 +1,110 @@
+"""Reuse a collector's previous result when its input files didn't change.
+
+Most runs of apache-info, nginx-info, haproxy-info and geoserver-info parse
+configuration files that haven't changed since the previous run. A collector
+passes its input files to ``fingerprint()`` (which only stats them) and looks
+up the result from last time with ``lookup()``. Only on a miss does it parse
+the files, after which it calls ``store()``.
+
+The cache files are json files in ``/var/local/serverscripts/cache/``. The
+number of hits and misses ends up in ``utils.stats``, a hit doesn't write
+anything.
+
+Collectors can also keep other state between runs there, like how far they
+got in a logfile, with ``load_state()`` and ``save_state()``.
+
+"""
+from serverscripts import utils
+
+import json
+import logging
+import os
+
+
+CACHE_DIR = "/var/local/serverscripts/cache"
+
+# Set to False by the scripts' --no-cache option.
+enabled = True
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(filenames):
+    """Return a json-compatible fingerprint of the files
+
+    The fingerprint consists of the filename, modification time, size and
+    inode of every file. Missing files are included as such, so that a file
+    appearing later on changes the fingerprint.
+
+    """
+    result = []
+    for filename in sorted(filenames):
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            result.append([filename, None, None, None])
+            continue
+        result.append([filename, stat.st_mtime_ns, stat.st_size, stat.st_ino])
+    return result
+
+
+def _cache_file(name):
+    return os.path.join(CACHE_DIR, name + ".json")
+
+
+def _load(name):
+    try:
+        with open(_cache_file(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def lookup(name, inputs):
+    """Return the stored result if the inputs' fingerprint is unchanged
+
+    Returns None on a cache miss (or when caching is disabled).
+
+    """
+    if not enabled:
+        return None
+    content = _load(name)
+    if content and content.get("fingerprint") == inputs:
+        utils.increment("cache_hits")
+        logger.info("Cache hit for %s, inputs didn't change", name)
+        return content["result"]
+    utils.increment("cache_misses")
+    logger.info("Cache miss for %s", name)
+    return None
+
+
+def store(name, inputs, result):
+    """Store the result together with the fingerprint of the inputs"""
+    if not enabled:
+        return
+    content = {"fingerprint": inputs, "result": result}
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        utils.write_json(_cache_file(name), content, compact=True)
+    except OSError:
+        logger.warning("Cannot write cache file for %s", name)
+
+
+def load_state(name):
+    """Return the state saved by ``save_state()`` (or an empty dict)"""
+    if not enabled:
+        return {}
+    return _load(name)
+
+
+def save_state(name, content):
+    """Save a json-compatible dict for the next run"""
+    if not enabled:
+        return
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        utils.write_json(_cache_file(name), content, compact=True)
+    except OSError:
+        logger.warning("Cannot write state file for %s", name)
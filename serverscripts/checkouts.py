@@ -7,18 +7,37 @@ Originally copied from ``buildout.py`` in
 https://github.com/reinout/serverinfo/
 
 """
-from serverscripts.utils import get_output
+from serverscripts import cache
+from serverscripts.utils import CommandTimeout
+from serverscripts.utils import log_memory_statistics
+from serverscripts.utils import MAX_WORKERS
+from serverscripts.utils import remember
+from serverscripts.utils import remembered_run_command
+from serverscripts.utils import run_command
+from serverscripts.utils import run_concurrently
+from serverscripts.utils import write_file
+from serverscripts.utils import write_json
+from urllib.parse import unquote
+from urllib.parse import urlparse
 
 import argparse
+import base64
 import copy
+import functools
+import glob
+import hashlib
 import json
 import logging
 import os
-import pkg_resources
 import re
 import serverscripts
+import shlex
 import sys
 import tempfile
+import threading
+import time
+import zipfile
+import zlib
 
 
 # if the serverscripts python interpreter is in a virtualenv, ignore that
@@ -26,6 +45,7 @@ os.environ["PIPENV_IGNORE_VIRTUALENVS"] = "1"
 
 
 SRV_DIR = "/srv/"
+GIT_STATUS_MAX_AGE = 24 * 60 * 60  # Seconds, see _status_fingerprint().
 GIT_URL = re.compile(
     r"""
     origin            # We want the origin remote.
@@ -43,6 +63,22 @@ GIT_URL = re.compile(
     """,
     re.VERBOSE,
 )
+EGG_NAME = re.compile(
+    r"""
+    (?P<name>[^-]+)         # Project name.
+    (-(?P<version>[^-]+)    # Version.
+     (-py(?P<pyver>[^-]+)   # Python version.
+      (-(?P<platform>.+))?  # Platform.
+     )?
+    )?
+    """,
+    re.VERBOSE | re.IGNORECASE,
+)
+EGG_INDEX = "checkouts_eggs"  # Cache state, see egg_distribution().
+PIPENV_UNSAFE = re.compile(r'[ &$`!*@"()\[\]\\\r\n\t]')
+GIT_CONFIG_SECTION = re.compile(
+    r'^\[(?P<section>[^\s"\]]+)(\s+"(?P<subsection>.*)")?\]'
+)
 EDITABLE_PKG = re.compile(
     r"""
     -e                # editable
@@ -85,10 +121,192 @@ SUPERVISOR_CRONJOB_EXCEPTIONS = [
 
 
 logger = logging.getLogger(__name__)
+_sys_path_lock = threading.Lock()
+
+
+def _git_dir(directory):
+    """Return the git dir of the checkout, following a ``gitdir:`` file"""
+    git_dir = os.path.join(directory, ".git")
+    if os.path.isfile(git_dir):
+        with open(git_dir) as f:
+            content = f.read().strip()
+        if not content.startswith("gitdir:"):
+            raise ValueError("Unknown .git file in %s" % directory)
+        git_dir = os.path.join(directory, content[len("gitdir:") :].strip())
+    return git_dir
+
+
+def _common_dir(git_dir):
+    """Return the dir with the config and refs (different for a worktree)"""
+    commondir_file = os.path.join(git_dir, "commondir")
+    if not os.path.exists(commondir_file):
+        return git_dir
+    with open(commondir_file) as f:
+        return os.path.join(git_dir, f.read().strip())
+
+
+def read_git_config(config_file):
+    """Return [(section, subsection, key, value), ...] from a git config file
+
+    Only the simple ``[remote "origin"]`` + ``url = ...`` kind of lines are
+    understood, which is all we need.
+
+    """
+    result = []
+    section = subsection = None
+    with open(config_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] in "#;":
+                continue
+            match = GIT_CONFIG_SECTION.match(line)
+            if match:
+                section = match.group("section").lower()
+                subsection = match.group("subsection")
+                continue
+            key, _, value = line.partition("=")
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            result.append((section, subsection, key.strip().lower(), value))
+    return result
+
+
+def _remote_lines(config):
+    """Return the lines ``git remote -v`` would print"""
+    urls = {}
+    push_urls = {}
+    for section, remote, key, value in config:
+        if section != "remote":
+            continue
+        if key == "url":
+            urls.setdefault(remote, []).append(value)
+        elif key == "pushurl":
+            push_urls.setdefault(remote, []).append(value)
+    lines = []
+    for remote in urls:
+        lines += ["%s\t%s (fetch)" % (remote, url) for url in urls[remote][:1]]
+        lines += [
+            "%s\t%s (push)" % (remote, url)
+            for url in push_urls.get(remote, urls[remote])
+        ]
+    return lines
+
+
+def _packed_refs(common_dir):
+    """Return {ref: sha} and {ref: peeled sha} (for annotated tags)"""
+    refs = {}
+    peeled = {}
+    packed_refs_file = os.path.join(common_dir, "packed-refs")
+    if not os.path.exists(packed_refs_file):
+        return refs, peeled
+    ref = None
+    with open(packed_refs_file) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("^"):
+                peeled[ref] = line[1:]
+                continue
+            sha, ref = line.split(" ", 1)
+            refs[ref] = sha
+    return refs, peeled
+
+
+def _loose_tag_target(common_dir, sha):
+    """Return the commit an annotated tag object points at, None if it isn't one
+
+    Raises OSError if the object isn't there as loose object (but packed).
+
+    """
+    object_file = os.path.join(common_dir, "objects", sha[:2], sha[2:])
+    with open(object_file, "rb") as f:
+        content = zlib.decompress(f.read())
+    header, _, body = content.partition(b"\0")
+    if not header.startswith(b"tag "):
+        return None
+    first_line = body.split(b"\n", 1)[0].decode("ascii")
+    if not first_line.startswith("object "):
+        return None
+    return first_line[len("object ") :]
+
 
+def _annotated_tags_at(common_dir, commit):
+    """Return the annotated tags pointing at the commit
 
-def git_info(directory):
-    """Return git information (like remote repo) for the directory"""
+    Raises OSError when a tag can't be resolved without git itself.
+
+    """
+    refs, peeled = _packed_refs(common_dir)
+    tags = []
+    for ref, sha in refs.items():
+        if ref.startswith("refs/tags/") and peeled.get(ref) == commit:
+            tags.append(ref[len("refs/tags/") :])
+    tags_dir = os.path.join(common_dir, "refs", "tags")
+    for root, _, filenames in os.walk(tags_dir):
+        for filename in filenames:
+            tag_file = os.path.join(root, filename)
+            ref = os.path.relpath(tag_file, common_dir).replace(os.sep, "/")
+            with open(tag_file) as f:
+                sha = f.read().strip()
+            if sha == commit:
+                # A lightweight tag, ``git describe`` ignores those.
+                continue
+            if _loose_tag_target(common_dir, sha) == commit:
+                tags.append(ref[len("refs/tags/") :])
+    return tags
+
+
+def _resolve_ref(git_dir, common_dir, ref):
+    """Return the sha of a ref like ``refs/heads/master``"""
+    for base_dir in (git_dir, common_dir):
+        ref_file = os.path.join(base_dir, ref)
+        if os.path.isfile(ref_file):
+            with open(ref_file) as f:
+                return f.read().strip()
+    return _packed_refs(common_dir)[0].get(ref)
+
+
+def _read_release(directory):
+    """Return the release like ``git_info()`` determines it, without git
+
+    That's ``master`` or ``main`` when we're on such a branch and otherwise
+    the annotated tag of the current commit. Returns None when that needs git
+    itself (``git describe``), like when there's no tag on the commit.
+
+    """
+    git_dir = _git_dir(directory)
+    common_dir = _common_dir(git_dir)
+    with open(os.path.join(git_dir, "HEAD")) as f:
+        head = f.read().strip()
+    if head.startswith("ref:"):
+        ref = head[len("ref:") :].strip()
+        branch = ref[len("refs/heads/") :]
+        for release in ("master", "main"):
+            if release in branch.lower():
+                return release
+        commit = _resolve_ref(git_dir, common_dir, ref)
+    else:
+        commit = head
+    if not commit:
+        return None
+    tags = _annotated_tags_at(common_dir, commit)
+    if len(tags) == 1:
+        return tags[0]
+    return None
+
+
+def git_info(directory, status=True):
+    """Return git information (like remote repo) for the directory
+
+    The remote url and the release (branch or tag) are read from the ``.git``
+    dir directly. Only when that's not enough, ``git describe`` is called.
+    ``git status`` (which looks at every file in the checkout) only runs for
+    the ``has_local_modifications`` and ``has_untracked_files`` info, which
+    are None without ``status``.
+
+    """
     logger.debug("Looking in %s...", directory)
     data = {}
     dir_contents = os.listdir(directory)
@@ -96,8 +314,18 @@ def git_info(directory):
         logger.warning("No .git directory found in %s", directory)
         return
 
-    output, error = get_output("git remote -v", cwd=directory)
-    for line in output.split("\n"):
+    try:
+        config_file = os.path.join(_common_dir(_git_dir(directory)), "config")
+        lines = _remote_lines(read_git_config(config_file))
+    except (OSError, ValueError):
+        logger.debug("Couldn't read the git config, asking git itself")
+        try:
+            output, error = run_command(["git", "remote", "-v"], cwd=directory)
+        except CommandTimeout as e:
+            logger.warning("%s", e)
+            output = ""
+        lines = output.split("\n")
+    for line in lines:
         if not line:
             continue
         match = GIT_URL.search(line)
@@ -109,29 +337,98 @@ def git_info(directory):
             user=match.group("user"), project=match.group("project")
         )
         logger.debug("Git repo found: %s", data["url"])
-    output, error = get_output("git status", cwd=directory)
-    output = output.lower()
-    if "master" in output:
-        data["release"] = "master"
-        logger.debug("It is a master checkout")
-    elif "main" in output:
-        data["release"] = "main"
-        logger.debug("It is a 'main' checkout")
+
+    try:
+        data["release"] = _read_release(directory)
+    except (OSError, ValueError, UnicodeDecodeError, zlib.error):
+        logger.debug("Couldn't read the release from .git, asking git itself")
+        data["release"] = None
+    if data["release"] is None:
+        try:
+            output, error = run_command(["git", "describe"], cwd=directory)
+        except CommandTimeout as e:
+            logger.warning("%s", e)
+        else:
+            first_line = output.split("\n")[0]
+            data["release"] = first_line.strip()
+            logger.debug("We're on a tag or branch: %s", data["release"])
     else:
-        output, error = get_output("git describe", cwd=directory)
-        first_line = output.split("\n")[0]
-        data["release"] = first_line.strip()
-        logger.debug("We're on a tag or branch: %s", data["release"])
-    data["has_local_modifications"] = "changes not staged" in output
-    data["has_untracked_files"] = "untracked" in output
+        logger.debug("It is a '%s' checkout", data["release"])
+
+    data["has_local_modifications"] = None
+    data["has_untracked_files"] = None
+    if status:
+        data.update(git_status(directory))
     return data
 
 
+def _status_fingerprint(directory):
+    """Return fingerprint of what a ``git status`` result depends on
+
+    That's the index, HEAD and the refs plus the checkout itself and its
+    top-level files and directories: adding or removing something changes the
+    mtime of the directory it is in. Changes deeper in the work tree aren't
+    always noticed, so the fingerprint changes every ``GIT_STATUS_MAX_AGE``
+    seconds anyway.
+
+    """
+    git_dir = _git_dir(directory)
+    common_dir = _common_dir(git_dir)
+    filenames = [
+        os.path.join(git_dir, "index"),
+        os.path.join(git_dir, "HEAD"),
+        os.path.join(common_dir, "packed-refs"),
+        directory,
+    ]
+    for root, _, ref_files in os.walk(os.path.join(common_dir, "refs")):
+        filenames += [os.path.join(root, ref_file) for ref_file in ref_files]
+    filenames += [
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name != ".git"
+    ]
+    period = int(time.time() // GIT_STATUS_MAX_AGE)
+    return [period] + cache.fingerprint(filenames)
+
+
+def git_status(directory):
+    """Return has_local_modifications/has_untracked_files of a checkout
+
+    ``git status`` looks at every file in the checkout, so its result is
+    cached for as long as the checkout's fingerprint doesn't change. Most
+    checkouts are left alone for weeks. When it times out, both are None.
+
+    """
+    cache_name = "git_status_%s" % hashlib.md5(directory.encode()).hexdigest()[:8]
+    try:
+        inputs = _status_fingerprint(directory)
+    except (OSError, ValueError):
+        inputs = None
+    if inputs is not None:
+        result = cache.lookup(cache_name, inputs)
+        if result is not None:
+            return result
+
+    try:
+        output, error = run_command(["git", "status"], cwd=directory)
+    except CommandTimeout as e:
+        logger.warning("%s", e)
+        return {"has_local_modifications": None, "has_untracked_files": None}
+    output = output.lower()
+    result = {
+        "has_local_modifications": "changes not staged" in output,
+        "has_untracked_files": "untracked" in output,
+    }
+    if inputs is not None:
+        # git status can refresh the index, so look again.
+        cache.store(cache_name, _status_fingerprint(directory), result)
+    return result
+
+
 def eggs_info(directory):
     files_of_interest = ["django", "test", "python"]
     possible_egg_dirs = set()
     python_version = None
-    before = copy.copy(sys.path)
     bin_dir = os.path.join(directory, "bin")
     if not os.path.exists(bin_dir):
         return
@@ -159,13 +456,21 @@ def eggs_info(directory):
                     break
             new_contents.append(line)
         # This is very evil, but cool! Because of the __name__ != main the
-        # remainder of the script is not executed.
-        exec("".join(new_contents))
-        possible_egg_dirs.update(sys.path)
+        # remainder of the script is not executed. sys.path is global, so only
+        # one thread at a time may do this.
+        with _sys_path_lock:
+            before = copy.copy(sys.path)
+            try:
+                exec("".join(new_contents))
+                possible_egg_dirs.update(sys.path)
+            finally:
+                sys.path = before
         # Detect python executable
         first_line = lines[0].strip()
         python_executable = first_line.lstrip("#!")
-        output, error = get_output("%s --version" % python_executable, cwd=directory)
+        output, error = remembered_run_command(
+            shlex.split(python_executable) + ["--version"], cwd=directory
+        )
         try:
             total_output = output + error
             python_version = total_output.strip().split()[1]
@@ -174,24 +479,130 @@ def eggs_info(directory):
             python_version = "UNKNOWN"
         logger.debug("Python version used: %s", python_version)
 
-    # reset sys.path
-    sys.path = before
-
     eggs = {}
     for dir_ in possible_egg_dirs:
-        info = list(pkg_resources.find_distributions(dir_, only=True))
-        if len(info) == 0:
+        info = egg_distribution(dir_)
+        if info is None:
             continue
-        info = info[0]
-        eggs[info.project_name] = info.version
+        project_name, version = info
+        eggs[project_name] = version
     if "Python" in eggs:
         del eggs["Python"]  # This is the version we run with, it seems.
     eggs["python"] = python_version
     return eggs
 
 
+def _project_and_version(basename):
+    """Return (project, version or None) from an egg or egg-info name
+
+    ``zest.releaser-6.4-py2.7`` is ("zest.releaser", "6.4") and
+    ``requests_toolbelt-0.5.1-py2.7`` is ("requests-toolbelt", "0.5.1"),
+    just like pkg_resources names them.
+
+    """
+    match = EGG_NAME.match(basename)
+    project_name = re.sub(r"[^A-Za-z0-9.]+", "-", match.group("name"))
+    return project_name, match.group("version")
+
+
+def _read_distribution(path):
+    """Return (project, version) of the first distribution at a sys.path entry
+
+    Like ``pkg_resources.find_distributions(path, only=True)``, without
+    importing the slow pkg_resources: an egg (dir or zipfile) is named after
+    its filename, for a directory (like a develop checkout) it's the
+    alphabetically first ``*.egg-info`` or ``*.dist-info`` in it. Older
+    setuptools versions sort those by version instead, which only matters for
+    a directory with more than one of them, like site-packages.
+
+    """
+    basename = os.path.basename(path)
+    if basename.lower().endswith(".egg"):
+        if os.path.isfile(path):
+            try:
+                with zipfile.ZipFile(path) as egg:
+                    egg.getinfo("EGG-INFO/PKG-INFO")
+            except (OSError, KeyError, zipfile.BadZipFile):
+                return None
+            return _project_and_version(basename[: -len(".egg")])
+        if os.path.isfile(os.path.join(path, "EGG-INFO", "PKG-INFO")):
+            return _project_and_version(basename[: -len(".egg")])
+    if not os.path.isdir(path):
+        return None
+    for entry in sorted(os.listdir(path)):
+        full_path = os.path.join(path, entry)
+        name, extension = os.path.splitext(entry)
+        if extension.lower() == ".egg-info":
+            metadata_file = os.path.join(full_path, "PKG-INFO")
+            if not os.path.isdir(full_path):
+                metadata_file = full_path
+        elif extension.lower() == ".dist-info" and os.path.isdir(full_path):
+            metadata_file = os.path.join(full_path, "METADATA")
+        else:
+            continue
+        if os.path.isdir(full_path) and not os.listdir(full_path):
+            continue
+        project_name, version = _project_and_version(name)
+        if version is None:
+            try:
+                version = _read_metadata(metadata_file)[1]
+            except OSError:
+                pass
+        return project_name, version
+    return None
+
+
+def _egg_index():
+    """Return the eggs of the previous run and an empty dict for this run
+
+    Both are {egg path: [mtime, project, version]}. See egg_distribution().
+
+    """
+    previous = cache.load_state(EGG_INDEX).get("eggs", {})
+    return previous, {}
+
+
+def egg_distribution(path):
+    """Return (project, version) of the first distribution at a sys.path entry
+
+    Buildouts share their eggs dir, so every path is only read once per run.
+    An egg never changes once it is installed, so eggs are also looked up in
+    the index of the previous run, keyed on their mtime. See
+    save_egg_index().
+
+    """
+    path = os.path.abspath(path)
+    if not path.lower().endswith(".egg"):
+        return remember(("distribution", path), _read_distribution, path)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    previous, current = remember(("egg index",), _egg_index)
+    known = current.get(path) or previous.get(path)
+    if known is None or known[0] != mtime:
+        result = _read_distribution(path)
+        known = [mtime] + list(result or [None, None])
+    current[path] = known
+    if known[1] is None:
+        return None
+    return known[1], known[2]
+
+
+def save_egg_index():
+    """Save the eggs looked up in this run for the next one"""
+    previous, current = remember(("egg index",), _egg_index)
+    if current != previous:
+        cache.save_state(EGG_INDEX, {"eggs": current})
+
+
 def whereis(name):
     """Find the first available path to an executable script."""
+    # We look for the same ones for every checkout.
+    return remember(("whereis", name, os.environ.get("PATH")), _whereis, name)
+
+
+def _whereis(name):
     paths = os.environ.get("PATH").split(":")
     for path in paths:
         executable = os.path.join(path, name)
@@ -227,20 +638,287 @@ def parse_freeze(output):
     return pkgs
 
 
+def _read_metadata(metadata_file):
+    """Return (name, version) from the headers of a METADATA or PKG-INFO file"""
+    name = version = None
+    with open(metadata_file, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                # The end of the headers, the description follows.
+                break
+            key, _, value = line.partition(":")
+            if key == "Name":
+                name = value.strip()
+            elif key == "Version":
+                version = value.strip()
+    return name, version
+
+
+def _editable_source(direct_url_file):
+    """Return the source dir of an editable install (PEP 610), if it is one"""
+    try:
+        with open(direct_url_file) as f:
+            direct_url = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not direct_url.get("dir_info", {}).get("editable"):
+        return None
+    url = direct_url.get("url", "")
+    if not url.startswith("file://"):
+        return None
+    return unquote(urlparse(url).path)
+
+
+def _editable_line(source_dir, name):
+    """Return the ``-e git+URL@COMMIT#egg=NAME`` line pip freeze would print
+
+    pip looks up the git checkout the source dir is in and takes the url of
+    its origin remote (or else the first one). Returns None when the source
+    isn't in a git checkout with a remote.
+
+    """
+    directory = os.path.abspath(source_dir)
+    while not os.path.exists(os.path.join(directory, ".git")):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    try:
+        git_dir = _git_dir(directory)
+        common_dir = _common_dir(git_dir)
+        config = read_git_config(os.path.join(common_dir, "config"))
+        with open(os.path.join(git_dir, "HEAD")) as f:
+            head = f.read().strip()
+        if head.startswith("ref:"):
+            head = _resolve_ref(git_dir, common_dir, head[len("ref:") :].strip())
+    except (OSError, ValueError):
+        return None
+    urls = {}
+    for section, remote, key, value in config:
+        if section == "remote" and key == "url":
+            urls.setdefault(remote, value)
+    if not urls or not head:
+        return None
+    url = urls.get("origin") or list(urls.values())[0]
+    return "-e git+%s@%s#egg=%s" % (url, head, name)
+
+
+def freeze_from_metadata(site_packages_dirs):
+    """Return what ``pip freeze --all`` prints, from the installed metadata
+
+    The ``*.dist-info`` and ``*.egg-info`` dirs in site-packages have the name
+    and version of every installed distribution, so there's no need to start
+    python and pip. Editable installs (``direct_url.json`` or an old
+    ``*.egg-link``) in a git checkout get a ``-e`` line.
+
+    """
+    lines = []
+    for site_packages in site_packages_dirs:
+        for entry in sorted(os.listdir(site_packages)):
+            path = os.path.join(site_packages, entry)
+            source_dir = None
+            if entry.endswith(".dist-info"):
+                metadata_file = os.path.join(path, "METADATA")
+                source_dir = _editable_source(os.path.join(path, "direct_url.json"))
+            elif entry.endswith(".egg-info"):
+                metadata_file = path
+                if os.path.isdir(path):
+                    metadata_file = os.path.join(path, "PKG-INFO")
+            elif entry.endswith(".egg-link"):
+                with open(path) as f:
+                    source_dir = f.readline().strip()
+                egg_infos = glob.glob(os.path.join(source_dir, "*.egg-info"))
+                egg_infos += glob.glob(os.path.join(source_dir, "*", "*.egg-info"))
+                if not egg_infos:
+                    continue
+                metadata_file = os.path.join(egg_infos[0], "PKG-INFO")
+            else:
+                continue
+            try:
+                name, version = _read_metadata(metadata_file)
+            except OSError:
+                continue
+            if not name or not version:
+                continue
+            line = None
+            if source_dir:
+                line = _editable_line(source_dir, name)
+            lines.append(line or "%s==%s" % (name, version))
+    return "\n".join(lines)
+
+
+def site_packages_dirs(venv_dir):
+    """Return the site-packages dirs of a virtualenv"""
+    found = glob.glob(os.path.join(venv_dir, "lib*", "python*", "site-packages"))
+    result = []
+    for site_packages in sorted(found):
+        # lib64 is often a symlink to lib.
+        if os.path.realpath(site_packages) not in map(os.path.realpath, result):
+            result.append(site_packages)
+    return result
+
+
+def pyvenv_python_version(venv_dir):
+    """Return the python version from the virtualenv's pyvenv.cfg (or None)
+
+    ``python -m venv`` writes ``version = 3.8.10``, virtualenv writes
+    ``version_info = 3.8.10.final.0``.
+
+    """
+    try:
+        with open(os.path.join(venv_dir, "pyvenv.cfg")) as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    values = {}
+    for line in lines:
+        key, _, value = line.partition("=")
+        values[key.strip()] = value.strip()
+    version = values.get("version") or values.get("version_info")
+    if not version:
+        return None
+    return ".".join(version.split(".")[:3])
+
+
+def packages_in_venv(venv_dir):
+    """Return parse_freeze()-like dict plus "python" of a virtualenv
+
+    Returns None if it doesn't look like a virtualenv.
+
+    """
+    site_packages = site_packages_dirs(venv_dir)
+    python_version = pyvenv_python_version(venv_dir)
+    if not site_packages or not python_version:
+        return None
+    logger.debug("Reading the package metadata in %s", ", ".join(site_packages))
+    pkgs = parse_freeze(freeze_from_metadata(site_packages))
+    pkgs["python"] = python_version
+    return pkgs
+
+
+def _workon_home():
+    """Return the dir where pipenv puts its virtualenvs"""
+    workon_home = os.environ.get("WORKON_HOME")
+    if not workon_home:
+        data_home = os.environ.get("XDG_DATA_HOME", "~/.local/share")
+        workon_home = os.path.join(data_home, "virtualenvs")
+    return os.path.abspath(os.path.expanduser(os.path.expandvars(workon_home)))
+
+
+def pipenv_venv_name(directory):
+    """Return the name pipenv gives the virtualenv of the project
+
+    The project's dir name with "dangerous" characters replaced, plus a hash
+    of the Pipfile's path: ``/srv/my-project`` gets ``my-project-wyUfYPqE``.
+
+    """
+    custom_name = os.environ.get("PIPENV_CUSTOM_VENV_NAME")
+    if custom_name:
+        return custom_name
+    name = PIPENV_UNSAFE.sub("_", os.path.basename(directory))[:42]
+    pipfile = os.path.join(directory, "Pipfile")
+    digest = hashlib.sha256(pipfile.encode()).digest()[:6]
+    return name + "-" + base64.urlsafe_b64encode(digest).decode()[:8]
+
+
+def pipenv_venv(directory):
+    """Return the virtualenv dir of a pipenv project, found like pipenv does
+
+    That's ``.venv`` in the project (``PIPENV_VENV_IN_PROJECT``) or a dir in
+    ``~/.local/share/virtualenvs/`` (``WORKON_HOME``). A ``.venv`` file
+    contains the name or path of the virtualenv. Returns None if the
+    virtualenv doesn't exist.
+
+    """
+    directory = os.path.abspath(directory)
+    dot_venv = os.path.join(directory, ".venv")
+    in_project = os.environ.get("PIPENV_VENV_IN_PROJECT", "").lower()
+    default = os.path.join(_workon_home(), pipenv_venv_name(directory))
+    if os.path.isfile(dot_venv):
+        with open(dot_venv) as f:
+            name = f.read().strip()
+        if not name:
+            venv_dir = default
+        elif os.sep in name:
+            venv_dir = os.path.join(directory, name)
+        else:
+            venv_dir = os.path.join(_workon_home(), name)
+    elif in_project in ("1", "true", "yes", "on"):
+        venv_dir = dot_venv
+    elif os.path.isdir(dot_venv) and in_project not in ("0", "false", "no", "off"):
+        # An existing virtualenv in WORKON_HOME wins from an unrelated .venv.
+        venv_dir = default if os.path.isdir(default) else dot_venv
+    else:
+        venv_dir = default
+    if not os.path.isdir(venv_dir):
+        logger.debug("Pipenv virtualenv %s doesn't exist", venv_dir)
+        return None
+    return venv_dir
+
+
+def _canonical_name(name):
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def lockfile_drift(directory, pkgs):
+    """Return the packages whose installed version differs from Pipfile.lock
+
+    The result is {package: {"locked": version, "installed": version or
+    None}}, for the pinned (``==``) default packages of the lockfile. None
+    if there's no (readable) Pipfile.lock.
+
+    """
+    try:
+        with open(os.path.join(directory, "Pipfile.lock")) as f:
+            lock = json.load(f)
+    except (OSError, ValueError):
+        return None
+    installed = {
+        _canonical_name(name): version
+        for name, version in pkgs.items()
+        if not name.startswith("-e ") and name != "python"
+    }
+    drift = {}
+    for name, info in sorted(lock.get("default", {}).items()):
+        version = info.get("version", "")
+        if not version.startswith("=="):
+            # A git or path dependency.
+            continue
+        locked = version[2:]
+        actual = installed.get(_canonical_name(name))
+        if actual != locked:
+            drift[name] = {"locked": locked, "installed": actual}
+    return drift
+
+
 def pipenv_info(directory):
     directory = os.path.abspath(directory)
+    if not os.path.exists(os.path.join(directory, "Pipfile")):
+        logger.error("No pipenv found in %s", directory)
+        return
+    venv_dir = pipenv_venv(directory)
+    if venv_dir:
+        pkgs = packages_in_venv(venv_dir)
+        if pkgs is not None:
+            return pkgs
+
+    logger.debug("Asking pipenv itself about %s", directory)
     # run pipenv using the serverscripts' interpreter
-    pipenv = sys.executable + " -m pipenv"
-    output, error = get_output(pipenv + " --where", cwd=directory)
+    pipenv = [sys.executable, "-m", "pipenv"]
+    output, error = run_command(
+        pipenv + ["--where"], cwd=directory, fail_on_exit_code=False
+    )
 
     if output.strip() != directory:
         logger.error("No pipenv found in %s", directory)
         return
 
-    output, error = get_output(pipenv + " run pip freeze --all", cwd=directory)
+    output, error = run_command(
+        pipenv + ["run", "pip", "freeze", "--all"], cwd=directory
+    )
     pkgs = parse_freeze(output)
 
-    output, error = get_output(pipenv + " run python --version", cwd=directory)
+    output, error = run_command(pipenv + ["run", "python", "--version"], cwd=directory)
     pkgs["python"] = parse_python_version(output, error)
     return pkgs
 
@@ -248,26 +926,30 @@ def pipenv_info(directory):
 def venv_info(bin_dir):
     if bin_dir[-1] != "/":
         bin_dir += "/"
+    pkgs = packages_in_venv(os.path.dirname(os.path.dirname(bin_dir)))
+    if pkgs is not None:
+        return pkgs
 
-    output, error = get_output(bin_dir + "pip freeze --all")
+    output, error = run_command([bin_dir + "pip", "freeze", "--all"])
     pkgs = parse_freeze(output)
 
-    output, error = get_output(bin_dir + "python --version")
+    output, error = remembered_run_command([bin_dir + "python", "--version"])
     pkgs["python"] = parse_python_version(output, error)
     return pkgs
 
 
-def django_info_buildout(bin_django):
-    matplotlibenv = "MPLCONFIGDIR=/tmp"
-    # ^^^ Corner case when something needs matplotlib in django's settings.
-    target_user_id = os.stat(bin_django).st_uid
-    command = "sudo -u \\#%s %s %s diffsettings" % (
-        target_user_id,
-        matplotlibenv,
-        bin_django,
-    )
-    logger.debug("Running %s diffsettings...", bin_django)
-    output, error = get_output(command)
+def _diffsettings(django_script, owner_of, cwd="."):
+    """Return output of django's diffsettings, run as the owner of the file"""
+    target_user_id = os.stat(owner_of).st_uid
+    command = [
+        "sudo",
+        "-u",
+        "#%s" % target_user_id,
+        # Corner case when something needs matplotlib in django's settings.
+        "MPLCONFIGDIR=/tmp",
+    ]
+    command += django_script + ["diffsettings"]
+    output, error = run_command(command, cwd=cwd, fail_on_exit_code=False)
     if error:
         logger.warning("Error output from diffsettings command: %s", error)
         if not output:
@@ -275,51 +957,27 @@ def django_info_buildout(bin_django):
     return parse_django_info(output)
 
 
+def django_info_buildout(bin_django):
+    logger.debug("Running %s diffsettings...", bin_django)
+    return _diffsettings([bin_django], bin_django)
+
+
 def django_info_pipenv(directory):
-    original_dir = os.getcwd()
-    os.chdir(directory)
-    matplotlibenv = "MPLCONFIGDIR=/tmp"
-    # ^^^ Corner case when something needs matplotlib in django's settings.
-    target_user_id = os.stat("manage.py").st_uid
-    django_script = "pipenv run python manage.py"
-
-    command = "sudo -u \\#%s %s %s diffsettings" % (
-        target_user_id,
-        matplotlibenv,
-        django_script,
+    return _diffsettings(
+        ["pipenv", "run", "python", "manage.py"],
+        os.path.join(directory, "manage.py"),
+        cwd=directory,
     )
-    output, error = get_output(command, cwd=directory, fail_on_exit_code=False)
-    os.chdir(original_dir)
-    if error:
-        logger.warning("Error output from diffsettings command: %s", error)
-        if not output:
-            return
-    return parse_django_info(output)
 
 
 def django_info_venv(directory, bin_dir):
     if bin_dir[-1] != "/":
         bin_dir += "/"
-
-    original_dir = os.getcwd()
-    os.chdir(directory)
-    matplotlibenv = "MPLCONFIGDIR=/tmp"
-    # ^^^ Corner case when something needs matplotlib in django's settings.
-    target_user_id = os.stat("manage.py").st_uid
-    django_script = bin_dir + "python manage.py"
-
-    command = "sudo -u \\#%s %s %s diffsettings" % (
-        target_user_id,
-        matplotlibenv,
-        django_script,
+    return _diffsettings(
+        [bin_dir + "python", "manage.py"],
+        os.path.join(directory, "manage.py"),
+        cwd=directory,
     )
-    output, error = get_output(command, cwd=directory, fail_on_exit_code=False)
-    os.chdir(original_dir)
-    if error:
-        logger.warning("Error output from diffsettings command: %s", error)
-        if not output:
-            return
-    return parse_django_info(output)
 
 
 def parse_django_info(output):
@@ -365,10 +1023,14 @@ def parse_django_info(output):
 
 
 def supervisorctl_warnings(supervisorctl_command):
-    """Return number of not-running processes inside supervisorctl"""
-    command = "%s status" % supervisorctl_command
-    logger.debug("Running '%s'...", command)
-    output, error = get_output(command)
+    """Return number of not-running processes inside supervisorctl
+
+    ``supervisorctl_command`` is a list like ``["bin/supervisorctl"]``.
+
+    """
+    command = supervisorctl_command + ["status"]
+    logger.debug("Running '%s'...", " ".join(command))
+    output, error = run_command(command)
     if error:
         logger.warning("Error output from supervisorctl command: %s", error)
 
@@ -385,6 +1047,123 @@ def supervisorctl_warnings(supervisorctl_command):
     return num_not_running
 
 
+def _unless_timed_out(function, *args):
+    """Return function(*args), or None when one of its commands timed out
+
+    The other checkouts still get their info, see ``run_concurrently()``.
+
+    """
+    try:
+        return function(*args)
+    except CommandTimeout as e:
+        logger.warning("%s", e)
+        return None
+
+
+def checkout_info(name, git_status=True):
+    """Return (info, bin/django failures, not running processes) of a checkout"""
+    directory = os.path.join(SRV_DIR, name)
+    num_bin_django_failures = 0
+    num_not_running = 0
+    checkout = {}
+    checkout["name"] = name
+    checkout["directory"] = directory
+    checkout["git"] = git_info(directory, status=git_status)
+
+    # determine the type of installation (buildout or pipenv)
+    if os.path.exists(os.path.join(directory, "Pipfile")) and whereis("pipenv"):
+        mode = "pipenv"
+    elif os.path.exists(os.path.join(directory, "buildout.cfg")):
+        mode = "buildout"
+    elif os.path.isfile(os.path.join(directory, ".venv/pyvenv.cfg")):
+        mode = "virtualenv"
+        bin_dir = os.path.abspath(os.path.join(directory, ".venv/bin"))
+    elif os.path.isfile(os.path.join(directory, "pyvenv.cfg")):
+        mode = "virtualenv"
+        bin_dir = os.path.abspath(os.path.join(directory, "bin"))
+    else:
+        mode = None
+        logger.warning("/srv directory without buildout.cfg or Pipfile: %s", directory)
+
+    # determine the installed packages
+    if mode == "buildout":
+        checkout["eggs"] = _unless_timed_out(eggs_info, directory)
+    elif mode == "pipenv":
+        checkout["eggs"] = _unless_timed_out(pipenv_info, directory)
+        if checkout["eggs"]:
+            checkout["lockfile_drift"] = lockfile_drift(directory, checkout["eggs"])
+    elif mode == "virtualenv":
+        checkout["eggs"] = _unless_timed_out(venv_info, bin_dir)
+    else:
+        checkout["eggs"] = None
+
+    # determine django info settings
+    if mode == "buildout":
+        bin_django = os.path.join(directory, "bin", "django")
+        if os.path.exists(bin_django):
+            checkout["django"] = django_info_buildout(bin_django)
+            if not checkout["django"]:
+                num_bin_django_failures += 1
+        else:
+            logger.debug("bin/django not found in %s", directory)
+    elif mode == "pipenv":
+        django_manage = os.path.join(directory, "manage.py")
+        if os.path.exists(django_manage):
+            checkout["django"] = django_info_pipenv(directory)
+            if not checkout["django"]:
+                num_bin_django_failures += 1
+        else:
+            logger.debug("manage.py not found in %s", directory)
+    elif mode == "virtualenv":
+        django_manage = os.path.join(directory, "manage.py")
+        if os.path.exists(django_manage):
+            checkout["django"] = django_info_venv(directory, bin_dir)
+            if not checkout["django"]:
+                num_bin_django_failures += 1
+        else:
+            logger.debug("manage.py not found in %s", directory)
+
+    # determine supervisorctl status
+    if mode == "buildout":
+        bin_supervisor = os.path.join(directory, "bin", "supervisorctl")
+        if os.path.exists(bin_supervisor):
+            try:
+                num_not_running += supervisorctl_warnings([bin_supervisor])
+            except Exception:  # Bare except.
+                logger.exception("Error calling %s", bin_supervisor)
+        else:
+            logger.debug("bin/supervisorctl not found in %s", directory)
+    elif mode in {"pipenv", "virtualenv"} and whereis("supervisorctl"):
+        # expect the supervisor conf file in the etc directory
+        etc_directory = os.path.join(directory, "etc")
+        if os.path.exists(etc_directory):
+            confs = [
+                fn
+                for fn in os.listdir(etc_directory)
+                if "supervisor" in fn and fn.endswith(".conf")
+            ]
+            if len(confs) == 1:
+                svc_command = [
+                    "supervisorctl",
+                    "-c",
+                    os.path.join(etc_directory, confs[0]),
+                ]
+                try:
+                    num_not_running += supervisorctl_warnings(svc_command)
+                except Exception:  # Bare except.
+                    logger.exception("Error calling %s", " ".join(svc_command))
+            elif len(confs) == 0:
+                logger.exception(
+                    "No supervisorctl configuration found in %s", etc_directory
+                )
+            else:
+                logger.exception(
+                    "Multiple supervisorctl configurations found in %s",
+                    etc_directory,
+                )
+    return checkout, num_bin_django_failures, num_not_running
+
+
 def main():
     """Installed as bin/checkout-info"""
     parser = argparse.ArgumentParser()
@@ -404,6 +1183,32 @@ def main():
         default=False,
         help="Print version",
     )
+    parser.add_argument(
+        "-j",
+        "--max-workers",
+        type=int,
+        dest="max_workers",
+        default=MAX_WORKERS,
+        help="Number of checkouts to look at at the same time (default: %s)"
+        % MAX_WORKERS,
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="use_cache",
+        default=True,
+        help="Always run 'git status', don't reuse the result of unchanged checkouts",
+    )
+    parser.add_argument(
+        "--no-git-status",
+        action="store_false",
+        dest="git_status",
+        default=True,
+        help=(
+            "Don't run 'git status' (slow on big checkouts): "
+            "has_local_modifications and has_untracked_files are left empty"
+        ),
+    )
     options = parser.parse_args()
     if options.print_version:
         print(serverscripts.__version__)
@@ -413,14 +1218,14 @@ def main():
     else:
         loglevel = logging.WARN
     logging.basicConfig(level=loglevel, format="%(levelname)s: %(message)s")
+    if not options.use_cache:
+        cache.enabled = False
 
-    result = {}
-    num_bin_django_failures = 0
-    num_not_running = 0
     if not os.path.exists(OUTPUT_DIR):
         os.mkdir(OUTPUT_DIR)
         logger.info("Created %s", OUTPUT_DIR)
-    for name in os.listdir(SRV_DIR):
+    names = []
+    for name in sorted(os.listdir(SRV_DIR)):
         directory = os.path.join(SRV_DIR, name)
         if os.path.islink(directory):
             logger.info("Ignoring %s, it is a symlink", directory)
@@ -431,104 +1236,26 @@ def main():
         if name == "lost+found":
             logger.info("Ignoring /srv/lost+found dir")
             continue
-        checkout = {}
-        checkout["name"] = name
-        checkout["directory"] = directory
-        checkout["git"] = git_info(directory)
-
-        # determine the type of installation (buildout or pipenv)
-        if os.path.exists(os.path.join(directory, "Pipfile")) and whereis("pipenv"):
-            mode = "pipenv"
-        elif os.path.exists(os.path.join(directory, "buildout.cfg")):
-            mode = "buildout"
-        elif os.path.isfile(os.path.join(directory, ".venv/pyvenv.cfg")):
-            mode = "virtualenv"
-            bin_dir = os.path.abspath(os.path.join(directory, ".venv/bin"))
-        elif os.path.isfile(os.path.join(directory, "pyvenv.cfg")):
-            mode = "virtualenv"
-            bin_dir = os.path.abspath(os.path.join(directory, "bin"))
-        else:
-            mode = None
-            logger.warning(
-                "/srv directory without buildout.cfg or Pipfile: %s", directory
-            )
+        names.append(name)
 
-        # determine the installed packages
-        if mode == "buildout":
-            checkout["eggs"] = eggs_info(directory)
-        elif mode == "pipenv":
-            checkout["eggs"] = pipenv_info(directory)
-        elif mode == "virtualenv":
-            checkout["eggs"] = venv_info(bin_dir)
-        else:
-            checkout["eggs"] = None
-
-        # determine django info settings
-        if mode == "buildout":
-            bin_django = os.path.join(directory, "bin", "django")
-            if os.path.exists(bin_django):
-                checkout["django"] = django_info_buildout(bin_django)
-                if not checkout["django"]:
-                    num_bin_django_failures += 1
-            else:
-                logger.debug("bin/django not found in %s", directory)
-        elif mode == "pipenv":
-            django_manage = os.path.join(directory, "manage.py")
-            if os.path.exists(django_manage):
-                checkout["django"] = django_info_pipenv(directory)
-                if not checkout["django"]:
-                    num_bin_django_failures += 1
-            else:
-                logger.debug("manage.py not found in %s", directory)
-        elif mode == "virtualenv":
-            django_manage = os.path.join(directory, "manage.py")
-            if os.path.exists(django_manage):
-                checkout["django"] = django_info_venv(directory, bin_dir)
-                if not checkout["django"]:
-                    num_bin_django_failures += 1
-            else:
-                logger.debug("manage.py not found in %s", directory)
-
-        # determine supervisorctl status
-        if mode == "buildout":
-            bin_supervisor = os.path.join(directory, "bin", "supervisorctl")
-            if os.path.exists(bin_supervisor):
-                try:
-                    num_not_running += supervisorctl_warnings(bin_supervisor)
-                except Exception:  # Bare except.
-                    logger.exception("Error calling %s", bin_supervisor)
-            else:
-                logger.debug("bin/supervisorctl not found in %s", directory)
-        elif mode in {"pipenv", "virtualenv"} and whereis("supervisorctl"):
-            # expect the supervisor conf file in the etc directory
-            etc_directory = os.path.join(directory, "etc")
-            if os.path.exists(etc_directory):
-                confs = [
-                    fn
-                    for fn in os.listdir(etc_directory)
-                    if "supervisor" in fn and fn.endswith(".conf")
-                ]
-                if len(confs) == 1:
-                    svc_command = "supervisorctl -c '{0}'".format(
-                        os.path.join(etc_directory, confs[0])
-                    )
-                    try:
-                        num_not_running += supervisorctl_warnings(svc_command)
-                    except Exception:  # Bare except.
-                        logger.exception("Error calling %s", svc_command)
-                elif len(confs) == 0:
-                    logger.exception(
-                        "No supervisorctl configuration found in %s", etc_directory
-                    )
-                else:
-                    logger.exception(
-                        "Multiple supervisorctl configurations found in %s",
-                        etc_directory,
-                    )
+    # The checkouts are independent: look at several at the same time.
+    infos = run_concurrently(
+        functools.partial(checkout_info, git_status=options.git_status),
+        names,
+        max_workers=options.max_workers,
+    )
+    result = {}
+    num_bin_django_failures = 0
+    num_not_running = 0
+    for name, (checkout, django_failures, not_running) in zip(names, infos):
         result[name] = checkout
+        num_bin_django_failures += django_failures
+        num_not_running += not_running
 
-    open(OUTPUT_FILE, "w").write(json.dumps(result, sort_keys=True, indent=4))
+    save_egg_index()
+    log_memory_statistics()
+    write_json(OUTPUT_FILE, result, compact=True)
     zabbix_file = os.path.join(VAR_DIR, "nens.bin_django_failures.errors")
-    open(zabbix_file, "w").write(str(num_bin_django_failures))
+    write_file(zabbix_file, str(num_bin_django_failures))
     zabbix_file2 = os.path.join(VAR_DIR, "nens.num_not_running.warnings")
-    open(zabbix_file2, "w").write(str(num_not_running))
+    write_file(zabbix_file2, str(num_not_running))
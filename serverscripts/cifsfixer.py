@@ -12,9 +12,10 @@ Goal copy/pasted from trac (https://office.lizard.net/trac/ticket/4272)::
 
 """
 from logging.handlers import RotatingFileHandler
+from serverscripts.utils import write_file
+from serverscripts.utils import write_json
 
 import argparse
-import json
 import logging
 import os
 import re
@@ -300,15 +301,15 @@ def main():
 
     # Write to files that will be read by zabbix.
     warningsfile = os.path.join(VAR_DIR, "nens.cifschecker.warnings")
-    open(warningsfile, "w").write(str(num_warnings))
+    write_file(warningsfile, str(num_warnings))
     errorsfile = os.path.join(VAR_DIR, "nens.cifschecker.errors")
-    open(errorsfile, "w").write(str(num_errors))
+    write_file(errorsfile, str(num_errors))
 
     # Write facts for serverinfo.
     if not os.path.exists(OUTPUT_DIR):
         os.mkdir(OUTPUT_DIR)
         logger.info("Created %s", OUTPUT_DIR)
-    open(OUTPUT_FILE, "w").write(json.dumps(fstab_mounts, sort_keys=True, indent=4))
+    write_json(OUTPUT_FILE, fstab_mounts)
 
     if num_errors == 0:
         logger.info("Everything OK with the mounts: %s", ", ".join(fstab_mounts.keys()))
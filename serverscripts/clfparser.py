@@ -1,52 +1,85 @@
-# Copied from the __init__.py of the pypi clfparser project
+# Originally copied from the __init__.py of the pypi clfparser project
 
 from datetime import datetime
 
 import re
 
 
-class CLFParser:
-    "Represents a single Apache common log format record"
+# "%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\""
+# Combined log format: the common log format plus referer and user agent. One
+# pattern recognizes both. The fields keep their surrounding quotes/brackets.
+LOG_LINE = re.compile(
+    r"(?P<h>[^ ]*) (?P<l>[^ ]*) (?P<u>[^ ]*) (?P<t>\[[^]]*\]) (?P<r>\"[^\"]*\") "
+    r"(?P<s>[^ ]*) (?P<b>[^ ]*)"
+    r"(?: (?P<Referer>\"[^\"]*\") (?P<Useragent>\"[^\"]*\"))?"
+)
+FIELDS = ("h", "l", "u", "t", "r", "s", "b", "Referer", "Useragent")
+
+
+class LogRecord:
+    """One parsed log line
+
+    The fields are available as attributes and, like the original dict, as
+    items: ``record.r`` or ``record["r"]``. ``time`` (a datetime) is only
+    parsed when you ask for it, as that is by far the most expensive part.
+
+    """
+
+    __slots__ = FIELDS
+
+    def __init__(self, h="", l="", u="", t="", r="", s="", b="", referer="", ua=""):
+        self.h = h
+        self.l = l  # noqa: E741
+        self.u = u
+        self.t = t
+        self.r = r
+        self.s = s
+        self.b = b
+        self.Referer = referer
+        self.Useragent = ua
 
-    # "%h %l %u %t \"%r\" %>s %b \"%{Referer}i\" \"%{User-agent}i\""
+    @property
+    def time(self):
+        if not self.t:
+            return ""
+        return datetime.strptime(self.t[1:21], "%d/%b/%Y:%H:%M:%S")
 
-    commonLogFormat = r'(?P<h>([^ ]*)) (?P<l>([^ ]*)) (?P<u>([^ ]*)) (?P<t>\[([^]]*)\]) (?P<r>"([^"]*)") (?P<s>([^ ]*)) (?P<b>([^ ]*))'
-    combinedLogFormat = r'(?P<h>([^ ]*)) (?P<l>([^ ]*)) (?P<u>([^ ]*)) (?P<t>\[([^]]*)\]) (?P<r>"([^"]*)") (?P<s>([^ ]*)) (?P<b>([^ ]*)) (?P<Referer>"([^"]*)") (?P<Useragent>"([^"]*)")'
+    @property
+    def timezone(self):
+        return self.t[22:27]
 
-    nullRec = {
-        "h": "",
-        "l": "",
-        "u": "",
-        "t": "",
-        "r": "",
-        "s": "",
-        "b": "",
-        "Referer": "",
-        "Useragent": "",
-        "time": "",
-        "timezone": "",
-    }
+    def __getitem__(self, key):
+        if key not in FIELDS and key not in ("time", "timezone"):
+            raise KeyError(key)
+        return getattr(self, key)
 
-    clfDict = {}
+    def as_dict(self):
+        """Return everything as a dict, including the parsed time"""
+        result = {field: getattr(self, field) for field in FIELDS}
+        result["time"] = self.time
+        result["timezone"] = self.timezone
+        return result
+
+
+def parse(line):
+    """Return a LogRecord for the (combined or common format) log line
+
+    A line that isn't in one of the formats results in a record with empty
+    fields.
+
+    """
+    match = LOG_LINE.match(line)
+    if match is None:
+        return LogRecord()
+    # Common format lines have no referer and user agent: "" instead of None.
+    return LogRecord(*match.groups(""))
+
+
+class CLFParser:
+    "Represents a single Apache common log format record"
 
     def __init__(self, rec):
-        for p in (self.combinedLogFormat, self.commonLogFormat):
-            m = re.match(p, rec)
-            if m:
-                self.clfDict = m.groupdict()
-                if p == self.commonLogFormat:
-                    self.clfDict.update({"Referer": "", "Useragent": ""})
-                self.clfDict.update(
-                    {
-                        "time": datetime.strptime(
-                            self.clfDict["t"][1:21], "%d/%b/%Y:%H:%M:%S"
-                        ),
-                        "timezone": (self.clfDict["t"])[22:27],
-                    }
-                )
-                break
-        else:
-            self.clfDict = self.nullRec
+        self.clfDict = parse(rec).as_dict()
 
     @classmethod
     def logDict(cls, rec):
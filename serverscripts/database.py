@@ -1,11 +1,15 @@
 """Extract information from postgres databases.
 
 """
-from serverscripts.utils import get_output
+from collections import Counter
+from serverscripts.utils import run_command
+from serverscripts.utils import stream_command
+from serverscripts.utils import write_file
+from serverscripts.utils import write_json
 
 import argparse
 import copy
-import json
+import glob
 import logging
 import os
 import re
@@ -15,8 +19,11 @@ import sys
 
 VAR_DIR = "/var/local/serverscripts"
 POSTGRES_DIR = "/etc/postgres/sites-enabled"
+POSTGRES_CONFIG_DIR = "/etc/postgresql"
 OUTPUT_DIR = "/var/local/serverinfo-facts"
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "databases.fact")
+POSTGRES_LOGFILES = "/var/log/postgresql/postgres*main.log*"
+ZGREP_TIMEOUT = 4 * 60  # Seconds, the logs can be big.
 DATABASE_TEMPLATE = {"name": "", "size": 0}
 POSTGRES_VERSION = re.compile(
     r"""
@@ -30,19 +37,18 @@ POSTGRES_VERSION = re.compile(
 )
 USAGE_LINE = re.compile(
     r"""
-    ^\s*                     # Start of line plus whitespace
-    (?P<num_logins>\d+)      # Number of logins
-    .+database=              # Whitespace, username, etc.
+    connection\ authorized:  # The line we're looking for
+    .*user=                  # Whitespace, etc.
+    (?P<user>\S+)            # User name
+    \s+database=             # Whitespace
     (?P<database>[\w\-]+)    # Database name
     """,
     re.VERBOSE,
 )
 CONNECTION_LINE = re.compile(
     r"""
-    ^\s*                     # Start of line plus whitespace
-    (?P<num_connections>\d+) # Number of logins
-    \s+                      # Whitespace
-    (?P<ip_address>[\d\.]+)  # IP address
+    connection\ received:\ host=  # The line we're looking for
+    (?P<ip_address>[\d\.]+)        # IP address (so no [local])
     """,
     re.VERBOSE,
 )
@@ -52,11 +58,11 @@ logger = logging.getLogger(__name__)
 
 
 def is_postgres_available():
-    return os.path.exists("/etc/postgresql")
+    return os.path.exists(POSTGRES_CONFIG_DIR)
 
 
 def _postgres_version():
-    output, error = get_output("ps ax")
+    output, error = run_command(["ps", "ax"])
     lines = output.split("\n")
     for line in lines:
         if POSTGRES_VERSION.match(line):
@@ -69,8 +75,8 @@ def _postgres_version():
 def _database_infos():
     """Return dict with info about the databases {database name: info}"""
     query = "select datname, pg_database_size(datname) from pg_database;"
-    command = "sudo -u postgres psql -c '%s' --tuples-only" % query
-    output, error = get_output(command)
+    command = ["sudo", "-u", "postgres", "psql", "-c", query, "--tuples-only"]
+    output, error = run_command(command)
     if error:
         logger.warning("Error output from psql command: %s", error)
     result = {}
@@ -94,49 +100,57 @@ def _database_infos():
     return result
 
 
+def _grep_logfiles(pattern):
+    """Yield the lines in the (gzipped) postgres logfiles containing pattern"""
+    logfiles = sorted(glob.glob(POSTGRES_LOGFILES))
+    if not logfiles:
+        # zgrep would wait for stdin.
+        return
+    command = ["zgrep", "--no-filename", pattern] + logfiles
+    # zgrep exits with 1 if there aren't any matches.
+    for line in stream_command(command, timeout=ZGREP_TIMEOUT, fail_on_exit_code=False):
+        yield line
+
+
 def _usage():
-    command = (
-        'zgrep "connection authorized" /var/log/postgresql/postgres*main.log*'
-        r'|grep -v "user=postgres"|cut -d= -f2,3|cut -d\  -f1,2|sort|uniq -c | sort -n'
-    )
-    output, error = get_output(command)
-    if error:
-        logger.warning("Error output from usage zgrep command: %s", error)
-    # Output looks like this:
-    #     9 ror_export database=ror_export
-    #    73 waterlabel_site database=waterlabel_site
-    # 23054 efcis_site database=efcis_site
-    # 26591 schademodule database=schademodule2018
+    """Return number of logins per database
+
+    The log lines look like this::
+
+        ... LOG:  connection authorized: user=efcis_site database=efcis_site
+
+    The postgres user itself is ignored. If multiple users log into a
+    database, we report the number of the busiest one.
+
+    """
+    logins = Counter()
+    for line in _grep_logfiles("connection authorized"):
+        match = USAGE_LINE.search(line)
+        if not match or match.group("user") == "postgres":
+            continue
+        logins[(match.group("user"), match.group("database"))] += 1
     result = {}
-    for line in output.split("\n"):
-        if USAGE_LINE.match(line):
-            match = USAGE_LINE.search(line)
-            num_logins = int(match.group("num_logins"))
-            database = match.group("database")
-            result[database] = num_logins
+    for (user, database), num_logins in logins.items():
+        result[database] = max(num_logins, result.get(database, 0))
     return result
 
 
 def _connections():
-    command = (
-        'zgrep "connection received: host=" /var/log/postgresql/postgres*main.log*'
-        r'|grep -v "local"|cut -d= -f2|cut -d\  -f1|sort|uniq -c | sort -n'
-    )
-    output, error = get_output(command)
-    if error:
-        logger.warning("Error output from usage zgrep command: %s", error)
-    # Output looks like this:
-    #   1629 10.100.160.171
-    #   2495 10.100.57.17
-    #   9805 10.100.57.16
-    result = {}
-    for line in output.split("\n"):
-        if CONNECTION_LINE.match(line):
-            match = CONNECTION_LINE.search(line)
-            num_connections = int(match.group("num_connections"))
-            ip_address = match.group("ip_address")
-            result[ip_address] = num_connections
-    return result
+    """Return number of connections per IP address
+
+    The log lines look like this::
+
+        ... LOG:  connection received: host=10.100.57.16 port=39744
+
+    Local connections (``host=[local]``) are ignored.
+
+    """
+    result = Counter()
+    for line in _grep_logfiles("connection received: host="):
+        match = CONNECTION_LINE.search(line)
+        if match:
+            result[match.group("ip_address")] += 1
+    return dict(result)
 
 
 def all_info():
@@ -202,11 +216,11 @@ def main():
         return
 
     result = all_info()
-    open(OUTPUT_FILE, "w").write(json.dumps(result, sort_keys=True, indent=4))
+    write_json(OUTPUT_FILE, result)
 
     zabbix_file = os.path.join(VAR_DIR, "nens.num_databases.info")
-    open(zabbix_file, "w").write(str(result["num_databases"]))
+    write_file(zabbix_file, str(result["num_databases"]))
     zabbix_file = os.path.join(VAR_DIR, "nens.total_databases_size.info")
-    open(zabbix_file, "w").write(str(result["total_databases_size"]))
+    write_file(zabbix_file, str(result["total_databases_size"]))
     zabbix_file = os.path.join(VAR_DIR, "nens.biggest_database_size.info")
-    open(zabbix_file, "w").write(str(result["biggest_database_size"]))
+    write_file(zabbix_file, str(result["biggest_database_size"]))
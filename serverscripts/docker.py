@@ -1,10 +1,16 @@
 """Extract info on docker."""
 from serverscripts.checkouts import parse_freeze
 from serverscripts.checkouts import parse_python_version
-from serverscripts.utils import get_output
+from serverscripts.utils import log_memory_statistics
+from serverscripts.utils import MAX_WORKERS
+from serverscripts.utils import remember
+from serverscripts.utils import run_command
+from serverscripts.utils import run_concurrently
+from serverscripts.utils import write_file
+from serverscripts.utils import write_json
 
 import argparse
-import json
+import functools
 import logging
 import os
 import serverscripts
@@ -12,6 +18,7 @@ import sys
 
 
 VAR_DIR = "/var/local/serverscripts"
+DOCKER_CONFIG_DIR = "/etc/docker"
 OUTPUT_DIR = "/var/local/serverinfo-facts"
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "docker.fact")
 DOCKER_TEMPLATE = {
@@ -52,13 +59,14 @@ logger = logging.getLogger(__name__)
 
 
 def is_docker_available():
-    return os.path.exists("/etc/docker")
+    return os.path.exists(DOCKER_CONFIG_DIR)
 
 
-def python_details(container):
+def python_details(container, image_ids=None):
     """Run pip freeze in containers that are python-based
 
     A container is python based if it has "python" in its command.
+    ``image_ids`` is ``{container id: image id}``, see ``image_ids()``.
     """
     # identify the python interpreter inside the docker
     split_command = container["command"].strip('"').split(" ")
@@ -72,17 +80,57 @@ def python_details(container):
             python_exec = "python3"  # global default
         else:
             python_exec = os.path.join(dirname, "python")
-    python_in_docker = "docker exec " + container["id"] + " " + python_exec + " "
+    python_in_docker = ["docker", "exec", container["id"], python_exec]
+
+    image_id = (image_ids or {}).get(container["id"])
+    if image_id:
+        # Containers of the same image have the same python. Their packages
+        # can differ (mounted or changed virtualenvs), so pip freeze runs in
+        # every container.
+        python_version = remember(
+            ("docker python", image_id, python_exec),
+            _python_version,
+            container,
+            python_exec,
+        )
+    else:
+        python_version = _python_version(container, python_exec)
+    if python_version is None:
+        return {}
+
+    # identify the python packages (eggs)
+    command = ["-m", "pip", "freeze", "--all"]
+    logger.debug(
+        "Running %s %s in container '%s'..",
+        python_exec,
+        " ".join(command),
+        container["names"],
+    )
+    output, _ = run_command(python_in_docker + command, fail_on_exit_code=False)
+    if output.startswith(DOCKER_EXEC_ERROR):
+        logger.warning("Error output from pip freeze in docker: %s", output)
+    eggs = parse_freeze(output)
+    eggs["python"] = python_version
+
+    return {"eggs": eggs}
+
+
+def _python_version(container, python_exec):
+    """Return the python version in the container (None if there's no python)"""
+    python_in_docker = ["docker", "exec", container["id"], python_exec]
 
     # identify the python version
-    command = "--version"
+    command = ["--version"]
     logger.debug(
-        "Running %s %s in container '%s'..", python_exec, command, container["names"]
+        "Running %s %s in container '%s'..",
+        python_exec,
+        " ".join(command),
+        container["names"],
     )
-    output, _ = get_output(python_in_docker + command, fail_on_exit_code=False)
+    output, _ = run_command(python_in_docker + command, fail_on_exit_code=False)
     if output.startswith(DOCKER_EXEC_ERROR) or output.startswith("Traceback"):
         logger.info("Did not find Python in docker %s", container["names"])
-        return {}
+        return None
     python_version = parse_python_version(output, "")
     logger.info(
         "Found Python %s ('%s') in container '%s'..",
@@ -90,19 +138,28 @@ def python_details(container):
         python_exec,
         container["names"],
     )
+    return python_version
 
-    # identify the python packages (eggs)
-    command = "-m pip freeze --all"
-    logger.debug(
-        "Running %s %s in container '%s'..", python_exec, command, container["names"]
-    )
-    output, _ = get_output(python_in_docker + command, fail_on_exit_code=False)
-    if output.startswith(DOCKER_EXEC_ERROR):
-        logger.warning("Error output from pip freeze in docker: %s", output)
-    eggs = parse_freeze(output)
-    eggs["python"] = python_version
 
-    return {"eggs": eggs}
+def image_ids(container_ids):
+    """Return {container id: image id}
+
+    ``docker ps`` only knows the image's name, like ``myapp:latest``, which
+    can point at another image after a pull.
+
+    """
+    if not container_ids:
+        return {}
+    command = ["docker", "inspect", "--format", "{{.Id}}\t{{.Image}}"]
+    output, error = run_command(command + container_ids, fail_on_exit_code=False)
+    if error:
+        logger.warning("Error output from docker inspect: %s", error)
+    result = {}
+    for line in output.split("\n"):
+        parts = line.split("\t")
+        if len(parts) == 2:
+            result[parts[0]] = parts[1]
+    return result
 
 
 def container_details():
@@ -111,9 +168,9 @@ def container_details():
     The fields are all fields that docker ps can return. See:
     See https://docs.docker.com/engine/reference/commandline/ps/.
     """
-    command = "docker ps --no-trunc --format '{}'".format(DOCKER_PS_FORMAT)
+    command = ["docker", "ps", "--no-trunc", "--format", DOCKER_PS_FORMAT]
     logger.debug("Running 'docker ps'...")
-    output, error = get_output(command, fail_on_exit_code=False)
+    output, error = run_command(command, fail_on_exit_code=False)
     if error:
         logger.warning("Error output from docker command: %s", error)
         return []
@@ -121,7 +178,7 @@ def container_details():
     return [dict(zip(keys, line.split("\t"))) for line in output.split("\n") if line]
 
 
-def all_info():
+def all_info(max_workers=MAX_WORKERS):
     """Return the info we want to extract from docker.
 
     The output looks like this::
@@ -135,9 +192,9 @@ def all_info():
 
     """
     result = DOCKER_TEMPLATE.copy()
-    command = "docker system df"
-    logger.debug("Running '%s'...", command)
-    output, error = get_output(command, fail_on_exit_code=False)
+    command = ["docker", "system", "df"]
+    logger.debug("Running '%s'...", " ".join(command))
+    output, error = run_command(command, fail_on_exit_code=False)
     if error:
         logger.warning("Error output from docker command: %s", error)
     lines = [line.strip() for line in output.split("\n")]
@@ -160,8 +217,15 @@ def all_info():
         if "volumes" in line:
             result["active_volumes"] = count
     result["containers"] = container_details()
-    for container in result["containers"]:
-        container["python"] = python_details(container)
+    ids = image_ids([container["id"] for container in result["containers"]])
+    # Two "docker exec" calls per container: do several containers at once.
+    pythons = run_concurrently(
+        functools.partial(python_details, image_ids=ids),
+        result["containers"],
+        max_workers,
+    )
+    for container, python in zip(result["containers"], pythons):
+        container["python"] = python
     logger.info("Found %d active docker containers", result["active_containers"])
     return result
 
@@ -185,6 +249,15 @@ def main():
         default=False,
         help="Print version",
     )
+    parser.add_argument(
+        "-j",
+        "--max-workers",
+        type=int,
+        dest="max_workers",
+        default=MAX_WORKERS,
+        help="Number of containers to look at at the same time (default: %s)"
+        % MAX_WORKERS,
+    )
     options = parser.parse_args()
     if options.print_version:
         print(serverscripts.__version__)
@@ -202,21 +275,20 @@ def main():
     if not is_docker_available():
         return
 
-    info_on_docker = all_info()
+    info_on_docker = all_info(max_workers=options.max_workers)
+    log_memory_statistics()
     docker_is_active = any(info_on_docker.values())
     result_for_serverinfo = {
         "available": True,
         "active": docker_is_active,
         "containers": info_on_docker["containers"],
     }
-    open(OUTPUT_FILE, "w").write(
-        json.dumps(result_for_serverinfo, sort_keys=True, indent=4)
-    )
+    write_json(OUTPUT_FILE, result_for_serverinfo, compact=True)
 
     if "active_images" in info_on_docker:
         zabbix_file1 = os.path.join(VAR_DIR, "nens.num_active_docker_images.info")
-        open(zabbix_file1, "w").write(str(info_on_docker["active_images"]))
+        write_file(zabbix_file1, str(info_on_docker["active_images"]))
         zabbix_file2 = os.path.join(VAR_DIR, "nens.num_active_docker_containers.info")
-        open(zabbix_file2, "w").write(str(info_on_docker["active_containers"]))
+        write_file(zabbix_file2, str(info_on_docker["active_containers"]))
         zabbix_file3 = os.path.join(VAR_DIR, "nens.num_active_docker_volumes.info")
-        open(zabbix_file3, "w").write(str(info_on_docker["active_volumes"]))
+        write_file(zabbix_file3, str(info_on_docker["active_volumes"]))
@@ -2,26 +2,93 @@
 
 """
 from collections import Counter
-from serverscripts.clfparser import CLFParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from serverscripts import cache
+from serverscripts import clfparser
+from serverscripts.sketches import HyperLogLog
+from serverscripts.sketches import SpaceSaving
+from serverscripts.utils import run_concurrently
+from serverscripts.utils import write_json
 from urllib.parse import parse_qs
+from urllib.parse import unquote
 from urllib.parse import urlparse
 
 import argparse
+import datetime
+import functools
 import glob
 import gzip
+import hashlib
 import json
 import logging
+import math
 import os
+import re
 import serverscripts
+import sqlite3
 import sys
 import xml.etree.ElementTree as ET
 
 
+VAR_DIR = "/var/local/serverscripts"
 OUTPUT_DIR = "/var/local/serverinfo-facts"
 OUTPUT_FILE = os.path.join(OUTPUT_DIR, "geoserver.fact")
+ROLLUP_DATABASE = "geoserver_usage.sqlite"  # In VAR_DIR.
+ROLLUP_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    geoserver TEXT NOT NULL,
+    day TEXT NOT NULL,
+    workspace TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    referer TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (geoserver, day, workspace, layer, referer)
+);
+CREATE TABLE IF NOT EXISTS histograms (
+    geoserver TEXT NOT NULL,
+    day TEXT NOT NULL,
+    workspace TEXT NOT NULL,
+    layer TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (geoserver, day, workspace, layer, metric, bucket)
+);
+"""
+NO_REFERER = "-"  # Stored instead of None, it is part of the primary key.
+ANY_REFERER = "*"  # Stored instead of the referer with sketches.
 CONFIG_DIR = "/etc/serverscripts"
 CONFIG_FILE = os.path.join(CONFIG_DIR, "geoserver.json")
 EXTRACT_FROM_PARAM = "extract workspace from layer param"
+HEAD_SIZE = 1024  # Bytes, see _head().
+# Anything but printable ascii in the request means the fast path of
+# extract_from_bytes() might differ from extract_from_line(): str.split() and
+# urlparse() treat it differently. Same with escaped letters, parse_qs() would
+# unescape a parameter name like "lay%65rs".
+PRINTABLE_ASCII = bytes(range(0x20, 0x7F))
+ESCAPED_LETTER = re.compile(rb"%[4-7][0-9A-Fa-f]")
+FALLBACK = object()
+MONTHS = {
+    month.encode(): number
+    for number, month in enumerate(
+        "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split(), start=1
+    )
+}
+_days = {}  # b"05/Oct/2022" -> "2022-10-05", see _day().
+# Histograms (with a log_format), see bucket().
+LATENCY_FIELDS = ("request_time", "upstream_response_time")  # In ms.
+BYTES_FIELDS = ("body_bytes_sent", "bytes_sent")
+BUCKETS_PER_DOUBLING = 4
+SUM = -1  # Not a bucket: the sum of all values.
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+WEB_MERCATOR = ("EPSG:3857", "EPSG:900913")
+HALF_WORLD = 20037508.342789244  # Meters from the EPSG:3857 origin to the edge.
+TILE_PIXELS = 256
+TILE_TOLERANCE = 0.01  # Part of a tile, for rounding errors in the bbox.
+TILES_PER_SEEDED = 10  # Tiles kept in memory per tile in the seeding list.
+CLIENTS_PRECISION = 10  # 1024 registers, 3.25% standard error.
+REFERERS_CAPACITY = 50  # Referers kept in memory per workspace and day.
 
 logger = logging.getLogger(__name__)
 
@@ -64,15 +131,19 @@ def extract_from_line(line):
     #  'time': datetime.datetime(2018, 11, 15, 6, 25, 14),
     #  'timezone': '+0100',
     #  'u': '-'}
-    clf = CLFParser.logDict(line)
-    referer = clf["Referer"]
+    # The time isn't parsed, we don't need it.
+    clf = clfparser.parse(line)
+    return _extract_from_request(clf.r, clf.Referer, line)
+
+
+def _extract_from_request(request, referer, line):
+    """Return workspace/referer/layer of the (quoted) request and referer"""
     if referer:
         referer_parts = referer.split("/")
         if len(referer_parts) >= 2:
             referer = referer_parts[2]
     if referer == '"-"':
         referer = None
-    request = clf["r"]
     try:
         url = request.split()[1]
     except IndexError:
@@ -107,39 +178,976 @@ def extract_from_line(line):
     if not layers:
         # Not a regular wms request.
         return
+    layers_value = layers[0]  # The parsed result is always a list.
     if workspace == EXTRACT_FROM_PARAM:
         # The workspace name is embedded in the layers with a colon:
         # nieuwegein_klimaatatlas:1844_nieuwegein_bluelabel_droogte,km_mask_nieuwegein
-        layers_value = layers[0]  # The parsed result is always a list.
         if ":" not in layers_value:
             return
         workspace = layers_value.split(":")[0]
     return {
         "referer": referer,
         "workspace": workspace,
+        "layer": layers_value,
     }
 
 
-def extract_from_logfiles(logfile):
-    if not os.path.exists(logfile):
+def _first_value(query, start_of_param):
+    """Return the first non-empty value of the parameter (like parse_qs)"""
+    start = query.find(start_of_param)
+    while start != -1:
+        start += len(start_of_param)
+        end = query.find(b"&", start)
+        value = query[start:] if end == -1 else query[start:end]
+        if value:
+            return value
+        start = query.find(start_of_param, start)
+
+
+def _fast_extract(line):
+    """Return what extract_from_line() would, or FALLBACK if unsure
+
+    Only the simple, unambiguous lines are handled: the request has to be
+    printable ascii without ``;``, ``#`` or escaped letters (``%65``).
+
+    """
+    # Find the ends of the fields of clfparser.LOG_LINE by hand, the same way
+    # the regex would.
+    end_of_u = -1
+    for _ in range(3):
+        end_of_u = line.find(b" ", end_of_u + 1)
+        if end_of_u == -1:
+            return FALLBACK
+    if line[end_of_u + 1 : end_of_u + 2] != b"[":
+        return FALLBACK
+    end_of_t = line.find(b"]", end_of_u + 2)
+    if end_of_t == -1 or line[end_of_t + 1 : end_of_t + 3] != b' "':
+        return FALLBACK
+    end_of_r = line.find(b'"', end_of_t + 3)
+    if end_of_r == -1 or line[end_of_r + 1 : end_of_r + 2] != b" ":
+        return FALLBACK
+    end_of_s = line.find(b" ", end_of_r + 2)
+    if end_of_s == -1:
+        return FALLBACK
+    request = line[end_of_t + 2 : end_of_r + 1]
+
+    referer = b""
+    end_of_b = line.find(b" ", end_of_s + 1)
+    if end_of_b != -1 and line[end_of_b + 1 : end_of_b + 2] == b'"':
+        end_of_referer = line.find(b'"', end_of_b + 2)
+        if (
+            end_of_referer != -1
+            and line[end_of_referer + 1 : end_of_referer + 3] == b' "'
+            and line.find(b'"', end_of_referer + 3) != -1
+        ):
+            referer = line[end_of_b + 1 : end_of_referer + 1]
+    if referer:
+        referer_parts = referer.split(b"/")
+        if len(referer_parts) == 2:
+            return FALLBACK
+        if len(referer_parts) > 2:
+            referer = referer_parts[2]
+    referer = None if referer == b'"-"' else referer.decode("utf-8", "replace")
+
+    if request.translate(None, PRINTABLE_ASCII):
+        return FALLBACK
+    request_parts = request.split()
+    if len(request_parts) < 2:
+        return FALLBACK
+    url = request_parts[1]
+    if not url.startswith(b"/") or url.startswith(b"//"):
+        return FALLBACK
+    if b";" in url or b"#" in url:
+        return FALLBACK
+    path, _, query = url.partition(b"?")
+    if path == b"/geoserver/wms":
+        workspace = EXTRACT_FROM_PARAM
+    else:
+        path_parts = path.split(b"/")
+        if len(path_parts) < 3:
+            return
+        workspace = path_parts[2].decode("ascii")
+
+    if b"%" in query and ESCAPED_LETTER.search(query):
+        return FALLBACK
+    query = b"&" + query
+    layers = _first_value(query, b"&layers=") or _first_value(query, b"&LAYERS=")
+    if layers is None:
+        return
+    layers_value = unquote(layers.decode("ascii").replace("+", " "))
+    if workspace == EXTRACT_FROM_PARAM:
+        if ":" not in layers_value:
+            return
+        workspace = layers_value.split(":")[0]
+    return {
+        "referer": referer,
+        "workspace": workspace,
+        "layer": layers_value,
+    }
+
+
+def extract_from_bytes(line):
+    """Return the same as extract_from_line(), but for a binary log line
+
+    Most lines are handled without decoding them or parsing the whole line and
+    query string. Other lines go to extract_from_line().
+
+    """
+    result = _fast_extract(line)
+    if result is FALLBACK:
+        return extract_from_line(line.decode("utf-8", "replace"))
+    return result
+
+
+def _parse_day(day):
+    """Return "2022-10-05" for b"05/Oct/2022", "" if it isn't a day"""
+    if day not in _days:
+        month = MONTHS.get(day[3:6])
+        if not (month and day[0:2].isdigit() and day[7:11].isdigit()):
+            return ""
+        _days[day] = "%s-%02d-%s" % (day[7:11].decode(), month, day[0:2].decode())
+    return _days[day]
+
+
+def _day(line, pattern=None):
+    """Return the day ("2022-10-05") of a log line, "" if there's none
+
+    The day comes from the time field: ``[05/Oct/2022:07:46:01 +0200]`` or,
+    with a ``log_format``, from ``$time_local``.
+
+    """
+    if pattern is None:
+        start = line.find(b"[") + 1
+        return _parse_day(line[start : start + 11])
+    match = pattern.match(line)
+    if match is None or "time_local" not in pattern.groupindex:
+        return ""
+    return _parse_day(match.group("time_local")[:11])
+
+
+@functools.lru_cache()
+def log_line_pattern(log_format):
+    """Return compiled regex for nginx's ``log_format``
+
+    Every ``$variable`` becomes a named group that extends up to the first
+    character after it in the format (or the end of the line).
+
+    """
+    parts = re.split(r"\$\{?(\w+)\}?", log_format)
+    regex = b""
+    for index, part in enumerate(parts):
+        if index % 2 == 0:
+            regex += re.escape(part.encode())
+            continue
+        following = parts[index + 1][:1].encode()
+        allowed = b"[^" + re.escape(following) + b"\n]*" if following else b"[^\n]*"
+        if part in re.compile(regex).groupindex:
+            regex += b"(?:" + allowed + b")"
+        else:
+            regex += b"(?P<" + part.encode() + b">" + allowed + b")"
+    return re.compile(regex)
+
+
+def _milliseconds(value):
+    """Return total ms of "0.012" or "0.012, 0.034" (several upstreams)
+
+    Returns None for "-" (no upstream, for instance).
+
+    """
+    total = None
+    for part in re.split(rb"[,:]", value):
+        try:
+            seconds = float(part)
+        except ValueError:
+            continue
+        total = (total or 0) + round(seconds * 1000)
+    return total
+
+
+def _performance(fields):
+    """Yield (metric, value) for the performance fields of a log line"""
+    for metric in LATENCY_FIELDS:
+        if fields.get(metric):
+            value = _milliseconds(fields[metric])
+            if value is not None:
+                yield metric, value
+    for field in BYTES_FIELDS:
+        if fields.get(field, b"").isdigit():
+            yield "bytes", int(fields[field])
+            break
+
+
+def bucket(value):
+    """Return the histogram bucket of a value (0 or more)
+
+    Bucket 0 is for values below 1. Above that, there are
+    ``BUCKETS_PER_DOUBLING`` buckets every time the value doubles, so a
+    bucket's values are at most 19% apart. Whatever the number of requests,
+    a histogram has only a few dozen buckets.
+
+    """
+    if value < 1:
+        return 0
+    return 1 + int(math.log2(value) * BUCKETS_PER_DOUBLING)
+
+
+def bucket_limit(index):
+    """Return the upper limit of the values in the bucket"""
+    return 2 ** (index / BUCKETS_PER_DOUBLING)
+
+
+def percentiles(buckets):
+    """Return p50/p95/p99 of a {bucket: count} histogram
+
+    The upper limits of the buckets are returned, so the real percentiles are
+    at most 19% lower. The ``SUM`` entry, if there, is the exact total.
+
+    """
+    result = {}
+    counts = sorted((index, count) for index, count in buckets.items() if index != SUM)
+    total = sum(count for index, count in counts)
+    for name, fraction in PERCENTILES:
+        seen = 0
+        for index, count in counts:
+            seen += count
+            if seen >= fraction * total:
+                result[name] = round(bucket_limit(index))
+                break
+    if SUM in buckets:
+        result["total"] = buckets[SUM]
+    return result
+
+
+def _extract_from_fields(fields, line):
+    """Return workspace/referer/layer of the fields of a ``log_format`` line"""
+    referer = fields.get("http_referer")
+    return _extract_from_request(
+        '"%s"' % fields.get("request", b"").decode("utf-8", "replace"),
+        "" if referer is None else '"%s"' % referer.decode("utf-8", "replace"),
+        line,
+    )
+
+
+def _sketch_line(sketches, day, result, remote_addr):
+    """Add the client and referer to the sketches of the (day, workspace)"""
+    key = (day, result["workspace"])
+    if key not in sketches:
+        sketches[key] = (
+            HyperLogLog(CLIENTS_PRECISION),
+            SpaceSaving(REFERERS_CAPACITY),
+        )
+    clients, referers = sketches[key]
+    clients.add(remote_addr)
+    referers.add(result["referer"] or NO_REFERER)
+
+
+def _count_line(line, counter, histograms, pattern=None, sketches=None):
+    """Count (day, workspace, layer, referer) of a binary log line
+
+    With a ``log_format`` pattern, also add the line to the histograms per
+    (day, workspace, layer, metric).
+
+    With ``sketches`` (a dict), the client and referer go into the sketches of
+    the (day, workspace) and the count is for ``ANY_REFERER``: the number of
+    referers doesn't make the counter grow.
+
+    """
+    if b"/geoserver/" not in line or b"GetMap" not in line:
+        return
+    if pattern is None:
+        result = extract_from_bytes(line)
+        if result:
+            day = _day(line)
+            referer = result["referer"]
+            if sketches is not None:
+                _sketch_line(sketches, day, result, line.partition(b" ")[0])
+                referer = ANY_REFERER
+            counter[(day, result["workspace"], result["layer"], referer)] += 1
         return
+    match = pattern.match(line)
+    if match is None:
+        return
+    fields = match.groupdict()
+    result = _extract_from_fields(fields, line)
+    if not result:
+        return
+    day = _parse_day(fields.get("time_local", b"")[:11])
+    key = (day, result["workspace"], result["layer"])
+    referer = result["referer"]
+    if sketches is not None:
+        _sketch_line(sketches, day, result, fields.get("remote_addr", b""))
+        referer = ANY_REFERER
+    counter[key + (referer,)] += 1
+    for metric, value in _performance(fields):
+        histograms[key + (metric, bucket(value))] += 1
+        histograms[key + (metric, SUM)] += value
+
+
+def _offset_of_day(f, day, size, pattern=None):
+    """Return the offset of the first line from ``day`` onwards
 
-    logfiles = glob.glob(logfile + "*")
-    for logfile in logfiles:
-        logger.debug("Reading logfile %s", logfile)
-        if logfile.endswith(".gz"):
-            f = gzip.open(logfile, "rt")
+    nginx logs are in chronological order, so we can do a binary search over
+    the line boundaries instead of reading everything before it. A line
+    without a day stops the search: better read too much than too little.
+
+    """
+    low, high = 0, size
+    while low < high:
+        middle = (low + high) // 2
+        # The first line that starts at or after the middle.
+        f.seek(max(middle - 1, 0))
+        if middle:
+            f.readline()
+        line = f.readline()
+        line_day = _day(line, pattern) if line else ""
+        if not line_day or line_day >= day:
+            high = middle
         else:
-            f = open(logfile, "rt")
+            low = middle + 1
+    f.seek(max(low - 1, 0))
+    if low:
+        f.readline()
+    return f.tell()
+
+
+def count_logfile(
+    logfile, offset=0, live=False, since=None, log_format=None, sketches=None
+):
+    """Return (counts, histograms, offset we got to, sketches) of the logfile
+
+    The counts are per (day, workspace, layer, referer). For an uncompressed
+    logfile we start reading at ``offset``. When reading from the start, we
+    skip right to the lines from the ``since`` day on. For the ``live``
+    logfile, an incomplete last line is left for the next time.
+
+    The lines are in nginx's combined format, unless there's a ``log_format``.
+    Only then are there histograms, see ``_count_line()``.
+
+    ``sketches`` is None or the {(day, workspace): (clients, referers)}
+    sketches to continue with (an empty dict to start with), see
+    ``_count_line()``.
+
+    """
+    counter = Counter()
+    histograms = Counter()
+    pattern = log_line_pattern(log_format) if log_format else None
+    if logfile.endswith(".gz"):
+        with gzip.open(logfile, "rb") as f:
+            for line in f:
+                _count_line(line, counter, histograms, pattern, sketches)
+        return counter, histograms, None, sketches
+    with open(logfile, "rb") as f:
+        if since and not offset:
+            size = os.fstat(f.fileno()).st_size
+            offset = _offset_of_day(f, since, size, pattern)
+        f.seek(offset)
+        for line in f:
+            if live and not line.endswith(b"\n"):
+                # Still being written.
+                break
+            offset += len(line)
+            _count_line(line, counter, histograms, pattern, sketches)
+    return counter, histograms, offset, sketches
+
+
+def _head(logfile, size):
+    """Return hash of the first bytes, to recognize a truncated+refilled file"""
+    with open(logfile, "rb") as f:
+        return hashlib.md5(f.read(size)).hexdigest()
+
+
+def _counts_to_json(counter):
+    return [list(key) + [count] for key, count in counter.items()]
+
+
+def _counts_from_json(counts):
+    return Counter({tuple(row[:-1]): row[-1] for row in counts})
+
+
+def _sketches_to_json(sketches):
+    return [
+        [day, workspace, clients.to_json(), referers.to_json()]
+        for (day, workspace), (clients, referers) in sketches.items()
+    ]
+
+
+def _sketches_from_json(rows):
+    return {
+        (day, workspace): (
+            HyperLogLog.from_json(clients),
+            SpaceSaving.from_json(referers),
+        )
+        for day, workspace, clients, referers in rows
+    }
+
+
+def _merge_sketches(sketches, other):
+    """Add the {(day, workspace): (clients, referers)} of other to sketches"""
+    for key, (clients, referers) in other.items():
+        if key in sketches:
+            clients = sketches[key][0].merge(clients)
+            referers = sketches[key][1].merge(referers)
+        sketches[key] = (clients, referers)
+
+
+def _mtime_day(stat):
+    return datetime.date.fromtimestamp(stat.st_mtime).isoformat()
+
+
+def _resume_point(
+    logfile, stat, checkpoint, since=None, log_format=None, sketches=False
+):
+    """Return the counts, histograms and sketches so far and the offset to use
+
+    A rotated ``.gz`` file never changes: if the size and mtime still match,
+    the counts of the previous run are all there is (offset None). For an
+    uncompressed file, we continue reading where we left off, provided the
+    file wasn't truncated (or truncated and refilled) in the meantime and the
+    previous run didn't skip lines that we need now (``since``). A different
+    ``log_format`` or switching ``sketches`` on or off means starting over.
+
+    The sketches are None without ``sketches``.
+
+    """
+    start_over = Counter(), Counter(), {} if sketches else None, 0
+    if (
+        not checkpoint
+        or checkpoint.get("log_format") != log_format
+        or ("sketches" in checkpoint) != sketches
+    ):
+        return start_over
+    counts = _counts_from_json(checkpoint["counts"])
+    histograms = _counts_from_json(checkpoint.get("histograms", []))
+    day_sketches = None
+    if sketches:
+        day_sketches = _sketches_from_json(checkpoint["sketches"])
+    if logfile.endswith(".gz"):
+        if (
+            checkpoint["size"] == stat.st_size
+            and checkpoint["mtime"] == stat.st_mtime_ns
+        ):
+            logger.debug("%s hasn't changed since the last run", logfile)
+            return counts, histograms, day_sketches, None
+        return start_over
+    if (
+        checkpoint["offset"] <= stat.st_size
+        and (checkpoint["since"] is None or (since and checkpoint["since"] <= since))
+        and _head(logfile, checkpoint["head_size"]) == checkpoint["head"]
+    ):
+        return counts, histograms, day_sketches, checkpoint["offset"]
+    return start_over
+
+
+def _checkpoint(
+    logfile, stat, counter, histograms, offset, since, log_format, sketches=None
+):
+    checkpoint = {
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "log_format": log_format,
+        "counts": _counts_to_json(counter),
+        "histograms": _counts_to_json(histograms),
+    }
+    if sketches is not None:
+        checkpoint["sketches"] = _sketches_to_json(sketches)
+    if not logfile.endswith(".gz"):
+        checkpoint["offset"] = offset
+        checkpoint["since"] = since
+        checkpoint["head_size"] = min(offset, HEAD_SIZE)
+        checkpoint["head"] = _head(logfile, checkpoint["head_size"])
+    return checkpoint
+
+
+def _count_logfiles(jobs, workers, function=count_logfile):
+    """Return {logfile: count_logfile() result}, in parallel if possible
+
+    ``jobs`` is a list of count_logfile() argument tuples, starting with the
+    logfile. Decompressing and parsing is CPU-bound, so we use processes:
+    every worker returns the (small) Counters of its file. Another
+    ``function``, like count_tiles(), can be used instead of count_logfile().
+
+    """
+    if not jobs:
+        return {}
+    logfiles = [job[0] for job in jobs]
+    workers = min(workers, len(jobs))
+    if workers <= 1:
+        results = [function(*job) for job in jobs]
+        return dict(zip(logfiles, results))
+    logger.debug("Reading %s logfiles with %s processes", len(jobs), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(function, *zip(*jobs))
+        return dict(zip(logfiles, results))
+
+
+def count_usage(logfile, workers=1, since=None, log_format=None, sketches=False):
+    """Return Counters of (day, workspace, layer, referer), histograms and sketches
+
+    The histograms are keyed by (day, workspace, layer, metric, bucket), see
+    ``_count_line()``. They are empty without a ``log_format``.
+
+    With ``sketches``, the referers are counted as ``ANY_REFERER``. They and
+    the clients end up in the {(day, workspace): (clients, referers)}
+    sketches instead, see ``sketches_per_workspace()``. Otherwise, the
+    sketches are empty.
+
+    Only new log lines are read: we keep checkpoints per file (keyed by inode,
+    as a rotated file keeps its inode) in the cache directory. The files that
+    have to be read are divided over ``workers`` processes.
+
+    With ``since`` (a day like "2022-10-05"), older lines are not needed.
+    Rotated files that were last written to before that day aren't read at
+    all. The result can still contain older days, from checkpoints of
+    previous runs and from the first lines of a rotated file.
+
+    """
+    total = Counter()
+    total_histograms = Counter()
+    total_sketches = {}
+    if not os.path.exists(logfile):
+        return total, total_histograms, total_sketches
+    state_name = "geoserver_logs_%s" % (hashlib.md5(logfile.encode()).hexdigest()[:8])
+    checkpoints = cache.load_state(state_name).get("files", {})
+    new_checkpoints = {}
+    files = []
+    for filename in sorted(glob.glob(logfile + "*")):
+        stat = os.stat(filename)
+        checkpoint = checkpoints.get(str(stat.st_ino))
+        if since and filename != logfile and _mtime_day(stat) < since:
+            logger.debug("Skipping %s, it is older than %s", filename, since)
+            if checkpoint:
+                new_checkpoints[str(stat.st_ino)] = checkpoint
+            continue
+        counter, histograms, day_sketches, offset = _resume_point(
+            filename,
+            stat,
+            checkpoint,
+            since=since,
+            log_format=log_format,
+            sketches=sketches,
+        )
+        counted_since = None
+        if offset and not filename.endswith(".gz"):
+            counted_since = checkpoint["since"]
+        elif offset == 0 and not filename.endswith(".gz"):
+            counted_since = since
+        files.append(
+            (filename, stat, counter, histograms, day_sketches, offset, counted_since)
+        )
+
+    # The sketches of the previous run are continued with (not merged with a
+    # new one, which would add to the error).
+    jobs = [
+        (filename, offset, filename == logfile, counted_since, log_format, day_sketches)
+        for filename, stat, _, _, day_sketches, offset, counted_since in files
+        if offset is not None and (filename.endswith(".gz") or offset < stat.st_size)
+    ]
+    for job in jobs:
+        logger.debug("Reading logfile %s from offset %s", job[0], job[1])
+    results = _count_logfiles(jobs, workers)
+
+    for (
+        filename,
+        stat,
+        counter,
+        histograms,
+        day_sketches,
+        offset,
+        counted_since,
+    ) in files:
+        if filename in results:
+            new_counter, new_histograms, offset, day_sketches = results[filename]
+            counter.update(new_counter)
+            histograms.update(new_histograms)
+        new_checkpoints[str(stat.st_ino)] = _checkpoint(
+            filename,
+            stat,
+            counter,
+            histograms,
+            offset,
+            counted_since,
+            log_format,
+            sketches=day_sketches,
+        )
+        total.update(counter)
+        total_histograms.update(histograms)
+        if day_sketches:
+            _merge_sketches(total_sketches, day_sketches)
+    cache.save_state(state_name, {"logfile": logfile, "files": new_checkpoints})
+    return total, total_histograms, total_sketches
+
+
+def window_start(days, today=None):
+    """Return the first day of a window of the last ``days`` days (incl. today)"""
+    today = today or datetime.date.today()
+    return (today - datetime.timedelta(days=days - 1)).isoformat()
+
+
+def tile(params):
+    """Return (z, x, y) of a GetMap request for a 256x256 web mercator tile
+
+    ``params`` are the request's parameters, with lowercase names. Requests
+    for other sizes or projections or that don't line up with the tile grid
+    (the zoom levels and tiles of OpenStreetMap and Google) return None.
+
+    """
+    srs = (params.get("srs") or params.get("crs") or "").upper()
+    try:
+        width, height = int(params["width"]), int(params["height"])
+        minx, miny, maxx, maxy = [float(value) for value in params["bbox"].split(",")]
+    except (KeyError, ValueError):
+        return
+    if srs not in WEB_MERCATOR or width != TILE_PIXELS or height != TILE_PIXELS:
+        return
+    size = maxx - minx
+    if size <= 0 or abs(maxy - miny - size) > TILE_TOLERANCE * size:
+        return
+    zoom = round(math.log2(2 * HALF_WORLD / size))
+    tile_size = 2 * HALF_WORLD / 2**zoom
+    if zoom < 0 or abs(size - tile_size) > TILE_TOLERANCE * tile_size:
+        return
+    # Tiles are numbered from the top left (north west) corner.
+    x = (minx + HALF_WORLD) / tile_size
+    y = (HALF_WORLD - maxy) / tile_size
+    if abs(x - round(x)) > TILE_TOLERANCE or abs(y - round(y)) > TILE_TOLERANCE:
+        return
+    x, y = round(x), round(y)
+    if not (0 <= x < 2**zoom and 0 <= y < 2**zoom):
+        return
+    return zoom, x, y
+
+
+def _extract_with_fields(line, pattern=None):
+    """Return (extract_from_bytes() result, fields) of a binary GetMap log line
+
+    The fields are those of the ``log_format`` pattern. In nginx's combined
+    format, there's only ``remote_addr`` and ``request``. Other lines return
+    (None, None).
+
+    """
+    if b"/geoserver/" not in line or b"GetMap" not in line:
+        return None, None
+    if pattern is None:
+        fields = {
+            "remote_addr": line.partition(b" ")[0],
+            "request": line.partition(b'"')[2].partition(b'"')[0],
+        }
+        return extract_from_bytes(line), fields
+    match = pattern.match(line)
+    if match is None:
+        return None, None
+    fields = match.groupdict()
+    return _extract_from_fields(fields, line), fields
+
+
+def extract_tile(line, pattern=None):
+    """Return (layer, (z, x, y)) of a binary log line with a tile request
+
+    Other lines return None. The layer is the ``layers`` parameter, just like
+    in the usage counts.
+
+    """
+    result, fields = _extract_with_fields(line, pattern)
+    if not result:
+        return
+    url = fields.get("request", b"").split()[1]
+    query = url.partition(b"?")[2].decode("utf-8", "replace")
+    params = {name.lower(): values[0] for name, values in parse_qs(query).items()}
+    zxy = tile(params)
+    if zxy is None:
+        return
+    return result["layer"], zxy
+
+
+def _lines_since(logfile, since=None, pattern=None):
+    """Yield the binary lines of the logfile, skipping to the ``since`` day
+
+    Only uncompressed logfiles can be skipped through: a ``.gz`` file yields
+    all its lines.
+
+    """
+    opener = gzip.open if logfile.endswith(".gz") else open
+    with opener(logfile, "rb") as f:
+        if since and not logfile.endswith(".gz"):
+            size = os.fstat(f.fileno()).st_size
+            f.seek(_offset_of_day(f, since, size, pattern))
         for line in f:
-            if "/geoserver/" not in line:
-                continue
-            if "GetMap" not in line:
-                continue
-            result = extract_from_line(line)
-            if result:
-                yield result
-        f.close()
+            yield line
+
+
+def _logfiles_since(logfile, since=None):
+    """Return the logfile and the rotated ones written to since ``since``"""
+    if not os.path.exists(logfile):
+        return []
+    result = []
+    for filename in sorted(glob.glob(logfile + "*")):
+        if since and filename != logfile and _mtime_day(os.stat(filename)) < since:
+            logger.debug("Skipping %s, it is older than %s", filename, since)
+            continue
+        result.append(filename)
+    return result
+
+
+def _merge_summaries(results):
+    """Return the merged {key: summary} dicts of the logfiles' results"""
+    summaries = {}
+    for filename in sorted(results):
+        for key, summary in results[filename].items():
+            if key in summaries:
+                summary = summaries[key].merge(summary)
+            summaries[key] = summary
+    return summaries
+
+
+def count_tiles(logfile, since=None, log_format=None, capacity=1000):
+    """Return {layer: SpaceSaving summary of the requested tiles} of a logfile
+
+    Only lines from the ``since`` day on are counted. Per layer, at most
+    ``capacity`` tiles are kept in memory.
+
+    """
+    summaries = {}
+    pattern = log_line_pattern(log_format) if log_format else None
+    for line in _lines_since(logfile, since, pattern):
+        found = extract_tile(line, pattern)
+        if found is None:
+            continue
+        if since and (_day(line, pattern) or since) < since:
+            continue
+        layer, zxy = found
+        if layer not in summaries:
+            summaries[layer] = SpaceSaving(capacity)
+        summaries[layer].add(zxy)
+    return summaries
+
+
+def hot_tiles(logfile, workers=1, since=None, log_format=None, top=100):
+    """Return the most requested tiles per layer, to seed the tile cache with
+
+    The result is {layer: {"requests": n, "share": s, "tiles": [[z, x, y,
+    count], ...]}} with the ``top`` tiles per layer, the most requested
+    first. ``requests`` is the exact number of tile requests for the layer,
+    ``share`` the part of those that the listed tiles served.
+
+    The tiles are counted in bounded memory (``TILES_PER_SEEDED`` times
+    ``top`` tiles per layer, see ``sketches.SpaceSaving``), so a count can be
+    too high by at most ``requests / capacity``. With a skewed distribution,
+    which is what makes seeding worthwhile, the top tiles are exact.
+
+    """
+    capacity = TILES_PER_SEEDED * top
+    jobs = [
+        (filename, since, log_format, capacity)
+        for filename in _logfiles_since(logfile, since)
+    ]
+    summaries = _merge_summaries(_count_logfiles(jobs, workers, function=count_tiles))
+
+    result = {}
+    for layer, summary in summaries.items():
+        most_common = summary.most_common(top)
+        result[layer] = {
+            "requests": summary.total,
+            "share": round(
+                sum(count for _, count, _ in most_common) / summary.total, 3
+            ),
+            "tiles": [list(zxy) + [count] for zxy, count, _ in most_common],
+        }
+    return result
+
+
+def sketches_per_workspace(day_sketches, since=None):
+    """Return {workspace: (clients, referers)} from the ``since`` day on
+
+    ``day_sketches`` are the {(day, workspace): (clients, referers)} sketches
+    of ``count_usage()``.
+
+    """
+    result = {}
+    for (day, workspace), sketches in sorted(day_sketches.items()):
+        if since and day < since:
+            continue
+        _merge_sketches(result, {workspace: sketches})
+    return result
+
+
+def _sketch_info(workspace_name, sketches, number=5):
+    """Return unique clients and top referers of a workspace from the sketches"""
+    if workspace_name not in sketches:
+        return {}
+    clients, referers = sketches[workspace_name]
+    most_common = referers.most_common(number)
+    return {
+        "unique_clients": clients.count(),
+        "unique_clients_error": round(clients.error, 4),
+        "referers": " + ".join(
+            "%s (%d)" % (None if referer == NO_REFERER else referer, count)
+            for referer, count, _ in most_common
+        ),
+        "referers_max_error": max(error for _, _, error in most_common),
+        "sketch_bytes": clients.memory() + referers.memory(),
+    }
+
+
+def open_rollup():
+    """Return connection to the database with the usage per day
+
+    If the database can't be used (no write permission, for instance), we
+    continue with an in-memory one. Only the history is lost then.
+
+    """
+    path = os.path.join(VAR_DIR, ROLLUP_DATABASE)
+    try:
+        if not os.path.exists(VAR_DIR):
+            os.makedirs(VAR_DIR)
+        connection = sqlite3.connect(path)
+        connection.executescript(ROLLUP_SCHEMA)
+    except (OSError, sqlite3.Error):
+        logger.warning("Cannot use %s, keeping the usage in memory", path)
+        connection = sqlite3.connect(":memory:")
+        connection.executescript(ROLLUP_SCHEMA)
+    return connection
+
+
+def _store_increases(connection, table, columns, geoserver_name, counts):
+    """Write the counts that went up, return how many there were"""
+    if not counts:
+        return 0
+    stored = {}
+    for row in connection.execute(
+        "SELECT %s, count FROM %s WHERE geoserver = ? AND day >= ?"
+        % (", ".join(columns), table),
+        (geoserver_name, min(counts)[0]),
+    ):
+        stored[tuple(row[:-1])] = row[-1]
+    changes = [
+        (geoserver_name,) + key + (count,)
+        for key, count in counts.items()
+        if count > stored.get(key, 0)
+    ]
+    placeholders = ", ".join(["?"] * (len(columns) + 2))
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO %s VALUES (%s)" % (table, placeholders), changes
+        )
+    return len(changes)
+
+
+def _remove_other_referers(connection, geoserver_name, counts):
+    """Remove the usage of the days that are now counted the other way
+
+    With sketches, a day is stored for ``ANY_REFERER`` instead of per referer.
+    After switching sketches on or off, the days in the logfiles would
+    otherwise be counted twice.
+
+    """
+    sketched = {day for day, _, _, referer in counts if referer == ANY_REFERER}
+    exact = {day for day, _, _, _ in counts} - sketched
+    with connection:
+        connection.executemany(
+            "DELETE FROM usage WHERE geoserver = ? AND day = ? AND referer != ?",
+            [(geoserver_name, day, ANY_REFERER) for day in sketched],
+        )
+        connection.executemany(
+            "DELETE FROM usage WHERE geoserver = ? AND day = ? AND referer = ?",
+            [(geoserver_name, day, ANY_REFERER) for day in exact],
+        )
+
+
+def update_rollup(connection, geoserver_name, day_counts, histograms=None):
+    """Store the counts of count_usage(), return number of changes
+
+    Only the counts that went up are written. A count never goes down: that
+    only happens when logrotate removes the oldest logfile, which still leaves
+    the first lines of its last day in the next one.
+
+    """
+    counts = {}
+    for (day, workspace, layer, referer), count in day_counts.items():
+        if day:
+            referer = NO_REFERER if referer is None else referer
+            counts[(day, workspace, layer, referer)] = count
+    _remove_other_referers(connection, geoserver_name, counts)
+    changes = _store_increases(
+        connection,
+        "usage",
+        ("day", "workspace", "layer", "referer"),
+        geoserver_name,
+        counts,
+    )
+    counts = {key: count for key, count in (histograms or {}).items() if key[0]}
+    changes += _store_increases(
+        connection,
+        "histograms",
+        ("day", "workspace", "layer", "metric", "bucket"),
+        geoserver_name,
+        counts,
+    )
+    logger.debug("Stored %s changed counts for %s", changes, geoserver_name)
+    return changes
+
+
+def usage_from_rollup(connection, geoserver_name, since):
+    """Return Counter with the usage per workspace from the ``since`` day on"""
+    return Counter(
+        dict(
+            connection.execute(
+                "SELECT workspace, SUM(count) FROM usage "
+                "WHERE geoserver = ? AND day >= ? GROUP BY workspace",
+                (geoserver_name, since),
+            )
+        )
+    )
+
+
+def referers_from_rollup(connection, geoserver_name, since, number=5):
+    """Return {workspace: [(referer, count), ...]} with the most common ones
+
+    Days that were counted with sketches have no referers.
+
+    """
+    result = {}
+    for workspace, referer, count in connection.execute(
+        "SELECT workspace, referer, SUM(count) AS total FROM usage "
+        "WHERE geoserver = ? AND day >= ? AND referer != ? "
+        "GROUP BY workspace, referer ORDER BY workspace, total DESC, referer",
+        (geoserver_name, since, ANY_REFERER),
+    ):
+        referers = result.setdefault(workspace, [])
+        if len(referers) < number:
+            referers.append((None if referer == NO_REFERER else referer, count))
+    return result
+
+
+def layer_usage_from_rollup(connection, geoserver_name, since):
+    """Return Counter with the usage per (workspace, layer)"""
+    rows = connection.execute(
+        "SELECT workspace, layer, SUM(count) FROM usage "
+        "WHERE geoserver = ? AND day >= ? GROUP BY workspace, layer",
+        (geoserver_name, since),
+    )
+    return Counter({(workspace, layer): count for workspace, layer, count in rows})
+
+
+def histograms_from_rollup(connection, geoserver_name, since):
+    """Return {(workspace, layer): {metric: {bucket: count}}}"""
+    result = {}
+    for workspace, layer, metric, index, count in connection.execute(
+        "SELECT workspace, layer, metric, bucket, SUM(count) FROM histograms "
+        "WHERE geoserver = ? AND day >= ? GROUP BY workspace, layer, metric, bucket",
+        (geoserver_name, since),
+    ):
+        metrics = result.setdefault((workspace, layer), {})
+        metrics.setdefault(metric, Counter())[index] = count
+    return result
+
+
+def _performance_info(histograms):
+    """Return {"request_time_ms": {"p50": ...}, ...} for {metric: histogram}"""
+    result = {}
+    for metric, buckets in sorted(histograms.items()):
+        name = metric + "_ms" if metric in LATENCY_FIELDS else metric
+        result[name] = percentiles(buckets)
+    return result
 
 
 def get_text_or_none(element, tag):
@@ -180,24 +1188,59 @@ def _combine_with_comma(datastores, key):
     return ", ".join(set(values))
 
 
+def _datastore_infos(inputs, state_name):
+    """Return {datastore_file: info} for the fingerprinted datastore files
+
+    The info of every file is kept in the cache, together with its mtime and
+    size: only new and changed files are parsed. The data dir is often on a
+    network mount, so those are parsed concurrently.
+
+    """
+    previous = cache.load_state(state_name).get("files", {})
+    infos = {}
+    to_parse = []
+    for datastore_file, mtime, size, _ in inputs:
+        kept = previous.get(datastore_file)
+        if kept and kept[:2] == [mtime, size]:
+            infos[datastore_file] = kept[2]
+        else:
+            to_parse.append(datastore_file)
+    logger.debug("Parsing %s of %s datastore files", len(to_parse), len(inputs))
+    infos.update(zip(to_parse, run_concurrently(extract_datastore_info, to_parse)))
+    cache.save_state(
+        state_name,
+        {
+            "files": {
+                datastore_file: [mtime, size, infos[datastore_file]]
+                for datastore_file, mtime, size, _ in inputs
+            }
+        },
+    )
+    return infos
+
+
 def extract_from_dirs(data_dir):
     workspaces_dir = os.path.join(data_dir, "workspaces")
     datastore_files = glob.glob(workspaces_dir + "/*/*/datastore.xml")
-    workspace_names = set(
-        [datastore_file.split("/")[-3] for datastore_file in datastore_files]
-    )
+    # Parsing all those xml files is expensive, so reuse the previous result if
+    # none of them changed.
+    inputs = cache.fingerprint(datastore_files)
+    data_dir_hash = hashlib.md5(data_dir.encode()).hexdigest()[:8]
+    cache_name = "geoserver_datastores_%s" % data_dir_hash
+    result = cache.lookup(cache_name, inputs)
+    if result is not None:
+        return result
+
+    infos = _datastore_infos(inputs, "geoserver_datastore_files_%s" % data_dir_hash)
+    datastores_per_workspace = {}
+    for datastore_file in datastore_files:
+        workspace_name = datastore_file.split("/")[-3]
+        datastores_per_workspace.setdefault(workspace_name, []).append(
+            infos[datastore_file]
+        )
     result = {}
-    for workspace_name in workspace_names:
+    for workspace_name, datastores in datastores_per_workspace.items():
         workspace = {}
-        workspace_datastore_files = [
-            datastore_file
-            for datastore_file in datastore_files
-            if datastore_file.split("/")[-3] == workspace_name
-        ]
-        datastores = [
-            extract_datastore_info(workspace_datastore_file)
-            for workspace_datastore_file in workspace_datastore_files
-        ]
         for key in [
             "enabled",
             "type",
@@ -208,27 +1251,89 @@ def extract_from_dirs(data_dir):
             workspace[key] = _combine_with_comma(datastores, key)
         result[workspace_name] = workspace
 
+    cache.store(cache_name, inputs, result)
     return result
 
 
-def extract_workspaces_info(geoserver_configuration):
-    """Return list of workspaces with all info"""
+def _workspace_performance(workspace_name, layer_usage, layer_histograms):
+    """Return performance info of the workspace plus that of its layers"""
+    workspace_histograms = {}
+    layers = {}
+    for (workspace, layer), count in layer_usage.most_common():
+        if workspace != workspace_name:
+            continue
+        histograms = layer_histograms.get((workspace, layer), {})
+        layers[layer] = {"usage": count}
+        layers[layer].update(_performance_info(histograms))
+        for metric, buckets in histograms.items():
+            workspace_histograms.setdefault(metric, Counter()).update(buckets)
+    result = _performance_info(workspace_histograms)
+    result["layers"] = layers
+    return result
+
+
+def extract_workspaces_info(
+    geoserver_configuration, since=None, windows=None, sketches=None
+):
+    """Return list of workspaces with all info
+
+    The usage is counted from the ``since`` day or else over the longest of
+    the ``windows`` (numbers of days). Without either, everything in the
+    logfiles counts. For every window, there's also a ``usage_7d``-like key.
+
+    The counts per day are added to the rollup database, the numbers are
+    summed from there.
+
+    With a ``log_format`` that includes ``$request_time`` and the like, there
+    are also percentiles of the latency and bytes per workspace and per layer.
+
+    With ``sketches`` (or ``"sketches": true`` in the configuration), the
+    number of unique clients is estimated per workspace and the referers come
+    from fixed-size summaries instead of the exact counts, see
+    ``_count_line()``. Those are only about what's still in the logfiles.
+
+    """
     workspaces = {}
     datastores_info = extract_from_dirs(geoserver_configuration["data_dir"])
+    if windows is None:
+        windows = geoserver_configuration.get("windows", [])
+    windows = sorted(set(windows))
+    if since is None and windows:
+        since = window_start(windows[-1])
+    earliest = since
+    if windows:
+        earliest = min(since, window_start(windows[-1]))
 
-    workspace_names_and_referers = Counter(
-        (
-            (log_line["workspace"], log_line["referer"])
-            for log_line in extract_from_logfiles(geoserver_configuration["logfile"])
-        )
-    ).most_common()
+    log_format = geoserver_configuration.get("log_format")
+    if sketches is None:
+        sketches = geoserver_configuration.get("sketches", False)
+    day_counts, histograms, day_sketches = count_usage(
+        geoserver_configuration["logfile"],
+        workers=geoserver_configuration.get("workers", 1),
+        since=earliest,
+        log_format=log_format,
+        sketches=sketches,
+    )
+    if since is None:
+        # Everything that's still in the logfiles.
+        since = min((day for day, _, _, _ in day_counts if day), default="")
+    workspace_sketches = sketches_per_workspace(day_sketches, since)
 
-    workspace_names_counter = Counter()
-    for (workspace_name, referer), workspace_count in workspace_names_and_referers:
-        workspace_names_counter.update({workspace_name: workspace_count})
-    workspace_names = workspace_names_counter.most_common()
+    geoserver_name = geoserver_configuration["geoserver_name"]
+    with closing(open_rollup()) as connection:
+        update_rollup(connection, geoserver_name, day_counts, histograms)
+        usage = usage_from_rollup(connection, geoserver_name, since)
+        referers = referers_from_rollup(connection, geoserver_name, since)
+        if log_format:
+            layer_usage = layer_usage_from_rollup(connection, geoserver_name, since)
+            layer_histograms = histograms_from_rollup(connection, geoserver_name, since)
+        usage_per_window = {}
+        for days in windows:
+            usage_per_window["usage_%dd" % days] = usage_from_rollup(
+                connection, geoserver_name, window_start(days)
+            )
 
-    for workspace_name, workspace_count in workspace_names:
+    for workspace_name, workspace_count in usage.most_common():
         if workspace_name not in datastores_info:
             logger.warn(
                 "Workspace %s from nginx logfile is missing in workspaces dir.",
@@ -236,24 +1341,32 @@ def extract_workspaces_info(geoserver_configuration):
             )
             continue
 
-        referers = Counter()
-        for (found_workspace_name, referer), count in workspace_names_and_referers:
-            if found_workspace_name != workspace_name:
-                continue
-            referers.update({referer: count})
         common_referers = [
-            "%s (%d)" % (referer, count) for (referer, count) in referers.most_common(5)
+            "%s (%d)" % (referer, count)
+            for (referer, count) in referers.get(workspace_name, [])
         ]
         workspaces[workspace_name] = {
             "usage": workspace_count,
             "referers": " + ".join(common_referers),
         }
+        for key, window_usage in usage_per_window.items():
+            workspaces[workspace_name][key] = window_usage[workspace_name]
+        if log_format:
+            workspaces[workspace_name].update(
+                _workspace_performance(workspace_name, layer_usage, layer_histograms)
+            )
+        if sketches:
+            workspaces[workspace_name].update(
+                _sketch_info(workspace_name, workspace_sketches)
+            )
 
     result = []
 
     for workspace_name in datastores_info:
         if workspace_name not in workspaces:
             workspaces[workspace_name] = {"usage": "", "referers": ""}
+            for key in usage_per_window:
+                workspaces[workspace_name][key] = ""
 
     for workspace_name, workspace_info in workspaces.items():
         workspace_info["workspace_name"] = workspace_name
@@ -265,6 +1378,13 @@ def extract_workspaces_info(geoserver_configuration):
     return result
 
 
+def _valid_day(value):
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise argparse.ArgumentTypeError("not a YYYY-MM-DD date: %r" % value)
+
+
 def main():
     """Installed as bin/geoserver-info"""
     parser = argparse.ArgumentParser()
@@ -284,6 +1404,54 @@ def main():
         default=False,
         help="Print version",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="use_cache",
+        default=True,
+        help="Always parse all datastore files and logfiles, don't reuse anything",
+    )
+    parser.add_argument(
+        "--since",
+        type=_valid_day,
+        metavar="YYYY-MM-DD",
+        help="Only count the usage from this day on",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        action="append",
+        dest="windows",
+        metavar="DAYS",
+        help=(
+            "Also report the usage over the last DAYS days, can be repeated. "
+            "Without --since, the usage is counted over the longest window"
+        ),
+    )
+    parser.add_argument(
+        "--sketches",
+        action="store_true",
+        default=None,
+        help=(
+            "Also estimate the unique clients per workspace and take the top "
+            "referers from a fixed-size summary"
+        ),
+    )
+    parser.add_argument(
+        "--tiles",
+        metavar="FILE",
+        help=(
+            "Instead of the usage, write the most requested 256x256 EPSG:3857 "
+            "tiles per layer to FILE, to seed the tile cache with"
+        ),
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=100,
+        metavar="N",
+        help="Number of tiles per layer for --tiles (default: %(default)s)",
+    )
 
     options = parser.parse_args()
     if options.print_version:
@@ -294,6 +1462,8 @@ def main():
     else:
         loglevel = logging.WARN
     logging.basicConfig(level=loglevel, format="%(levelname)s: %(message)s")
+    if not options.use_cache:
+        cache.enabled = False
 
     if not os.path.exists(CONFIG_DIR):
         os.mkdir(CONFIG_DIR)
@@ -303,17 +1473,33 @@ def main():
     if not configuration:
         return
 
+    if options.tiles:
+        seeding_lists = {}
+        for geoserver_configuration in configuration:
+            seeding_lists[geoserver_configuration["geoserver_name"]] = hot_tiles(
+                geoserver_configuration["logfile"],
+                workers=geoserver_configuration.get("workers", 1),
+                since=options.since,
+                log_format=geoserver_configuration.get("log_format"),
+                top=options.top,
+            )
+        write_json(options.tiles, seeding_lists)
+        return
+
     result_for_serverinfo = {}
     # The result is a dict of a list of dicts. Key is the geoserver name, the
     # list is a list of workspaces, every workspace is a dict with
     # geoserver_name, active, etc.  xxx
     for geoserver_configuration in configuration:
-        workspaces = extract_workspaces_info(geoserver_configuration)
+        workspaces = extract_workspaces_info(
+            geoserver_configuration,
+            since=options.since,
+            windows=options.windows,
+            sketches=options.sketches,
+        )
         result_for_serverinfo[geoserver_configuration["geoserver_name"]] = workspaces
 
     if not result_for_serverinfo:
         return
 
-    open(OUTPUT_FILE, "w").write(
-        json.dumps(result_for_serverinfo, sort_keys=True, indent=4)
-    )
+    write_json(OUTPUT_FILE, result_for_serverinfo)
@@ -1,8 +1,10 @@
 """Extract information from haproxy config files.
 
 """
+from serverscripts import cache
+from serverscripts.utils import write_json
+
 import argparse
-import json
 import logging
 import os
 import re
@@ -108,6 +110,27 @@ def extract_sites(filename):
             }
 
 
+def extract_all_sites(filename):
+    """Return {name_protocol: site info} from the haproxy config file"""
+    result = {}
+    for site_info in extract_sites(filename):
+        name = site_info["name"]
+        protocol = site_info["protocol"]  # http or https
+        key = "_".join([name, protocol])
+        if key in result:
+            logger.error(
+                "Haproxy %s site %s from %s is already known",
+                protocol,
+                name,
+                filename,
+            )
+            # TODO: record this as an error for zabbix
+            continue
+
+        result[key] = site_info
+    return result
+
+
 def main():
     """Installed as bin/checkout-info"""
     parser = argparse.ArgumentParser()
@@ -127,6 +150,13 @@ def main():
         default=False,
         help="Print version",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="use_cache",
+        default=True,
+        help="Always parse the config file, don't reuse the previous result",
+    )
     options = parser.parse_args()
     if options.print_version:
         print(serverscripts.__version__)
@@ -136,26 +166,17 @@ def main():
     else:
         loglevel = logging.WARN
     logging.basicConfig(level=loglevel, format="%(levelname)s: %(message)s")
+    if not options.use_cache:
+        cache.enabled = False
 
-    result = {}
     if not os.path.exists(OUTPUT_DIR):
         os.mkdir(OUTPUT_DIR)
         logger.info("Created %s", OUTPUT_DIR)
     if not os.path.exists(HAPROXY_CFG):
         return
-    for site_info in extract_sites(HAPROXY_CFG):
-        name = site_info["name"]
-        protocol = site_info["protocol"]  # http or https
-        key = "_".join([name, protocol])
-        if key in result:
-            logger.error(
-                "Haproxy %s site %s from %s is already known",
-                protocol,
-                name,
-                HAPROXY_CFG,
-            )
-            # TODO: record this as an error for zabbix
-            continue
-
-        result[key] = site_info
-    open(OUTPUT_FILE, "w").write(json.dumps(result, sort_keys=True, indent=4))
+    inputs = cache.fingerprint([HAPROXY_CFG])
+    result = cache.lookup("haproxy", inputs)
+    if result is None:
+        result = extract_all_sites(HAPROXY_CFG)
+        cache.store("haproxy", inputs, result)
+    write_json(OUTPUT_FILE, result)
@@ -1,11 +1,13 @@
 """Extract information from nginx config files.
 
 """
+from serverscripts import cache
+from serverscripts.utils import write_file
+from serverscripts.utils import write_json
 from urllib.parse import urlparse
 
 import argparse
 import copy
-import json
 import logging
 import os
 import re
@@ -144,6 +146,38 @@ def extract_sites(filename):
             yield copy.deepcopy(site)
 
 
+def extract_all_sites(conf_filenames):
+    """Return site info from all config files, plus the number of errors
+
+    ``conf_filenames`` are filenames inside ``NGINX_DIR``.
+
+    """
+    result = {}
+    num_errors = 0
+    for conf_filename in conf_filenames:
+        try:
+            fullpath = os.path.join(NGINX_DIR, conf_filename)
+            for site_info in extract_sites(fullpath):
+                name = site_info["name"]
+                protocol = site_info["protocol"]  # http or https
+                key = "_".join([name, protocol])
+                if key in result:
+                    logger.error(
+                        "Nginx %s site %s from %s is already known",
+                        protocol,
+                        name,
+                        conf_filename,
+                    )
+                    num_errors += 1
+                    continue
+
+                result[key] = site_info
+        except:  # Bare except
+            num_errors += 1
+            logger.exception("Something went wrong when reading %s", fullpath)
+    return result, num_errors
+
+
 def main():
     """Installed as bin/checkout-info"""
     parser = argparse.ArgumentParser()
@@ -163,6 +197,13 @@ def main():
         default=False,
         help="Print version",
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="use_cache",
+        default=True,
+        help="Always parse the config files, don't reuse the previous result",
+    )
     options = parser.parse_args()
     if options.print_version:
         print(serverscripts.__version__)
@@ -172,38 +213,29 @@ def main():
     else:
         loglevel = logging.WARN
     logging.basicConfig(level=loglevel, format="%(levelname)s: %(message)s")
+    if not options.use_cache:
+        cache.enabled = False
 
-    result = {}
     if not os.path.exists(OUTPUT_DIR):
         os.mkdir(OUTPUT_DIR)
         logger.info("Created %s", OUTPUT_DIR)
     if not os.path.exists(NGINX_DIR):
         return
-    num_errors = 0
-    for conf_filename in os.listdir(NGINX_DIR):
-        if conf_filename.startswith("."):
-            continue
-        try:
-            fullpath = os.path.join(NGINX_DIR, conf_filename)
-            for site_info in extract_sites(fullpath):
-                name = site_info["name"]
-                protocol = site_info["protocol"]  # http or https
-                key = "_".join([name, protocol])
-                if key in result:
-                    logger.error(
-                        "Nginx %s site %s from %s is already known",
-                        protocol,
-                        name,
-                        conf_filename,
-                    )
-                    num_errors += 1
-                    continue
-
-                result[key] = site_info
-        except:  # Bare except
-            num_errors += 1
-            logger.exception("Something went wrong when reading %s", fullpath)
+    conf_filenames = [
+        conf_filename
+        for conf_filename in os.listdir(NGINX_DIR)
+        if not conf_filename.startswith(".")
+    ]
+    inputs = cache.fingerprint(
+        [os.path.join(NGINX_DIR, conf_filename) for conf_filename in conf_filenames]
+    )
+    cached = cache.lookup("nginx", inputs)
+    if cached is None:
+        result, num_errors = extract_all_sites(conf_filenames)
+        cache.store("nginx", inputs, {"result": result, "num_errors": num_errors})
+    else:
+        result, num_errors = cached["result"], cached["num_errors"]
 
-    open(OUTPUT_FILE, "w").write(json.dumps(result, sort_keys=True, indent=4))
+    write_json(OUTPUT_FILE, result)
     zabbix_file = os.path.join(VAR_DIR, "nens.nginx_sites.warnings")
-    open(zabbix_file, "w").write(str(num_errors))
+    write_file(zabbix_file, str(num_errors))
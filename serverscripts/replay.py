@@ -0,0 +1,399 @@
+"""Record a collector run on a server and replay it somewhere else.
+
+Every collector depends on the commands it runs (git, pip, docker, psql) and
+on files in ``/etc``, ``/srv`` and ``/var/log``. That makes it hard to find
+out why a collector is slow on a specific server. So::
+
+    $ serverscripts-replay record checkouts /tmp/checkouts-bundle
+
+runs checkout-info like the cronjob does, but also stores every command with
+its output, exit code and duration plus a copy of every file it looked at
+into the bundle directory. Copy the bundle to your laptop and::
+
+    $ serverscripts-replay replay checkouts /tmp/checkouts-bundle
+
+runs checkout-info against the bundle: the files are read from the bundle
+and the recorded output is returned instead of running the commands. The
+fact files end up in a temporary directory. By default the commands take no
+time, so you measure serverscripts' own work. With ``--timings`` every
+command takes as long as it did on the server.
+
+The cache (see ``cache.py``) is disabled during both, otherwise a recorded run
+might not read the configuration files at all.
+
+Recording works by temporarily wrapping ``open()``, ``os.stat()``,
+``os.lstat()``, ``os.listdir()`` and ``os.scandir()``: it is a tool for
+developers, don't use it in a cronjob.
+
+"""
+from serverscripts import cache
+from serverscripts import script
+from serverscripts import utils
+
+import argparse
+import builtins
+import collections
+import importlib
+import json
+import logging
+import os
+import serverscripts
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+
+ROOTS = ["/etc/", "/srv/", "/var/log/"]
+INFO_FILE = "bundle.json"
+FILES_DIR = "files"
+COMMANDS_DIR = "commands"
+# Module attributes that point at where a collector writes its output.
+OUTPUT_ATTRIBUTES = ["OUTPUT_DIR", "VAR_DIR"]
+NOT_RECORDED = 127
+
+logger = logging.getLogger(__name__)
+
+_original_open = builtins.open
+_original_stat = os.stat
+_original_lstat = os.lstat
+_original_listdir = os.listdir
+_original_scandir = os.scandir
+
+
+def _is_path(path):
+    # Not file descriptors, for instance.
+    return isinstance(path, str)
+
+
+def _absolute(path):
+    return os.path.abspath(path)
+
+
+class Recorder:
+    """Store commands plus the files that are looked at into a bundle"""
+
+    def __init__(self, bundle_dir, roots):
+        self.bundle_dir = os.path.abspath(bundle_dir)
+        self.files_dir = os.path.join(bundle_dir, FILES_DIR)
+        self.roots = roots
+        self.commands = []
+        self.seen = set()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(bundle_dir, COMMANDS_DIR))
+        os.makedirs(self.files_dir)
+
+    def recorded_path(self, path):
+        if not _is_path(path):
+            return
+        path = _absolute(path)
+        if not any((path + "/").startswith(root) for root in self.roots):
+            return
+        if (path + "/").startswith(self.bundle_dir + "/"):
+            # Our own bookkeeping.
+            return
+        return path
+
+    def start(self, argv, cwd):
+        return argv, cwd
+
+    def finished(self, argv, cwd, output, error_output, exit_code, duration):
+        with self.lock:
+            number = len(self.commands)
+            self.commands.append(
+                {
+                    "argv": argv,
+                    "cwd": _absolute(cwd),
+                    "exit_code": exit_code,
+                    "duration": duration,
+                }
+            )
+        base = os.path.join(self.bundle_dir, COMMANDS_DIR, str(number))
+        with _original_open(base + ".out", "w") as f:
+            f.write(output)
+        with _original_open(base + ".err", "w") as f:
+            f.write(error_output)
+
+    def _copy_entry(self, path, with_content):
+        """Recreate path in the bundle: a directory, symlink or (empty) file"""
+        with self.lock:
+            key = (path, with_content)
+            if key in self.seen:
+                return
+            self.seen.add(key)
+        target = self.files_dir + path
+        try:
+            mode = _original_lstat(path).st_mode
+        except OSError:
+            return
+        if stat.S_ISLNK(mode):
+            if not os.path.lexists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.symlink(os.readlink(path), target)
+        elif stat.S_ISDIR(mode):
+            os.makedirs(target, exist_ok=True)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if with_content:
+                with _original_open(path, "rb") as source:
+                    with _original_open(target, "wb") as destination:
+                        shutil.copyfileobj(source, destination)
+            elif not os.path.exists(target):
+                _original_open(target, "wb").close()
+
+    def open(self, file, mode="r", *args, **kwargs):
+        result = _original_open(file, mode, *args, **kwargs)
+        path = self.recorded_path(file)
+        if path and not any(character in mode for character in "wax+"):
+            self._copy_entry(path, with_content=True)
+        return result
+
+    def stat(self, path, *args, **kwargs):
+        result = _original_stat(path, *args, **kwargs)
+        recorded_path = self.recorded_path(path)
+        if recorded_path:
+            self._copy_entry(recorded_path, with_content=False)
+        return result
+
+    def lstat(self, path, *args, **kwargs):
+        result = _original_lstat(path, *args, **kwargs)
+        recorded_path = self.recorded_path(path)
+        if recorded_path:
+            self._copy_entry(recorded_path, with_content=False)
+        return result
+
+    def listdir(self, path="."):
+        result = _original_listdir(path)
+        recorded_path = self.recorded_path(path)
+        if recorded_path:
+            for name in result:
+                self._copy_entry(os.path.join(recorded_path, name), False)
+        return result
+
+    def scandir(self, path="."):
+        recorded_path = self.recorded_path(path)
+        if recorded_path:
+            for name in _original_listdir(path):
+                self._copy_entry(os.path.join(recorded_path, name), False)
+        return _original_scandir(path)
+
+    def save(self, collector):
+        info = {
+            "collector": collector,
+            "hostname": os.uname().nodename,
+            "recorded": time.time(),
+            "roots": self.roots,
+            "commands": self.commands,
+        }
+        with _original_open(os.path.join(self.bundle_dir, INFO_FILE), "w") as f:
+            json.dump(info, f, indent=4)
+
+
+class Replayer:
+    """Serve commands and files from a bundle"""
+
+    def __init__(self, bundle_dir, timings=False):
+        self.bundle_dir = os.path.abspath(bundle_dir)
+        self.files_dir = os.path.join(self.bundle_dir, FILES_DIR)
+        self.timings = timings
+        with _original_open(os.path.join(bundle_dir, INFO_FILE)) as f:
+            info = json.load(f)
+        self.roots = info["roots"]
+        self.recorded = collections.defaultdict(collections.deque)
+        for number, command in enumerate(info["commands"]):
+            command["number"] = number
+            self.recorded[tuple(command["argv"])].append(command)
+        self.lock = threading.Lock()
+        self.not_recorded = []
+
+    def translate(self, path):
+        if not _is_path(path):
+            return path
+        absolute_path = _absolute(path)
+        if not any((absolute_path + "/").startswith(root) for root in self.roots):
+            return path
+        return self.files_dir + absolute_path
+
+    def start(self, argv, cwd):
+        """Return a command that outputs what the original command did"""
+        with self.lock:
+            recorded = self.recorded.get(tuple(argv))
+            command = recorded.popleft() if recorded else None
+            if command is None:
+                self.not_recorded.append(argv)
+        if command is None:
+            logger.warning("Command %s wasn't recorded", " ".join(argv))
+            replacement = 'echo "Not recorded: $1" >&2; exit %s' % NOT_RECORDED
+            return ["/bin/sh", "-c", replacement, "replay", " ".join(argv)], "/"
+        base = os.path.join(self.bundle_dir, COMMANDS_DIR, str(command["number"]))
+        duration = command["duration"] if self.timings else 0
+        exit_code = command["exit_code"]
+        if exit_code < 0:
+            # Killed by a signal (timeout), the shell can't exit with that.
+            exit_code = 128 - exit_code
+        replacement = 'sleep "$3"; cat "$1"; cat "$2" >&2; exit "$4"'
+        return (
+            [
+                "/bin/sh",
+                "-c",
+                replacement,
+                "replay",
+                base + ".out",
+                base + ".err",
+                "%.3f" % duration,
+                str(exit_code),
+            ],
+            "/",
+        )
+
+    def finished(self, argv, cwd, output, error_output, exit_code, duration):
+        pass
+
+    def open(self, file, *args, **kwargs):
+        return _original_open(self.translate(file), *args, **kwargs)
+
+    def stat(self, path, *args, **kwargs):
+        return _original_stat(self.translate(path), *args, **kwargs)
+
+    def lstat(self, path, *args, **kwargs):
+        return _original_lstat(self.translate(path), *args, **kwargs)
+
+    def listdir(self, path="."):
+        return _original_listdir(self.translate(path))
+
+    def scandir(self, path="."):
+        return _original_scandir(self.translate(path))
+
+
+def _run_main(module, hook):
+    """Run the collector's main() with the hook installed"""
+    utils.stats.clear()
+    utils.forget()
+    cache_enabled = cache.enabled
+    cache.enabled = False
+    utils.command_hook = hook
+    builtins.open = hook.open
+    os.stat = hook.stat
+    os.lstat = hook.lstat
+    os.listdir = hook.listdir
+    os.scandir = hook.scandir
+    original_argv = sys.argv
+    sys.argv = [module.__name__.split(".")[-1] + "-info"]
+    started = time.time()
+    try:
+        module.main()
+    except SystemExit:
+        pass
+    finally:
+        duration = time.time() - started
+        sys.argv = original_argv
+        builtins.open = _original_open
+        os.stat = _original_stat
+        os.lstat = _original_lstat
+        os.listdir = _original_listdir
+        os.scandir = _original_scandir
+        utils.command_hook = None
+        cache.enabled = cache_enabled
+    return duration
+
+
+def record(module_name, bundle_dir, roots=ROOTS):
+    """Run the collector and record it into the bundle, return the duration"""
+    module = importlib.import_module(module_name)
+    recorder = Recorder(bundle_dir, roots)
+    duration = _run_main(module, recorder)
+    recorder.save(module_name)
+    logger.info(
+        "Recorded %s commands and %s files and directories in %.2fs",
+        len(recorder.commands),
+        len(recorder.seen),
+        duration,
+    )
+    return duration
+
+
+def replay(module_name, bundle_dir, output_dir, timings=False):
+    """Run the collector against the bundle, return the duration
+
+    The collector's output ends up in ``output_dir``.
+
+    """
+    module = importlib.import_module(module_name)
+    replayer = Replayer(bundle_dir, timings=timings)
+    originals = {}
+    for attribute in OUTPUT_ATTRIBUTES + ["OUTPUT_FILE"]:
+        if hasattr(module, attribute):
+            originals[attribute] = getattr(module, attribute)
+    for attribute in OUTPUT_ATTRIBUTES:
+        if attribute in originals:
+            setattr(module, attribute, output_dir)
+    if "OUTPUT_FILE" in originals:
+        output_file = os.path.basename(originals["OUTPUT_FILE"])
+        module.OUTPUT_FILE = os.path.join(output_dir, output_file)
+    try:
+        duration = _run_main(module, replayer)
+    finally:
+        for attribute, value in originals.items():
+            setattr(module, attribute, value)
+    for argv in replayer.not_recorded:
+        logger.warning("Not recorded: %s", " ".join(argv))
+    logger.info("Replayed in %.2fs, output is in %s", duration, output_dir)
+    return duration
+
+
+def main():
+    """Installed as bin/serverscripts-replay"""
+    collectors = {name: module_name for name, module_name, _ in script.COLLECTORS}
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("collector", choices=sorted(collectors))
+    parser.add_argument("bundle", help="Directory for the recording")
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        default=False,
+        help="Verbose output",
+    )
+    parser.add_argument(
+        "-V",
+        "--version",
+        action="version",
+        version=serverscripts.__version__,
+        help="Print version",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        dest="timings",
+        default=False,
+        help="Replay: let the commands take as long as they did when recording",
+    )
+    parser.add_argument(
+        "--output-dir",
+        dest="output_dir",
+        default=None,
+        help="Replay: where to write the output (default: a temporary directory)",
+    )
+    options = parser.parse_args()
+    if options.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.INFO
+    logging.basicConfig(level=loglevel, format="%(levelname)s: %(message)s")
+
+    module_name = collectors[options.collector]
+    if options.mode == "record":
+        if os.path.exists(options.bundle):
+            parser.error("%s already exists" % options.bundle)
+        duration = record(module_name, options.bundle)
+    else:
+        output_dir = options.output_dir or tempfile.mkdtemp(prefix="replay-")
+        duration = replay(
+            module_name, options.bundle, output_dir, timings=options.timings
+        )
+    print("%s: %.2fs" % (options.collector, duration))
+    print(json.dumps(utils.stats, sort_keys=True))
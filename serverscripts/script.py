@@ -1,14 +1,293 @@
 """Run-everything script that collects all info.
 
-Better than having 5 different cronjobs :-)"""
+Better than having 5 different cronjobs :-)
 
-import serverscripts.apache
-import serverscripts.checkouts
-import serverscripts.database
-import serverscripts.docker
-import serverscripts.geoserver
-import serverscripts.haproxy
-import serverscripts.nginx
+Every collector runs in its own (forked) process. A bounded number of them
+runs at the same time and every collector has its own wall-clock timeout: a
+hanging ``docker exec`` only kills the docker collector, the rest still writes
+its fact files.
+
+Per collector, the wall time, cpu time, peak memory and number of subprocesses
+is stored in ``collectors.fact`` (and in zabbix files), so that we can see
+which collector eats our cron window.
+
+The collector modules are only imported (in the child process) when a cheap
+probe says they are useful on this server: no need to import xml and gzip
+handling for geoserver on a server without geoserver. Keep the import of this
+module itself cheap: see ``benchmarks/importtime.py``.
+
+"""
+from multiprocessing.connection import wait
+from serverscripts import cache
+from serverscripts import utils
+
+import argparse
+import importlib
+import logging
+import multiprocessing
+import os
+import resource
+import serverscripts
+import signal
+import sys
+import time
+
+
+COLLECTORS = [
+    # (name, module, path that must exist for the collector to be useful). The
+    # path is the same one the module itself checks, see test_script.py.
+    ("apache", "serverscripts.apache", "/etc/apache2/sites-enabled"),
+    ("checkouts", "serverscripts.checkouts", "/srv/"),
+    ("database", "serverscripts.database", "/etc/postgresql"),
+    ("docker", "serverscripts.docker", "/etc/docker"),
+    ("geoserver", "serverscripts.geoserver", "/etc/serverscripts/geoserver.json"),
+    ("haproxy", "serverscripts.haproxy", "/etc/haproxy/haproxy.cfg"),
+    ("nginx", "serverscripts.nginx", "/etc/nginx/sites-enabled"),
+]
+VAR_DIR = "/var/local/serverscripts"
+OUTPUT_DIR = "/var/local/serverinfo-facts"
+OUTPUT_FILE = os.path.join(OUTPUT_DIR, "collectors.fact")
+MAX_WORKERS = 4
+# Seconds a terminated collector gets to kill its commands, see kill_collector().
+KILL_GRACE = 5
+DEFAULT_TIMEOUT = 5 * 60  # Seconds.
+TIMEOUTS = {
+    # Collectors that are expected to take longer than the default.
+    "checkouts": 15 * 60,
+    "geoserver": 30 * 60,
+}
+OK = "ok"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+NOT_AVAILABLE = "not available"
+ZABBIX_METRICS = [
+    "wall_time",
+    "cpu_time",
+    "peak_rss",
+    "subprocesses",
+    "subprocess_output_bytes",
+]
+
+
+logger = logging.getLogger(__name__)
+
+
+def _resource_usage():
+    """Return resource usage of the current process"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage = {
+        # Including the cpu time of the subprocesses we started.
+        "cpu_time": own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        "peak_rss": own.ru_maxrss * 1024,  # Linux reports kilobytes.
+    }
+    usage.update(utils.stats)
+    return usage
+
+
+def is_available(probe_path):
+    """Return whether the collector is useful on this server (cheap check)"""
+    return os.path.exists(probe_path)
+
+
+def _terminate(signum, frame):
+    """Kill the commands of the collector and exit right away"""
+    utils.kill_commands()
+    os._exit(128 + signum)
+
+
+def _run_collector(name, module_name, verbose, connection):
+    """Run the collector's main() inside the (forked) child process
+
+    The collector gets its own process group, so that we can kill it including
+    any subprocesses it started when it times out. The commands it runs have
+    their own process group (see ``utils.run_command()``), so on SIGTERM the
+    collector kills those itself. Afterwards, the resource usage is sent back
+    to the parent through ``connection``.
+
+    """
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGTERM, _terminate)
+    utils.stats.clear()
+    sys.argv = [name + "-info"]
+    if verbose:
+        sys.argv.append("--verbose")
+    exit_code = 0
+    try:
+        importlib.import_module(module_name).main()
+    except SystemExit as e:
+        exit_code = e.code
+    except Exception:
+        logger.exception("Collector %s failed", name)
+        exit_code = 1
+    connection.send(_resource_usage())
+    connection.close()
+    sys.exit(exit_code)
+
+
+def start_collector(name, module_name, verbose=False):
+    """Start the collector in a separate process and return that process
+
+    The collector module is imported in the child process. If the parent
+    already imported it, the child gets it for free.
+
+    """
+    context = multiprocessing.get_context("fork")
+    receiving_end, sending_end = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_run_collector,
+        args=(name, module_name, verbose, sending_end),
+        name=name,
+    )
+    process.start()
+    sending_end.close()
+    process.started = time.time()
+    process.connection = receiving_end
+    logger.debug("Started collector %s (pid %s)", name, process.pid)
+    return process
+
+
+def kill_collector(process):
+    """Kill the collector process plus everything it started
+
+    The collector first gets a SIGTERM, so that it can kill the commands it
+    runs in their own process group. Whatever still runs after
+    ``KILL_GRACE`` seconds gets a SIGKILL.
+
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except OSError:
+        # Already gone or it didn't manage to create its own group yet.
+        process.terminate()
+    process.join(KILL_GRACE)
+    try:
+        # Including anything that's left in its process group.
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGKILL)
+    process.join()
+    process.connection.close()
+
+
+def finish_collector(process):
+    """Return info on the finished collector: status plus resource usage"""
+    info = {"wall_time": time.time() - process.started}
+    try:
+        info.update(process.connection.recv())
+    except EOFError:
+        # The collector died before it could report.
+        pass
+    process.join()
+    process.connection.close()
+    info["status"] = OK if process.exitcode == 0 else FAILED
+    info["success"] = info["status"] == OK
+    return info
+
+
+def wait_for_collectors(running, timeouts, until=None):
+    """Wait for running collectors, return {name: info} of the finished ones
+
+    ``running`` is a {name: process} dict, finished (or killed) collectors are
+    removed from it. We wait until at least one collector finishes, one of them
+    hits its timeout or until the ``until`` timestamp is reached, whichever
+    comes first.
+
+    """
+    deadlines = {
+        name: process.started + timeouts.get(name, DEFAULT_TIMEOUT)
+        for name, process in running.items()
+    }
+    wake_up = min(list(deadlines.values()) + ([until] if until else []))
+    wait(
+        [process.sentinel for process in running.values()],
+        timeout=max(0, wake_up - time.time()),
+    )
+
+    result = {}
+    now = time.time()
+    for name, process in list(running.items()):
+        if not process.is_alive():
+            result[name] = finish_collector(process)
+            if result[name]["success"]:
+                logger.info(
+                    "Collector %s finished in %.1fs", name, result[name]["wall_time"]
+                )
+            else:
+                logger.error(
+                    "Collector %s failed with exit code %s after %.1fs",
+                    name,
+                    process.exitcode,
+                    result[name]["wall_time"],
+                )
+            del running[name]
+        elif now >= deadlines[name]:
+            kill_collector(process)
+            result[name] = {
+                "status": TIMED_OUT,
+                "success": False,
+                "wall_time": now - process.started,
+            }
+            logger.error(
+                "Collector %s timed out after %ss, killed it",
+                name,
+                timeouts.get(name, DEFAULT_TIMEOUT),
+            )
+            del running[name]
+    return result
+
+
+def run_collectors(collectors, max_workers=MAX_WORKERS, timeouts=None):
+    """Run the collectors concurrently and return {name: info}
+
+    The info is a dict with the status (``OK``, ``FAILED``, ``TIMED_OUT``),
+    the wall time and the resource usage reported by the collector.
+
+    Collectors whose probe path doesn't exist are skipped (and never
+    imported), they're reported as ``NOT_AVAILABLE``.
+
+    At most ``max_workers`` collectors run at the same time. A collector that
+    runs longer than its timeout (see ``TIMEOUTS``) is killed and reported.
+    As the fact files are written atomically, a killed collector leaves its
+    previous fact file intact.
+
+    """
+    if timeouts is None:
+        timeouts = TIMEOUTS
+    verbose = logger.getEffectiveLevel() <= logging.DEBUG
+    max_workers = max(1, max_workers)
+    pending = []
+    running = {}  # {name: process}
+    result = {}
+    for name, module_name, probe_path in collectors:
+        if is_available(probe_path):
+            pending.append((name, module_name))
+        else:
+            logger.debug("Skipping %s: %s doesn't exist", name, probe_path)
+            result[name] = {"status": NOT_AVAILABLE, "success": True}
+    while pending or running:
+        while pending and len(running) < max_workers:
+            name, module_name = pending.pop(0)
+            running[name] = start_collector(name, module_name, verbose=verbose)
+        result.update(wait_for_collectors(running, timeouts))
+    return result
+
+
+def write_collectors_info(collectors_info):
+    """Write collectors.fact plus per-collector zabbix files"""
+    if not os.path.exists(OUTPUT_DIR):
+        os.mkdir(OUTPUT_DIR)
+        logger.info("Created %s", OUTPUT_DIR)
+    utils.write_json(OUTPUT_FILE, collectors_info)
+    for name, info in collectors_info.items():
+        for metric in ZABBIX_METRICS:
+            zabbix_file = os.path.join(
+                VAR_DIR, "nens.collector_%s_%s.info" % (name, metric)
+            )
+            utils.write_file(zabbix_file, str(info.get(metric, 0)))
+        zabbix_file = os.path.join(VAR_DIR, "nens.collector_%s.errors" % name)
+        utils.write_file(zabbix_file, str(int(not info["success"])))
 
 
 def main():
@@ -19,20 +298,63 @@ def main():
     info-gathering to a separate script, but for now it is OK. So... cifsfixer
     is run separately by another cronjob.
 
-    geoserver-info also isn't being run as it is quite expensive: it reads
-    potentially huge nginx access log collections.
-
     """
-    for module in [
-        serverscripts.apache,
-        serverscripts.checkouts,
-        serverscripts.database,
-        serverscripts.docker,
-        serverscripts.geoserver,
-        serverscripts.haproxy,
-        serverscripts.nginx,
-    ]:
-        try:
-            module.main()
-        except Exception as e:
-            print(e)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        dest="verbose",
+        default=False,
+        help="Verbose output",
+    )
+    parser.add_argument(
+        "-V",
+        "--version",
+        action="store_true",
+        dest="print_version",
+        default=False,
+        help="Print version",
+    )
+    parser.add_argument(
+        "-j",
+        "--max-workers",
+        type=int,
+        dest="max_workers",
+        default=MAX_WORKERS,
+        help="Number of collectors to run at the same time (default: %s)" % MAX_WORKERS,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        dest="timeout",
+        default=None,
+        help="Timeout in seconds for every collector (default: per collector)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        dest="use_cache",
+        default=True,
+        help="Don't let collectors reuse previous results for unchanged inputs",
+    )
+    options = parser.parse_args()
+    if options.print_version:
+        print(serverscripts.__version__)
+        sys.exit()
+    if options.verbose:
+        loglevel = logging.DEBUG
+    else:
+        loglevel = logging.WARN
+    logging.basicConfig(level=loglevel, format="%(levelname)s: %(message)s")
+    if not options.use_cache:
+        # The collectors' processes inherit this.
+        cache.enabled = False
+
+    timeouts = TIMEOUTS
+    if options.timeout:
+        timeouts = {name: options.timeout for name, module, probe in COLLECTORS}
+    collectors_info = run_collectors(
+        COLLECTORS, max_workers=options.max_workers, timeouts=timeouts
+    )
+    write_collectors_info(collectors_info)
@@ -0,0 +1,192 @@
+"""Summaries of big streams of items in a fixed amount of memory.
+
+Counting everything exactly, like every tile that was ever requested, takes
+memory that grows with the logfiles. The summaries here answer one question
+approximately instead, with a known error, in memory that doesn't grow.
+
+"""
+import hashlib
+import math
+import sys
+
+
+class SpaceSaving:
+    """The most common items of a stream, the "Space-Saving" algorithm
+
+    At most ``capacity`` items are counted. A new item takes the place of the
+    least counted one and inherits its count as (possible) error. An item's
+    count is never too low and at most ``error`` too high. Every item that
+    occurs more than ``total / capacity`` times is guaranteed to be there.
+
+    See Metwally, Agrawal and El Abbadi, "Efficient computation of frequent
+    and top-k elements in data streams" (2005).
+
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # count -> items with that count, to find the least counted one fast.
+        self._items_per_count = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _set_count(self, item, count):
+        old_count = self.counts.get(item)
+        if old_count is not None:
+            items = self._items_per_count[old_count]
+            items.discard(item)
+            if not items:
+                del self._items_per_count[old_count]
+        self.counts[item] = count
+        self._items_per_count.setdefault(count, set()).add(item)
+
+    def memory(self):
+        """Return the (approximate) memory use in bytes"""
+        result = sum(
+            sys.getsizeof(container)
+            for container in (self.counts, self.errors, self._items_per_count)
+        )
+        result += sum(sys.getsizeof(items) for items in self._items_per_count.values())
+        result += sum(sys.getsizeof(item) for item in self.counts)
+        return result
+
+    def minimum(self):
+        """Return the lowest count, which is 0 if we're not full yet"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self._items_per_count)
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self._set_count(item, self.counts[item] + count)
+            return
+        error = 0
+        if len(self.counts) >= self.capacity:
+            error = min(self._items_per_count)
+            items = self._items_per_count[error]
+            replaced = items.pop()
+            if not items:
+                del self._items_per_count[error]
+            del self.counts[replaced]
+            del self.errors[replaced]
+        self.errors[item] = error
+        self._set_count(item, error + count)
+
+    def most_common(self, number=None):
+        """Return [(item, count, error), ...], the most common first"""
+        items = sorted(self.counts, key=self.counts.get, reverse=True)
+        return [(item, self.counts[item], self.errors[item]) for item in items][:number]
+
+    def to_json(self):
+        """Return a json-compatible dict, the items must be json-compatible"""
+        return {
+            "capacity": self.capacity,
+            "total": self.total,
+            "items": [list(item) for item in self.most_common()],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """Return the summary from a ``to_json()`` dict"""
+        result = cls(data["capacity"])
+        result.total = data["total"]
+        for item, count, error in data["items"]:
+            result.errors[item] = error
+            result._set_count(item, count)
+        return result
+
+    def merge(self, other):
+        """Return a new summary of both streams
+
+        An item that's missing in one of the summaries could have occurred
+        there as often as that summary's minimum, so that's added to its count
+        and error (Agarwal et al., "Mergeable summaries", 2012).
+
+        """
+        result = SpaceSaving(self.capacity)
+        result.total = self.total + other.total
+        minimum, other_minimum = self.minimum(), other.minimum()
+        combined = {}
+        for item in set(self.counts) | set(other.counts):
+            combined[item] = (
+                self.counts.get(item, minimum) + other.counts.get(item, other_minimum),
+                self.errors.get(item, minimum) + other.errors.get(item, other_minimum),
+            )
+        most_common = sorted(combined, key=lambda item: combined[item], reverse=True)
+        for item in most_common[: self.capacity]:
+            count, error = combined[item]
+            result.errors[item] = error
+            result._set_count(item, count)
+        return result
+
+
+class HyperLogLog:
+    """Estimate the number of distinct items, the "HyperLogLog" algorithm
+
+    The items are hashed to ``2 ** precision`` one-byte registers, which is
+    all the memory that's used. The relative standard error of ``count()`` is
+    ``1.04 / sqrt(2 ** precision)``: 3.25% (1 KB) for the default precision.
+
+    See Flajolet, Fusy, Gandouet and Meunier, "HyperLogLog: the analysis of a
+    near-optimal cardinality estimation algorithm" (2007).
+
+    """
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.registers = bytearray(2**precision)
+
+    @property
+    def error(self):
+        """Return the relative standard error of the estimate"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def memory(self):
+        """Return the (approximate) memory use in bytes"""
+        return sys.getsizeof(self.registers)
+
+    def add(self, item):
+        """Add an item (bytes or str)"""
+        if isinstance(item, str):
+            item = item.encode("utf-8")
+        # 64 bits is plenty, no large range correction needed.
+        hashed = int.from_bytes(hashlib.md5(item).digest()[:8], "big")
+        bits = 64 - self.precision
+        index = hashed >> bits
+        # The position of the first 1 bit in the remaining bits.
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        """Return the estimated number of distinct items"""
+        size = len(self.registers)
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimate = alpha * size * size / sum(2.0**-rank for rank in self.registers)
+        empty = self.registers.count(0)
+        if estimate <= 2.5 * size and empty:
+            # Small numbers are estimated better from the empty registers.
+            estimate = size * math.log(size / empty)
+        return round(estimate)
+
+    def to_json(self):
+        """Return a json-compatible dict"""
+        return {"precision": self.precision, "registers": self.registers.hex()}
+
+    @classmethod
+    def from_json(cls, data):
+        """Return the estimator from a ``to_json()`` dict"""
+        result = cls(data["precision"])
+        result.registers = bytearray.fromhex(data["registers"])
+        return result
+
+    def merge(self, other):
+        """Return a new estimator of the items of both"""
+        result = HyperLogLog(self.precision)
+        result.registers = bytearray(map(max, self.registers, other.registers))
+        return result
@@ -0,0 +1,57 @@
+from serverscripts import agent
+from serverscripts.tests.test_script import fake_collector
+from unittest import TestCase
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import time
+
+
+def _ok():
+    pass
+
+
+class AgentTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_load_config_defaults(self):
+        intervals = agent.load_config(os.path.join(self.tempdir, "agent.json"))
+        self.assertEqual(intervals, agent.INTERVALS)
+
+    def test_load_config(self):
+        config_file = os.path.join(self.tempdir, "agent.json")
+        open(config_file, "w").write(json.dumps({"checkouts": 1800, "reinout": 1}))
+        intervals = agent.load_config(config_file)
+        self.assertEqual(intervals["checkouts"], 1800)
+        self.assertEqual(intervals["cifsfixer"], agent.INTERVALS["cifsfixer"])
+        self.assertNotIn("reinout", intervals)
+
+    def test_run_schedule(self):
+        collectors = [fake_collector("fast", _ok), fake_collector("slow", _ok)]
+        output_file = os.path.join(self.tempdir, "collectors.fact")
+        with mock.patch.multiple(
+            "serverscripts.script",
+            VAR_DIR=self.tempdir,
+            OUTPUT_DIR=self.tempdir,
+            OUTPUT_FILE=output_file,
+        ):
+            num_runs = agent.run_schedule(
+                collectors, {"fast": 0.2, "slow": 60}, until=time.time() + 1.1
+            )
+        self.assertGreaterEqual(num_runs["fast"], 3)
+        self.assertEqual(num_runs["slow"], 1)
+        self.assertTrue(json.load(open(output_file))["slow"]["success"])
+
+    def test_unavailable_collector_is_not_run(self):
+        collectors = [("missing", "serverscripts.tests.not_there", "/does/not/exist")]
+        num_runs = agent.run_schedule(
+            collectors, {"missing": 0.2}, until=time.time() + 0.5
+        )
+        self.assertEqual(num_runs["missing"], 0)
@@ -0,0 +1,77 @@
+from serverscripts import cache
+from serverscripts import utils
+from unittest import TestCase
+
+import mock
+import os
+import shutil
+import tempfile
+
+
+class CacheTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+        self.patcher = mock.patch.object(cache, "CACHE_DIR", self.cache_dir)
+        self.patcher.start()
+        self.input_file = os.path.join(self.tempdir, "haproxy.cfg")
+        open(self.input_file, "w").write("something")
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tempdir)
+
+    def test_fingerprint_changes(self):
+        before = cache.fingerprint([self.input_file])
+        self.assertEqual(before, cache.fingerprint([self.input_file]))
+        open(self.input_file, "w").write("something longer")
+        self.assertNotEqual(before, cache.fingerprint([self.input_file]))
+
+    def test_fingerprint_missing_file(self):
+        missing = os.path.join(self.tempdir, "missing")
+        self.assertEqual(cache.fingerprint([missing]), [[missing, None, None, None]])
+
+    def test_lookup_and_store(self):
+        inputs = cache.fingerprint([self.input_file])
+        self.assertIsNone(cache.lookup("haproxy", inputs))
+        cache.store("haproxy", inputs, {"site_http": {"name": "site"}})
+        self.assertEqual(
+            cache.lookup("haproxy", inputs), {"site_http": {"name": "site"}}
+        )
+
+    def test_hit_writes_nothing(self):
+        inputs = cache.fingerprint([self.input_file])
+        cache.store("haproxy", inputs, {})
+        with mock.patch.object(utils, "write_file") as mock_write_file:
+            self.assertEqual(cache.lookup("haproxy", inputs), {})
+            self.assertFalse(mock_write_file.called)
+
+    def test_changed_inputs(self):
+        inputs = cache.fingerprint([self.input_file])
+        cache.store("haproxy", inputs, {})
+        open(self.input_file, "w").write("changed")
+        self.assertIsNone(cache.lookup("haproxy", cache.fingerprint([self.input_file])))
+
+    def test_disabled(self):
+        inputs = cache.fingerprint([self.input_file])
+        cache.store("haproxy", inputs, {})
+        with mock.patch.object(cache, "enabled", False):
+            self.assertIsNone(cache.lookup("haproxy", inputs))
+
+    def test_stats(self):
+        inputs = cache.fingerprint([self.input_file])
+        with mock.patch.object(utils, "stats", utils.Counter()):
+            cache.lookup("haproxy", inputs)
+            cache.store("haproxy", inputs, {})
+            cache.lookup("haproxy", inputs)
+            self.assertEqual(utils.stats["cache_misses"], 1)
+            self.assertEqual(utils.stats["cache_hits"], 1)
+
+    def test_stats_from_threads(self):
+        inputs = cache.fingerprint([self.input_file])
+        cache.store("haproxy", inputs, {})
+        with mock.patch.object(utils, "stats", utils.Counter()):
+            utils.run_concurrently(
+                lambda _: cache.lookup("haproxy", inputs), range(200)
+            )
+            self.assertEqual(utils.stats["cache_hits"], 200)
@@ -1,11 +1,16 @@
+from serverscripts import cache
 from serverscripts import checkouts
+from serverscripts import utils
 from unittest import TestCase
 
+import json
 import mock
 import os
 import shutil
 import sys
 import tempfile
+import time
+import zipfile
 
 
 OUR_PYTHON_VERSION = "%s.%s.%s" % (
@@ -59,6 +64,42 @@ class VenvPipenvTestCase(TestCase):
         self.assertIn("pip", output)
         self.assertEqual(output["python"], OUR_PYTHON_VERSION)
 
+    def test_pipenv_venv_same_as_pipenv(self):
+        output, error = utils.run_command(
+            [sys.executable, "-m", "pipenv", "--venv"], cwd=self.dir_with_pipenv
+        )
+        self.assertEqual(checkouts.pipenv_venv(self.dir_with_pipenv), output.strip())
+
+    def test_pipenv_info_without_pipenv(self):
+        with mock.patch("serverscripts.checkouts.run_command") as mock_run_command:
+            output = checkouts.pipenv_info(self.dir_with_pipenv)
+            self.assertFalse(mock_run_command.called)
+        self.assertIn("pip", output)
+        self.assertEqual(output["python"], OUR_PYTHON_VERSION)
+
+    def test_lockfile_drift(self):
+        pkgs = checkouts.pipenv_info(self.dir_with_pipenv)
+        self.assertEqual(checkouts.lockfile_drift(self.dir_with_pipenv, pkgs), {})
+        lock = {
+            "default": {
+                "Pip": {"version": "==0.1"},
+                "not-installed": {"version": "==1.0"},
+                "from-git": {"git": "https://github.com/nens/from-git.git"},
+            }
+        }
+        lockfile = os.path.join(self.dir_outside_proj, "Pipfile.lock")
+        with open(lockfile, "w") as f:
+            json.dump(lock, f)
+        self.assertEqual(
+            checkouts.lockfile_drift(self.dir_outside_proj, pkgs),
+            {
+                "Pip": {"locked": "0.1", "installed": pkgs["pip"]},
+                "not-installed": {"locked": "1.0", "installed": None},
+            },
+        )
+        os.remove(lockfile)
+        self.assertIsNone(checkouts.lockfile_drift(self.dir_outside_proj, pkgs))
+
     def test_correct_venv_info(self):
         """Pipenv is just a special virtualenv"""
         bin_dir = self.dir_with_venv + "/bin"
@@ -66,8 +107,18 @@ class VenvPipenvTestCase(TestCase):
         self.assertIn("pip", output)
         self.assertEqual(output["python"], OUR_PYTHON_VERSION)
 
+    def test_venv_info_same_as_pip_freeze(self):
+        bin_dir = self.dir_with_venv + "/bin"
+        with mock.patch("serverscripts.checkouts.run_command") as mock_run_command:
+            output = checkouts.venv_info(bin_dir)
+            self.assertFalse(mock_run_command.called)
+        freeze_output, error = utils.run_command([bin_dir + "/pip", "freeze", "--all"])
+        expected = checkouts.parse_freeze(freeze_output)
+        expected["python"] = OUR_PYTHON_VERSION
+        self.assertEqual(output, expected)
+
     def test_django_info_no_pipenv(self):
-        with mock.patch("serverscripts.checkouts.get_output") as mock_get_output:
+        with mock.patch("serverscripts.checkouts.run_command") as mock_get_output:
             with mock.patch("serverscripts.checkouts.os.stat") as mock_stat:
                 mock_get_output.return_value = ("", "bloody murder")
                 mock_stat.return_value = mock.Mock(st_uid=1234)
@@ -75,7 +126,7 @@ class VenvPipenvTestCase(TestCase):
                 self.assertIsNone(result)
 
     def test_django_info(self):
-        with mock.patch("serverscripts.checkouts.get_output") as mock_get_output:
+        with mock.patch("serverscripts.checkouts.run_command") as mock_get_output:
             with mock.patch("serverscripts.checkouts.os.stat") as mock_stat:
                 mock_get_output.return_value = (self.example_diffsettings_output, "")
                 mock_stat.return_value = mock.Mock(st_uid=1234)
@@ -91,6 +142,11 @@ class GitAndEggInfoTestCase(TestCase):
         self.example_diffsettings_output = open(
             os.path.join(self.our_dir, "example_diffsettings.txt")
         ).read()
+        self.cache_dir = tempfile.mkdtemp()
+        cache_dir_patcher = mock.patch.object(cache, "CACHE_DIR", self.cache_dir)
+        cache_dir_patcher.start()
+        self.addCleanup(cache_dir_patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
 
     def test_no_git_dir(self):
         self.assertEqual(checkouts.git_info(self.our_dir), None)
@@ -106,15 +162,38 @@ class GitAndEggInfoTestCase(TestCase):
         output = checkouts.eggs_info(self.dir_with_buildout)
         self.assertIn("serverscripts", output)
 
+    def test_eggs_info_restores_sys_path(self):
+        before = list(sys.path)
+        checkouts.eggs_info(self.dir_with_buildout)
+        self.assertEqual(sys.path, before)
+
+    def test_eggs_info_in_threads(self):
+        # eggs_info() temporarily changes the global sys.path.
+        expected = checkouts.eggs_info(self.dir_with_buildout)
+        result = utils.run_concurrently(
+            checkouts.eggs_info, [self.dir_with_buildout] * 4, max_workers=4
+        )
+        self.assertEqual(result, [expected] * 4)
+
     def test_python_version_in_eggs_info(self):
-        with mock.patch("serverscripts.checkouts.get_output") as mock_get_output:
+        with mock.patch(
+            "serverscripts.checkouts.remembered_run_command"
+        ) as mock_get_output:
             mock_get_output.return_value = ("Python 2.9.42", "")
             output = checkouts.eggs_info(self.dir_with_buildout)
             self.assertEqual(output["python"], "2.9.42")
             mock_get_output.assert_called_with(
-                "python3 --version", cwd=self.dir_with_buildout
+                ["python3", "--version"], cwd=self.dir_with_buildout
             )
 
+    def test_whereis(self):
+        utils.forget()
+        self.assertTrue(checkouts.whereis("sh").endswith("/sh"))
+        self.assertIsNone(checkouts.whereis("reinout-is-not-installed"))
+        with mock.patch("serverscripts.checkouts._whereis") as mock_whereis:
+            self.assertTrue(checkouts.whereis("sh").endswith("/sh"))
+            self.assertFalse(mock_whereis.called)
+
     def test_git_regex(self):
         line = "origin git@github.com:nens/delfland.git (fetch)"
         match = checkouts.GIT_URL.search(line)
@@ -136,7 +215,7 @@ class GitAndEggInfoTestCase(TestCase):
         self.assertEqual(match.group("user"), "nens")
 
     def test_django_info(self):
-        with mock.patch("serverscripts.checkouts.get_output") as mock_get_output:
+        with mock.patch("serverscripts.checkouts.run_command") as mock_get_output:
             with mock.patch("serverscripts.checkouts.os.stat") as mock_stat:
                 mock_get_output.return_value = (self.example_diffsettings_output, "")
                 mock_stat.return_value = mock.Mock(st_uid=1234)
@@ -144,7 +223,7 @@ class GitAndEggInfoTestCase(TestCase):
                 self.assertEqual(len(result["databases"]), 2)
 
     def test_supervisorctl_warnings(self):
-        with mock.patch("serverscripts.checkouts.get_output") as mock_get_output:
+        with mock.patch("serverscripts.checkouts.run_command") as mock_get_output:
             mock_get_output.return_value = (
                 """
 gunicorn                         RUNNING   pid 1418, uptime 0:39:04
@@ -153,5 +232,351 @@ something                        STOPPED
             """,
                 "",
             )
-            result = checkouts.supervisorctl_warnings("some/bin/supervisorctl")
+            result = checkouts.supervisorctl_warnings(["some/bin/supervisorctl"])
             self.assertEqual(result, 1)
+
+
+class GitReaderTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        cache_dir_patcher = mock.patch.object(cache, "CACHE_DIR", self.cache_dir)
+        cache_dir_patcher.start()
+        self.addCleanup(cache_dir_patcher.stop)
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.git("init", "-q", "-b", "master")
+        self.git("config", "user.name", "Someone")
+        self.git("config", "user.email", "someone@example.com")
+        self.git("remote", "add", "upstream", "git@github.com:other/fork.git")
+        self.git("remote", "add", "origin", "https://github.com/nens/example.git")
+        open(os.path.join(self.tempdir, "README"), "w").write("Hello\n")
+        self.git("add", "README")
+        self.git("commit", "-q", "-m", "First")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def git(self, *args):
+        output, error = utils.run_command(("git",) + args, cwd=self.tempdir)
+        return output.strip()
+
+    def git_info_with_git(self):
+        """Return the git info like it was determined with git commands only"""
+        with mock.patch("serverscripts.checkouts._read_release") as mock_release:
+            mock_release.side_effect = OSError
+            with mock.patch("serverscripts.checkouts.read_git_config") as mock_read:
+                mock_read.side_effect = OSError
+                return checkouts.git_info(self.tempdir)
+
+    def test_url_and_branch(self):
+        with mock.patch(
+            "serverscripts.checkouts.run_command", wraps=utils.run_command
+        ) as mock_run_command:
+            result = checkouts.git_info(self.tempdir, status=False)
+            self.assertFalse(mock_run_command.called)
+        self.assertEqual(
+            result,
+            {
+                "url": "https://github.com/nens/example",
+                "release": "master",
+                "has_local_modifications": None,
+                "has_untracked_files": None,
+            },
+        )
+        self.git("checkout", "-q", "-b", "main")
+        self.assertEqual(checkouts.git_info(self.tempdir)["release"], "main")
+
+    def test_same_as_git(self):
+        self.git("checkout", "-q", "-b", "feature")
+        self.git("tag", "-a", "-m", "Release", "1.0")
+        self.assertEqual(checkouts.git_info(self.tempdir)["release"], "1.0")
+        self.assertEqual(checkouts.git_info(self.tempdir), self.git_info_with_git())
+        # Packed refs.
+        self.git("pack-refs", "--all")
+        self.assertEqual(checkouts.git_info(self.tempdir)["release"], "1.0")
+        # Detached HEAD, with a change.
+        self.git("checkout", "-q", "1.0")
+        open(os.path.join(self.tempdir, "README"), "a").write("world\n")
+        self.assertEqual(checkouts.git_info(self.tempdir), self.git_info_with_git())
+        self.assertTrue(checkouts.git_info(self.tempdir)["has_local_modifications"])
+
+    def test_git_describe_fallback(self):
+        self.git("checkout", "-q", "-b", "feature")
+        self.git("tag", "-a", "-m", "Release", "1.0")
+        self.git("commit", "-q", "--allow-empty", "-m", "Second")
+        self.git("tag", "lightweight")
+        with mock.patch(
+            "serverscripts.checkouts.run_command", wraps=utils.run_command
+        ) as mock_run_command:
+            result = checkouts.git_info(self.tempdir, status=False)
+            mock_run_command.assert_called_once_with(
+                ["git", "describe"], cwd=self.tempdir
+            )
+        self.assertEqual(result["release"], self.git("describe"))
+        self.assertTrue(result["release"].startswith("1.0-1-g"))
+
+    def test_worktree(self):
+        self.git("tag", "-a", "-m", "Release", "1.0")
+        worktree = os.path.join(self.tempdir, "worktree")
+        self.git("worktree", "add", "-q", "--detach", worktree, "1.0")
+        with mock.patch("serverscripts.checkouts.run_command") as mock_run_command:
+            result = checkouts.git_info(worktree, status=False)
+            self.assertFalse(mock_run_command.called)
+        self.assertEqual(result["url"], "https://github.com/nens/example")
+        self.assertEqual(result["release"], "1.0")
+
+    def test_git_status_cached(self):
+        self.assertEqual(
+            checkouts.git_status(self.tempdir),
+            {"has_local_modifications": False, "has_untracked_files": False},
+        )
+        with mock.patch("serverscripts.checkouts.run_command") as mock_run_command:
+            checkouts.git_status(self.tempdir)
+            self.assertFalse(mock_run_command.called)
+        # A new file.
+        open(os.path.join(self.tempdir, "new"), "w").close()
+        self.assertTrue(checkouts.git_status(self.tempdir)["has_untracked_files"])
+        # A commit changes the refs and the index.
+        self.git("add", "new")
+        self.git("commit", "-q", "-m", "New file")
+        self.assertFalse(checkouts.git_status(self.tempdir)["has_untracked_files"])
+        # Once in a while, git status runs anyway.
+        with mock.patch("serverscripts.checkouts.time.time") as mock_time:
+            mock_time.return_value = time.time() + checkouts.GIT_STATUS_MAX_AGE
+            with mock.patch(
+                "serverscripts.checkouts.run_command", wraps=utils.run_command
+            ) as mock_run_command:
+                checkouts.git_status(self.tempdir)
+                self.assertTrue(mock_run_command.called)
+
+    def test_git_status_timeout(self):
+        with mock.patch("serverscripts.checkouts.run_command") as mock_run_command:
+            mock_run_command.side_effect = utils.CommandTimeout("git status")
+            self.assertEqual(
+                checkouts.git_status(self.tempdir),
+                {"has_local_modifications": None, "has_untracked_files": None},
+            )
+        # The timeout isn't cached.
+        self.assertFalse(checkouts.git_status(self.tempdir)["has_untracked_files"])
+
+    def test_packages_timeout(self):
+        with mock.patch("serverscripts.checkouts.venv_info") as mock_venv_info:
+            mock_venv_info.side_effect = utils.CommandTimeout("pip freeze")
+            self.assertIsNone(
+                checkouts._unless_timed_out(checkouts.venv_info, "/some/bin/")
+            )
+
+    def test_git_status_without_cache(self):
+        with mock.patch.object(cache, "enabled", False):
+            checkouts.git_status(self.tempdir)
+            with mock.patch(
+                "serverscripts.checkouts.run_command", wraps=utils.run_command
+            ) as mock_run_command:
+                checkouts.git_status(self.tempdir)
+                self.assertTrue(mock_run_command.called)
+
+
+class MetadataTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.site_packages = os.path.join(
+            self.tempdir, "venv", "lib", "python3.8", "site-packages"
+        )
+        os.makedirs(self.site_packages)
+        with open(os.path.join(self.tempdir, "venv", "pyvenv.cfg"), "w") as f:
+            f.write("home = /usr/bin\nversion = 3.8.10\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def add_metadata(self, path, name, version):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(
+                "Metadata-Version: 2.1\nName: %s\nVersion: %s\n\n" % (name, version)
+            )
+            f.write("Name: not-a-header\n")
+
+    def test_packages_in_venv(self):
+        self.add_metadata(
+            os.path.join(self.site_packages, "Django-3.2.dist-info", "METADATA"),
+            "Django",
+            "3.2",
+        )
+        self.add_metadata(
+            os.path.join(self.site_packages, "old-1.0-py3.8.egg-info", "PKG-INFO"),
+            "old",
+            "1.0",
+        )
+        self.add_metadata(
+            os.path.join(self.site_packages, "single-2.0.egg-info"), "single", "2.0"
+        )
+        # Editable install of a git checkout.
+        source_dir = os.path.join(self.tempdir, "src", "project")
+        os.makedirs(os.path.join(source_dir, ".git", "refs", "heads"))
+        with open(os.path.join(source_dir, ".git", "HEAD"), "w") as f:
+            f.write("ref: refs/heads/master\n")
+        with open(
+            os.path.join(source_dir, ".git", "refs", "heads", "master"), "w"
+        ) as f:
+            f.write("abc123\n")
+        with open(os.path.join(source_dir, ".git", "config"), "w") as f:
+            f.write('[remote "origin"]\n\turl = git@github.com:nens/project.git\n')
+        dist_info = os.path.join(self.site_packages, "project-0.1.dist-info")
+        self.add_metadata(os.path.join(dist_info, "METADATA"), "project", "0.1")
+        with open(os.path.join(dist_info, "direct_url.json"), "w") as f:
+            f.write('{"url": "file://%s", "dir_info": {"editable": true}}' % source_dir)
+        # An old-style egg-link, not in a git checkout.
+        self.add_metadata(
+            os.path.join(self.tempdir, "linked", "linked.egg-info", "PKG-INFO"),
+            "linked",
+            "0.2",
+        )
+        with open(os.path.join(self.site_packages, "linked.egg-link"), "w") as f:
+            f.write(os.path.join(self.tempdir, "linked") + "\n.\n")
+
+        self.assertEqual(
+            checkouts.packages_in_venv(os.path.join(self.tempdir, "venv")),
+            {
+                "Django": "3.2",
+                "old": "1.0",
+                "single": "2.0",
+                "-e project": "abc123",
+                "linked": "0.2",
+                "python": "3.8.10",
+            },
+        )
+
+    def test_pyvenv_python_version(self):
+        venv_dir = os.path.join(self.tempdir, "venv")
+        self.assertEqual(checkouts.pyvenv_python_version(venv_dir), "3.8.10")
+        with open(os.path.join(venv_dir, "pyvenv.cfg"), "w") as f:
+            f.write("version_info = 3.11.2.final.0\n")
+        self.assertEqual(checkouts.pyvenv_python_version(venv_dir), "3.11.2")
+        self.assertIsNone(checkouts.pyvenv_python_version(self.tempdir))
+
+
+class PipenvVenvTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.project = os.path.join(self.tempdir, "my project")
+        os.makedirs(self.project)
+        open(os.path.join(self.project, "Pipfile"), "w").close()
+        self.workon_home = os.path.join(self.tempdir, "virtualenvs")
+        environ = {"WORKON_HOME": self.workon_home}
+        environ_patcher = mock.patch.dict(os.environ, environ)
+        environ_patcher.start()
+        self.addCleanup(environ_patcher.stop)
+        os.environ.pop("PIPENV_VENV_IN_PROJECT", None)
+        os.environ.pop("PIPENV_CUSTOM_VENV_NAME", None)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_workon_home(self):
+        name = checkouts.pipenv_venv_name(self.project)
+        self.assertTrue(name.startswith("my_project-"))
+        self.assertEqual(len(name), len("my_project-") + 8)
+        self.assertIsNone(checkouts.pipenv_venv(self.project))
+        os.makedirs(os.path.join(self.workon_home, name))
+        self.assertEqual(
+            checkouts.pipenv_venv(self.project), os.path.join(self.workon_home, name)
+        )
+
+    def test_in_project(self):
+        dot_venv = os.path.join(self.project, ".venv")
+        os.makedirs(dot_venv)
+        self.assertEqual(checkouts.pipenv_venv(self.project), dot_venv)
+
+    def test_dot_venv_file(self):
+        with open(os.path.join(self.project, ".venv"), "w") as f:
+            f.write("custom\n")
+        os.makedirs(os.path.join(self.workon_home, "custom"))
+        self.assertEqual(
+            checkouts.pipenv_venv(self.project),
+            os.path.join(self.workon_home, "custom"),
+        )
+
+
+class EggIndexTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+        cache_dir_patcher = mock.patch.object(cache, "CACHE_DIR", self.cache_dir)
+        cache_dir_patcher.start()
+        self.addCleanup(cache_dir_patcher.stop)
+        utils.forget()
+        self.eggs = os.path.join(self.tempdir, "eggs")
+        for name in ["zest.releaser-6.4-py2.7.egg", "requests_toolbelt-0.5.1-py3.egg"]:
+            egg_info = os.path.join(self.eggs, name, "EGG-INFO")
+            os.makedirs(egg_info)
+            with open(os.path.join(egg_info, "PKG-INFO"), "w") as f:
+                f.write("Metadata-Version: 1.1\nName: whatever\nVersion: 1.0\n")
+        with zipfile.ZipFile(os.path.join(self.eggs, "zipped-1.2-py3.egg"), "w") as f:
+            f.writestr("EGG-INFO/PKG-INFO", "Metadata-Version: 1.1\n")
+        with open(os.path.join(self.eggs, "broken-1.0-py3.egg"), "wb") as f:
+            f.write(b"not a zipfile")
+        self.develop = os.path.join(self.tempdir, "develop")
+        os.makedirs(os.path.join(self.develop, "my_project.egg-info"))
+        with open(
+            os.path.join(self.develop, "my_project.egg-info", "PKG-INFO"), "w"
+        ) as f:
+            f.write("Metadata-Version: 1.1\nName: my-project\nVersion: 2.0.dev0\n")
+
+    def tearDown(self):
+        utils.forget()
+        shutil.rmtree(self.tempdir)
+
+    def test_names(self):
+        self.assertEqual(
+            checkouts.egg_distribution(
+                os.path.join(self.eggs, "zest.releaser-6.4-py2.7.egg")
+            ),
+            ("zest.releaser", "6.4"),
+        )
+        self.assertEqual(
+            checkouts.egg_distribution(
+                os.path.join(self.eggs, "requests_toolbelt-0.5.1-py3.egg")
+            ),
+            ("requests-toolbelt", "0.5.1"),
+        )
+        self.assertEqual(
+            checkouts.egg_distribution(os.path.join(self.eggs, "zipped-1.2-py3.egg")),
+            ("zipped", "1.2"),
+        )
+        self.assertEqual(
+            checkouts.egg_distribution(self.develop), ("my-project", "2.0.dev0")
+        )
+        self.assertIsNone(
+            checkouts.egg_distribution(os.path.join(self.eggs, "broken-1.0-py3.egg"))
+        )
+        self.assertIsNone(checkouts.egg_distribution(self.eggs))
+        self.assertIsNone(checkouts.egg_distribution("/does/not/exist.egg"))
+
+    def test_same_as_pkg_resources(self):
+        try:
+            import pkg_resources
+        except ImportError:
+            self.skipTest("pkg_resources isn't available")
+        paths = [os.path.join(self.eggs, name) for name in os.listdir(self.eggs)]
+        paths.append(self.develop)
+        for path in paths:
+            distributions = list(pkg_resources.find_distributions(path, only=True))
+            expected = None
+            if distributions:
+                expected = (distributions[0].project_name, distributions[0].version)
+            self.assertEqual(checkouts.egg_distribution(path), expected, path)
+
+    def test_eggs_are_read_once(self):
+        egg = os.path.join(self.eggs, "zest.releaser-6.4-py2.7.egg")
+        with mock.patch.object(
+            checkouts, "_read_distribution", wraps=checkouts._read_distribution
+        ) as reader:
+            checkouts.egg_distribution(egg)
+            checkouts.egg_distribution(egg)
+            self.assertEqual(reader.call_count, 1)
+            checkouts.save_egg_index()
+            # The next run uses the saved index.
+            utils.forget()
+            self.assertEqual(checkouts.egg_distribution(egg), ("zest.releaser", "6.4"))
+            self.assertEqual(reader.call_count, 1)
@@ -0,0 +1,52 @@
+from datetime import datetime
+from serverscripts import clfparser
+
+
+COMBINED = (
+    '10.100.110.89 - - [15/Nov/2018:06:25:14 +0100] "GET /geoserver/wms?a=b '
+    'HTTP/1.1" 200 1796 "https://wpn.klimaatatlas.net/" "Mozilla/5.0 (Macintosh)"\n'
+)
+COMMON = '127.0.0.1 - frank [10/Oct/2000:13:55:36 -0700] "GET /a.gif HTTP/1.0" 200 2326'
+
+
+def test_combined():
+    record = clfparser.parse(COMBINED)
+    assert record.h == "10.100.110.89"
+    assert record.r == '"GET /geoserver/wms?a=b HTTP/1.1"'
+    assert record.Referer == '"https://wpn.klimaatatlas.net/"'
+    assert record["Useragent"] == '"Mozilla/5.0 (Macintosh)"'
+    assert record.time == datetime(2018, 11, 15, 6, 25, 14)
+    assert record.timezone == "+0100"
+
+
+def test_common():
+    record = clfparser.parse(COMMON)
+    assert record.u == "frank"
+    assert record.b == "2326"
+    assert record.Referer == ""
+    assert record.Useragent == ""
+
+
+def test_no_match():
+    record = clfparser.parse("something completely different")
+    assert record.r == ""
+    assert record.time == ""
+
+
+def test_slots():
+    record = clfparser.parse(COMMON)
+    assert not hasattr(record, "__dict__")
+
+
+def test_log_dict():
+    # The old interface still works.
+    result = clfparser.CLFParser.logDict(COMBINED)
+    assert result["s"] == "200"
+    assert result["time"] == datetime(2018, 11, 15, 6, 25, 14)
+    assert result["timezone"] == "+0100"
+    assert clfparser.CLFParser.logDict("garbage")["Referer"] == ""
+
+
+def test_log_parts():
+    parts = clfparser.CLFParser.logParts(COMMON, "%h %u %b")
+    assert parts == ["127.0.0.1", "frank", "2326"]
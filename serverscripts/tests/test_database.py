@@ -1,7 +1,25 @@
 from serverscripts import database
 from unittest import TestCase
 
+import gzip
 import mock
+import os
+import shutil
+import tempfile
+
+
+LOG_LINES = [
+    "2023-01-05 LOG:  connection received: host=10.100.160.171 port=40938\n",
+    "2023-01-05 LOG:  connection authorized: user=waterlabel_site "
+    "database=waterlabel_site SSL enabled\n",
+    "2023-01-05 LOG:  connection received: host=10.100.160.171 port=40940\n",
+    "2023-01-05 LOG:  connection authorized: user=waterlabel_site "
+    "database=waterlabel_site SSL enabled\n",
+    "2023-01-05 LOG:  connection received: host=10.100.57.16 port=50122\n",
+    "2023-01-05 LOG:  connection authorized: user=efcis_site database=efcis_site\n",
+    "2023-01-05 LOG:  connection received: host=[local]\n",
+    "2023-01-05 LOG:  connection authorized: user=postgres database=efcis_site\n",
+]
 
 
 class DatabaseTestCase(TestCase):
@@ -26,7 +44,7 @@ class DatabaseTestCase(TestCase):
         self.assertTrue("Smoke test, it just should not crash")
 
     def test_postgres_version(self):
-        with mock.patch("serverscripts.database.get_output") as mock_get_output:
+        with mock.patch("serverscripts.database.run_command") as mock_get_output:
             mock_get_output.return_value = (
                 "14160 bla bla /usr/lib/postgresql/9.3/bin/postgres bla bla",
                 "",
@@ -34,47 +52,28 @@ class DatabaseTestCase(TestCase):
             self.assertEqual("9.3", database._postgres_version())
 
     def test_database_info1(self):
-        with mock.patch("serverscripts.database.get_output") as mock_get_output:
+        with mock.patch("serverscripts.database.run_command") as mock_get_output:
             mock_get_output.return_value = (self.sizes_output, "")
             self.assertEqual(9, len(database._database_infos()))
 
     def test_database_info2(self):
-        with mock.patch("serverscripts.database.get_output") as mock_get_output:
+        with mock.patch("serverscripts.database.run_command") as mock_get_output:
             mock_get_output.return_value = (self.sizes_output, "")
             self.assertEqual(
                 database._database_infos()["lizard_nxt"]["size"], 2207000000
             )
 
     def test_database_usage(self):
-        with mock.patch("serverscripts.database.get_output") as mock_get_output:
-            mock_get_output.return_value = (
-                """
-                9 ror_export database=ror_export
-               73 waterlabel_site database=waterlabel_site
-            23054 efcis_site database=efcis_site
-            26591 schademodule database=schademodule2018
-            241537 klimaatatlas-geoserver database=klimaatatlas-geoserver-v2
-            """,
-                "",
-            )
+        with mock.patch("serverscripts.database._grep_logfiles") as mock_grep:
+            mock_grep.return_value = LOG_LINES
             result = database._usage()
-            print(result)
-            self.assertEqual(result["waterlabel_site"], 73)
-            self.assertEqual(result["klimaatatlas-geoserver-v2"], 241537)
+            self.assertEqual(result, {"waterlabel_site": 2, "efcis_site": 1})
 
     def test_database_connections(self):
-        with mock.patch("serverscripts.database.get_output") as mock_get_output:
-            mock_get_output.return_value = (
-                """
-             1629 10.100.160.171
-             2495 10.100.57.17
-             9805 10.100.57.16
-            """,
-                "",
-            )
+        with mock.patch("serverscripts.database._grep_logfiles") as mock_grep:
+            mock_grep.return_value = LOG_LINES
             result = database._connections()
-            print(result)
-            self.assertEqual(result["10.100.160.171"], 1629)
+            self.assertEqual(result, {"10.100.160.171": 2, "10.100.57.16": 1})
 
     def test_all_info(self):
         with mock.patch("serverscripts.database._postgres_version") as mock_version:
@@ -84,7 +83,7 @@ class DatabaseTestCase(TestCase):
                         "serverscripts.database._connections"
                     ) as mock_connections:
                         with mock.patch(
-                            "serverscripts.database.get_output"
+                            "serverscripts.database.run_command"
                         ) as mock_get_output:
                             mock_get_output.return_value = ("", "")
                             mock_version.return_value = "2.0"
@@ -106,3 +105,29 @@ class DatabaseTestCase(TestCase):
                                 result["databases"]["alexandr"]["num_logins"], 0
                             )
                             self.assertEqual(result["connections"], {"1.2.3.4": 42})
+
+
+class GrepLogfilesTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        with open(os.path.join(self.tempdir, "postgresql-main.log"), "w") as f:
+            f.writelines(LOG_LINES[:4])
+        with gzip.open(
+            os.path.join(self.tempdir, "postgresql-main.log.1.gz"), "wt"
+        ) as f:
+            f.writelines(LOG_LINES[4:])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_grep_logfiles(self):
+        logfiles = os.path.join(self.tempdir, "postgres*main.log*")
+        with mock.patch("serverscripts.database.POSTGRES_LOGFILES", logfiles):
+            lines = list(database._grep_logfiles("connection received"))
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("2023-01-05 LOG:"))
+
+    def test_no_logfiles(self):
+        logfiles = os.path.join(self.tempdir, "nothing*")
+        with mock.patch("serverscripts.database.POSTGRES_LOGFILES", logfiles):
+            self.assertEqual(list(database._grep_logfiles("connection")), [])
@@ -1,4 +1,5 @@
 from serverscripts import docker
+from serverscripts import utils
 from unittest import TestCase
 
 import mock
@@ -16,19 +17,35 @@ cca6ed94102fa749cd32cb289cde07d38323380697a87f6c6334de9715caac76	harbor.lizard.n
 9d6dda1ad3054870b157252c3ceb752a67d5382430b8d37a9d40b72db83f2777	minio/minio:RELEASE.2020-10-03T02-19-42Z	"/usr/bin/docker-entrypoint.sh server /export"	2021-04-15 13:42:06 +0200 CEST	2 weeks ago	0.0.0.0:9000->9000/tcp, :::9000->9000/tcp	Up 51 minutes	0B (virtual 62.4MB)	threedi-api_minio_1	1c18c1163d44b55769f5090b8ae12fff8c3f970f63007d98b5130b1fdaaebab5,threedi-api_miniodata	threedi_backend
 """
 
+DOCKER_INSPECT_OUTPUT = """
+cca6ed94102fa749cd32cb289cde07d38323380697a87f6c6334de9715caac76	sha256:2b1f3c4d
+9d6dda1ad3054870b157252c3ceb752a67d5382430b8d37a9d40b72db83f2777	sha256:9e8d7c6b
+"""
+
 
 class DockerTestCase(TestCase):
-    @mock.patch("serverscripts.docker.get_output")
+    @mock.patch("serverscripts.docker.run_command")
     @mock.patch("serverscripts.docker.container_details")
     @mock.patch("serverscripts.docker.python_details")
     def test_all_info(self, mock_python, mock_details, mock_output):
-        mock_output.return_value = (REGULAR_OUTPUT, "")
+        mock_output.side_effect = [(REGULAR_OUTPUT, ""), (DOCKER_INSPECT_OUTPUT, "")]
         mock_details.return_value = [{"id": "123", "command": "run"}]
         result = docker.all_info()
         self.assertEqual(3, result["active_volumes"])
         self.assertIs(mock_details.return_value, result["containers"])
+        self.assertNotIn("image_id", result["containers"][0])
 
-    @mock.patch("serverscripts.docker.get_output")
+    @mock.patch("serverscripts.docker.run_command")
+    def test_image_ids(self, mock_output):
+        mock_output.return_value = (DOCKER_INSPECT_OUTPUT, "")
+        result = docker.image_ids(["cca6ed9", "9d6dda1"])
+        self.assertEqual(
+            result["cca6ed94102fa749cd32cb289cde07d38323380697a87f6c6334de9715caac76"],
+            "sha256:2b1f3c4d",
+        )
+        self.assertEqual(len(result), 2)
+
+    @mock.patch("serverscripts.docker.run_command")
     def test_container_details(self, mock_output):
         mock_output.return_value = (DOCKER_PS_OUTPUT, "")
         result = docker.container_details()
@@ -37,3 +54,33 @@ class DockerTestCase(TestCase):
             result[0]["command"], '"python manage.py runserver 0.0.0.0:8000"'
         )
         self.assertEqual(result[1]["size"], "0B (virtual 62.4MB)")
+
+    @mock.patch("serverscripts.docker.run_command")
+    def test_python_version_per_image(self, mock_output):
+        utils.forget()
+        mock_output.return_value = ("Python 3.8.10", "")
+        image_ids = {"1": "sha256:1", "2": "sha256:1"}
+        container1 = {"id": "1", "command": "python", "names": "api"}
+        container2 = {"id": "2", "command": "python", "names": "api"}
+        result1 = docker.python_details(container1, image_ids)
+        result2 = docker.python_details(container2, image_ids)
+        self.assertEqual(result1, result2)
+        self.assertEqual(result1["eggs"]["python"], "3.8.10")
+        # --version only for the first container, pip freeze for both.
+        self.assertEqual(mock_output.call_count, 3)
+        pip_freezes = [
+            call[0][0] for call in mock_output.call_args_list if "pip" in call[0][0]
+        ]
+        self.assertEqual([command[2] for command in pip_freezes], ["1", "2"])
+
+    @mock.patch("serverscripts.docker.run_command")
+    def test_same_tag_other_image(self, mock_output):
+        utils.forget()
+        mock_output.return_value = ("Python 3.8.10", "")
+        image_ids = {"1": "sha256:1", "2": "sha256:2"}
+        for container_id in image_ids:
+            container = {"id": container_id, "image": "api:latest", "names": "api"}
+            container["command"] = "python"
+            docker.python_details(container, image_ids)
+        # --version and pip freeze in both containers.
+        self.assertEqual(mock_output.call_count, 4)
@@ -1,11 +1,48 @@
+from collections import Counter
+from contextlib import closing
+from serverscripts import cache
 from serverscripts import geoserver
+from unittest import TestCase
 
+import datetime
+import glob
+import gzip
+import mock
 import os
+import shutil
+import tempfile
 
 
 OUR_DIR = os.path.dirname(__file__)
 
 
+def _extract_from_logfiles(logfile):
+    """Yield the extract_from_line() result of every GetMap line, as a reference"""
+    for filename in glob.glob(logfile + "*"):
+        opener = gzip.open if filename.endswith(".gz") else open
+        with opener(filename, "rt") as f:
+            for line in f:
+                if "/geoserver/" not in line or "GetMap" not in line:
+                    continue
+                result = geoserver.extract_from_line(line)
+                if result:
+                    yield result
+
+
+def _count(logfile, workers=1, since=None):
+    """Return Counter of (workspace, referer) from count_usage()"""
+    day_counts = geoserver.count_usage(logfile, workers=workers, since=since)[0]
+    return _per_workspace_and_referer(day_counts, since=since)
+
+
+def _per_workspace_and_referer(day_counts, since=None):
+    result = Counter()
+    for (day, workspace, layer, referer), count in day_counts.items():
+        if since is None or day >= since:
+            result[(workspace, referer)] += count
+    return result
+
+
 def test_config_file():
     config_example = os.path.join(OUR_DIR, "example_geoserver.json")
     configuration = geoserver.load_config(config_example)
@@ -15,7 +52,7 @@ def test_config_file():
 
 def test_extract_from_logfiles():
     lines = list(
-        geoserver.extract_from_logfiles(
+        _extract_from_logfiles(
             os.path.join(OUR_DIR, "example_geoserver_logs/access.log")
         )
     )
@@ -32,12 +69,676 @@ def test_extract_from_line_no_workspace():
     assert result["workspace"] == "nieuwegein_klimaatatlas"
 
 
+def test_extract_from_bytes_same_as_line():
+    logfiles = glob.glob(os.path.join(OUR_DIR, "example_geoserver_logs/access.log*"))
+    logfiles.append(os.path.join(OUR_DIR, "no-workspace-in-url-cornercase.log"))
+    fast = 0
+    for logfile in logfiles:
+        opener = gzip.open if logfile.endswith(".gz") else open
+        with opener(logfile, "rb") as f:
+            for line in f:
+                expected = geoserver.extract_from_line(line.decode("utf-8", "replace"))
+                assert geoserver.extract_from_bytes(line) == expected
+                if b"GetMap" in line:
+                    assert geoserver._fast_extract(line) is not geoserver.FALLBACK
+                    fast += 1
+    assert fast > 400
+
+
+def test_extract_from_bytes_corner_cases():
+    start = b'1.2.3.4 - - [15/Nov/2018:06:25:14 +0100] "GET '
+    end = b' HTTP/1.1" 200 1796 "https://example.com/x" "Mozilla/5.0"\n'
+    urls = [
+        b"/geoserver/ws/wms?request=GetMap&layers=ws%3Aa",
+        b"/geoserver/wms?request=GetMap&layers=ws%3Aa",
+        b"/geoserver/wms?request=GetMap&LAYERS=ws:a&layers=",
+        b"/geoserver/wms?request=GetMap&LAYERS=other:a&layers=ws:a",
+        b"/geoserver/wms?request=GetMap&layers=no_colon",
+        b"/geoserver/wms?request=GetMap&layers=a+b:c",
+        b"/geoserver/wms?request=GetMap&lay%65rs=ws:a",
+        b"/geoserver/wms?request=GetMap&layers=%77s:a",
+        b"/geoserver/wms?request=GetMap;layers=ws:a",
+        b"/geoserver/wms?request=GetMap&layers=ws:a#fragment",
+        b"/geoserver/wms?request=GetMap&layers=w\xc3\xa9:a",
+        b"/geoserver/ws/wms?request=GetMap",
+        b"/favicon.ico?GetMap",
+        b"//geoserver/ws/wms?request=GetMap&layers=a",
+        b"http://host/geoserver/ws/wms?request=GetMap&layers=a",
+    ]
+    lines = [start + url + end for url in urls]
+    lines += [
+        start + urls[0] + b' HTTP/1.1" 200 1796\n',
+        start + urls[0] + b' HTTP/1.1" 200 1796 "-" "-"\n',
+        start + urls[0] + b' HTTP/1.1" 200 1796 "https://h\xc3\xa9st/" "-"\n',
+        start + urls[0] + b' HTTP/1.1" 200 1796 "https://host" "-"\n',
+        start + urls[0] + b'" 200 1796 "-" "-"\n',
+        b'1.2.3.4 - - "GET /geoserver/ws/wms?request=GetMap&layers=a" 200\n',
+        b"garbage /geoserver/ GetMap\n",
+    ]
+    for line in lines:
+        expected = geoserver.extract_from_line(line.decode("utf-8", "replace"))
+        assert geoserver.extract_from_bytes(line) == expected, line
+
+
 def test_extract_workspaces_info():
     geoserver_configuration = {
         "geoserver_name": "geoserver.staging.lizard.net",
         "logfile": os.path.join(OUR_DIR, "example_geoserver_logs/access.log"),
         "data_dir": os.path.join(OUR_DIR, "example_geoserver_data/"),
     }
-    workspaces = geoserver.extract_workspaces_info(geoserver_configuration)
+    cache_dir = tempfile.mkdtemp()
+    with mock.patch.object(cache, "CACHE_DIR", cache_dir):
+        with mock.patch.object(geoserver, "VAR_DIR", cache_dir):
+            workspaces = geoserver.extract_workspaces_info(geoserver_configuration)
+    shutil.rmtree(cache_dir)
     assert isinstance(workspaces, list)
     assert "database_server" in workspaces[0]
+
+
+def test_extract_from_dirs_cached():
+    data_dir = os.path.join(OUR_DIR, "example_geoserver_data/")
+    cache_dir = tempfile.mkdtemp()
+    with mock.patch.object(cache, "CACHE_DIR", cache_dir):
+        first = geoserver.extract_from_dirs(data_dir)
+        with mock.patch.object(geoserver, "extract_datastore_info") as mock_extract:
+            second = geoserver.extract_from_dirs(data_dir)
+            assert not mock_extract.called
+    shutil.rmtree(cache_dir)
+    assert first == second
+
+
+def test_extract_from_dirs_only_parses_changed_files():
+    tempdir = tempfile.mkdtemp()
+    data_dir = os.path.join(tempdir, "data")
+    shutil.copytree(os.path.join(OUR_DIR, "example_geoserver_data/"), data_dir)
+    datastore_files = glob.glob(data_dir + "/workspaces/*/*/datastore.xml")
+    with mock.patch.object(cache, "CACHE_DIR", os.path.join(tempdir, "cache")):
+        first = geoserver.extract_from_dirs(data_dir)
+        with open(datastore_files[0], "a") as f:
+            f.write("\n")
+        with mock.patch.object(
+            geoserver,
+            "extract_datastore_info",
+            wraps=geoserver.extract_datastore_info,
+        ) as mock_extract:
+            second = geoserver.extract_from_dirs(data_dir)
+            mock_extract.assert_called_once_with(datastore_files[0])
+    with mock.patch.object(cache, "enabled", False):
+        uncached = geoserver.extract_from_dirs(data_dir)
+    shutil.rmtree(tempdir)
+    assert len(datastore_files) > 1
+    assert first == second == uncached
+
+
+class CheckpointTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logs_dir = os.path.join(self.tempdir, "logs")
+        shutil.copytree(os.path.join(OUR_DIR, "example_geoserver_logs"), self.logs_dir)
+        self.logfile = os.path.join(self.logs_dir, "access.log")
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+        self.lines = open(self.logfile, "rb").readlines()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def full_rescan(self):
+        return Counter(
+            (line["workspace"], line["referer"])
+            for line in _extract_from_logfiles(self.logfile)
+        )
+
+    def count(self):
+        with mock.patch.object(cache, "CACHE_DIR", self.cache_dir):
+            return _count(self.logfile)
+
+    def test_same_as_full_rescan(self):
+        expected = self.full_rescan()
+        self.assertEqual(self.count(), expected)
+        # Second time, from the checkpoints.
+        with mock.patch.object(geoserver.gzip, "open") as mock_open:
+            self.assertEqual(self.count(), expected)
+            self.assertFalse(mock_open.called)
+
+    def test_appended_lines(self):
+        with open(self.logfile, "wb") as f:
+            f.writelines(self.lines[:1000])
+        self.count()
+        with open(self.logfile, "ab") as f:
+            f.writelines(self.lines[1000:])
+            # Half a line: it is still being written.
+            f.write(self.lines[0][:20])
+        with mock.patch.object(
+            geoserver, "extract_from_bytes", wraps=geoserver.extract_from_bytes
+        ) as mock_extract:
+            self.count()
+            # Only the new lines are parsed.
+            self.assertGreater(mock_extract.call_count, 0)
+            self.assertLess(mock_extract.call_count, len(self.lines) - 1000)
+        with open(self.logfile, "ab") as f:
+            f.write(self.lines[0][20:])
+        self.assertEqual(self.count(), self.full_rescan())
+
+    def test_rotation(self):
+        self.count()
+        os.rename(self.logfile, self.logfile + ".0")
+        with open(self.logfile, "wb") as f:
+            f.writelines(self.lines[:500])
+        self.assertEqual(self.count(), self.full_rescan())
+
+    def test_truncation(self):
+        self.count()
+        with open(self.logfile, "wb") as f:
+            f.writelines(self.lines[-300:])
+        self.assertEqual(self.count(), self.full_rescan())
+
+    def test_no_cache(self):
+        self.count()
+        with mock.patch.object(cache, "enabled", False):
+            self.assertEqual(self.count(), self.full_rescan())
+
+    def test_workers(self):
+        with mock.patch.object(cache, "enabled", False):
+            sequential = _count(self.logfile, workers=1)
+            parallel = _count(self.logfile, workers=4)
+        self.assertEqual(parallel, sequential)
+        self.assertEqual(parallel.most_common(), sequential.most_common())
+
+    def test_workers_with_checkpoints(self):
+        with mock.patch.object(cache, "CACHE_DIR", self.cache_dir):
+            _count(self.logfile, workers=4)
+            with open(self.logfile, "ab") as f:
+                f.writelines(self.lines[:100])
+            result = _count(self.logfile, workers=4)
+        self.assertEqual(result, self.full_rescan())
+
+
+def _rotation_number(logfile):
+    # access.log.12.gz -> 12, access.log -> 0
+    parts = os.path.basename(logfile).split(".")
+    return int(parts[2]) if len(parts) > 2 else 0
+
+
+class TimeWindowTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logs_dir = os.path.join(self.tempdir, "logs")
+        shutil.copytree(os.path.join(OUR_DIR, "example_geoserver_logs"), self.logs_dir)
+        self.logfile = os.path.join(self.logs_dir, "access.log")
+        self.cache_dir = os.path.join(self.tempdir, "cache")
+        # Oldest first: access.log.14.gz ... access.log.1, access.log.
+        logfiles = sorted(glob.glob(self.logfile + "*"), key=_rotation_number)
+        logfiles.reverse()
+        self.lines = []
+        for logfile in logfiles:
+            opener = gzip.open if logfile.endswith(".gz") else open
+            with opener(logfile, "rb") as f:
+                lines = f.readlines()
+            self.lines.extend(lines)
+            # Like logrotate leaves them: the mtime is that of the last line.
+            last_written = datetime.datetime.strptime(
+                geoserver._day(lines[-1]), "%Y-%m-%d"
+            ) + datetime.timedelta(hours=12)
+            os.utime(logfile, (last_written.timestamp(), last_written.timestamp()))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def expected(self, since):
+        with mock.patch.object(cache, "enabled", False):
+            day_counts = geoserver.count_usage(self.logfile)[0]
+        return _per_workspace_and_referer(day_counts, since=since)
+
+    def count(self, since):
+        with mock.patch.object(cache, "CACHE_DIR", self.cache_dir):
+            return _count(self.logfile, since=since)
+
+    def test_offset_of_day(self):
+        multiday_log = os.path.join(self.tempdir, "multiday.log")
+        with open(multiday_log, "wb") as f:
+            f.writelines(self.lines)
+        days = sorted(set(geoserver._day(line) for line in self.lines))
+        with open(multiday_log, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            for day in days + ["2000-01-01", "2030-01-01"]:
+                expected = 0
+                for line in self.lines:
+                    if geoserver._day(line) >= day:
+                        break
+                    expected += len(line)
+                self.assertEqual(geoserver._offset_of_day(f, day, size), expected)
+
+    def test_since(self):
+        expected = self.expected("2022-09-20")
+        self.assertTrue(expected)
+        self.assertNotEqual(expected, self.expected(None))
+        with mock.patch.object(geoserver.gzip, "open", wraps=gzip.open) as mock_open:
+            self.assertEqual(self.count("2022-09-20"), expected)
+        # Only the files written to from the 20th on are read.
+        self.assertEqual(mock_open.call_count, 6)
+
+    def test_since_seeks_in_the_logfile(self):
+        # One big logfile with all days in it.
+        for logfile in glob.glob(self.logfile + ".*"):
+            os.remove(logfile)
+        with open(self.logfile, "wb") as f:
+            f.writelines(self.lines)
+        expected = self.expected("2022-10-03")
+        with mock.patch.object(
+            geoserver, "_count_line", wraps=geoserver._count_line
+        ) as mock_count_line:
+            self.assertEqual(self.count("2022-10-03"), expected)
+        # Only the lines from the 3rd on are read.
+        recent_lines = [
+            line for line in self.lines if geoserver._day(line) >= "2022-10-03"
+        ]
+        self.assertEqual(mock_count_line.call_count, len(recent_lines))
+
+    def test_checkpoints_with_earlier_since(self):
+        self.count("2022-10-05")
+        self.assertEqual(self.count("2022-10-05"), self.expected("2022-10-05"))
+        # Lines that were skipped before are needed now.
+        self.assertEqual(self.count("2022-09-01"), self.expected("2022-09-01"))
+        self.assertEqual(self.count(None), self.expected(None))
+
+    def test_windows(self):
+        geoserver_configuration = {
+            "geoserver_name": "geoserver.staging.lizard.net",
+            "logfile": self.logfile,
+            "data_dir": os.path.join(OUR_DIR, "example_geoserver_data/"),
+        }
+        # Windows that start on the 5th and the 3rd of October 2022.
+        days_since_5th = (datetime.date.today() - datetime.date(2022, 10, 5)).days + 1
+        windows = [days_since_5th, days_since_5th + 2]
+        with mock.patch.object(cache, "CACHE_DIR", self.cache_dir):
+            with mock.patch.object(geoserver, "VAR_DIR", self.tempdir):
+                workspaces = geoserver.extract_workspaces_info(
+                    geoserver_configuration, windows=windows
+                )
+        usage_since_5th = Counter()
+        for (workspace, referer), count in self.expected("2022-10-05").items():
+            usage_since_5th[workspace] += count
+        for workspace in workspaces:
+            key = "usage_%dd" % days_since_5th
+            if workspace["usage"] == "":
+                self.assertEqual(workspace[key], "")
+                continue
+            self.assertEqual(
+                workspace[key], usage_since_5th[workspace["workspace_name"]]
+            )
+            self.assertGreaterEqual(
+                workspace["usage"], workspace["usage_%dd" % windows[1]]
+            )
+
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.geoserver_configuration = {
+            "geoserver_name": "geoserver.staging.lizard.net",
+            "logfile": os.path.join(OUR_DIR, "example_geoserver_logs/access.log"),
+            "data_dir": os.path.join(OUR_DIR, "example_geoserver_data/"),
+        }
+
+        var_dir_patcher = mock.patch.object(geoserver, "VAR_DIR", self.tempdir)
+        var_dir_patcher.start()
+        self.addCleanup(var_dir_patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def extract_workspaces_info(self):
+        with mock.patch.object(cache, "CACHE_DIR", self.tempdir):
+            return geoserver.extract_workspaces_info(self.geoserver_configuration)
+
+    def test_only_changes_are_stored(self):
+        day_counts = Counter(
+            {
+                ("2022-10-04", "ws", "ws:a", None): 3,
+                ("2022-10-05", "ws", "ws:a", "example.com"): 2,
+            }
+        )
+        with closing(geoserver.open_rollup()) as connection:
+            self.assertEqual(geoserver.update_rollup(connection, "gs", day_counts), 2)
+            self.assertEqual(geoserver.update_rollup(connection, "gs", day_counts), 0)
+            day_counts[("2022-10-05", "ws", "ws:a", "example.com")] += 1
+            # The oldest logfile was removed.
+            del day_counts[("2022-10-04", "ws", "ws:a", None)]
+            self.assertEqual(geoserver.update_rollup(connection, "gs", day_counts), 1)
+            usage = geoserver.usage_from_rollup(connection, "gs", "2022-10-01")
+            referers = geoserver.referers_from_rollup(connection, "gs", "2022-10-01")
+        self.assertEqual(usage, Counter({"ws": 6}))
+        self.assertEqual(referers, {"ws": [(None, 3), ("example.com", 3)]})
+
+    def test_same_as_counting(self):
+        workspaces = self.extract_workspaces_info()
+        with mock.patch.object(cache, "enabled", False):
+            counts = _count(self.geoserver_configuration["logfile"])
+        usage = Counter()
+        for (workspace, referer), count in counts.items():
+            usage[workspace] += count
+        for workspace in workspaces:
+            if workspace["usage"] != "":
+                self.assertEqual(workspace["usage"], usage[workspace["workspace_name"]])
+        # The second time, the database is used and nothing is counted twice.
+        again = self.extract_workspaces_info()
+        by_name = lambda workspace: workspace["workspace_name"]  # noqa: E731
+        self.assertEqual(sorted(again, key=by_name), sorted(workspaces, key=by_name))
+        self.assertTrue(
+            os.path.exists(os.path.join(self.tempdir, geoserver.ROLLUP_DATABASE))
+        )
+
+    def test_database_not_writable(self):
+        not_a_dir = os.path.join(self.tempdir, "file")
+        open(not_a_dir, "w").close()
+        with mock.patch.object(geoserver, "VAR_DIR", os.path.join(not_a_dir, "var")):
+            with closing(geoserver.open_rollup()) as connection:
+                geoserver.update_rollup(
+                    connection, "gs", Counter({("2022-10-05", "ws", "ws:a", None): 1})
+                )
+                usage = geoserver.usage_from_rollup(connection, "gs", "")
+        self.assertEqual(usage, Counter({"ws": 1}))
+
+
+LOG_FORMAT = (
+    '$remote_addr - $remote_user [$time_local] "$request" $status '
+    '$body_bytes_sent "$http_referer" "$http_user_agent" '
+    "$request_time $upstream_response_time"
+)
+
+
+class PerformanceTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        # The example logfile, plus request and upstream response times.
+        self.logfile = os.path.join(self.tempdir, "access.log")
+        self.combined_lines = open(
+            os.path.join(OUR_DIR, "example_geoserver_logs/access.log"), "rb"
+        ).readlines()
+        with open(self.logfile, "wb") as f:
+            for line in self.combined_lines:
+                f.write(line.rstrip(b"\n") + b" 0.123 0.050, 0.020\n")
+        var_dir_patcher = mock.patch.object(geoserver, "VAR_DIR", self.tempdir)
+        var_dir_patcher.start()
+        self.addCleanup(var_dir_patcher.stop)
+        cache_dir_patcher = mock.patch.object(cache, "CACHE_DIR", self.tempdir)
+        cache_dir_patcher.start()
+        self.addCleanup(cache_dir_patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_log_line_pattern(self):
+        pattern = geoserver.log_line_pattern(LOG_FORMAT)
+        fields = pattern.match(open(self.logfile, "rb").readline()).groupdict()
+        self.assertEqual(fields["time_local"], b"05/Oct/2022:07:46:01 +0200")
+        self.assertTrue(fields["request"].startswith(b"GET /geoserver/"))
+        self.assertEqual(fields["request_time"], b"0.123")
+        self.assertEqual(fields["upstream_response_time"], b"0.050, 0.020")
+
+    def test_percentiles(self):
+        buckets = Counter()
+        for value in range(1, 1001):
+            buckets[geoserver.bucket(value)] += 1
+        result = geoserver.percentiles(buckets)
+        for name, expected in [("p50", 500), ("p95", 950), ("p99", 990)]:
+            self.assertGreaterEqual(result[name], expected)
+            self.assertLessEqual(result[name], expected * 1.19)
+        self.assertEqual(
+            geoserver.percentiles(Counter({0: 3})), {"p50": 1, "p95": 1, "p99": 1}
+        )
+
+    def test_same_counts_as_combined_format(self):
+        counter, histograms, offset, _ = geoserver.count_logfile(
+            self.logfile, log_format=LOG_FORMAT
+        )
+        combined_counter = Counter()
+        for line in self.combined_lines:
+            geoserver._count_line(line, combined_counter, Counter())
+        self.assertEqual(counter, combined_counter)
+        # Every counted request is in the request_time histograms.
+        request_times = Counter()
+        for (day, workspace, layer, metric, bucket), count in histograms.items():
+            if metric == "request_time" and bucket != geoserver.SUM:
+                request_times[(day, workspace, layer)] += count
+        counts_per_layer = Counter()
+        for (day, workspace, layer, referer), count in counter.items():
+            counts_per_layer[(day, workspace, layer)] += count
+        self.assertEqual(request_times, counts_per_layer)
+
+    def test_changed_log_format(self):
+        counts, histograms, _ = geoserver.count_usage(self.logfile)
+        self.assertFalse(histograms)
+        # The checkpoint can't be used, as it has no histograms.
+        counts, histograms, _ = geoserver.count_usage(
+            self.logfile, log_format=LOG_FORMAT
+        )
+        self.assertTrue(histograms)
+
+    def test_workspaces_info(self):
+        geoserver_configuration = {
+            "geoserver_name": "geoserver.staging.lizard.net",
+            "logfile": self.logfile,
+            "data_dir": os.path.join(OUR_DIR, "example_geoserver_data/"),
+            "log_format": LOG_FORMAT,
+        }
+        workspaces = geoserver.extract_workspaces_info(geoserver_configuration)
+        used = [workspace for workspace in workspaces if workspace["usage"]]
+        self.assertTrue(used)
+        for workspace in used:
+            self.assertEqual(workspace["request_time_ms"]["p50"], 128)
+            self.assertEqual(
+                workspace["request_time_ms"]["total"], 123 * workspace["usage"]
+            )
+            self.assertEqual(
+                workspace["upstream_response_time_ms"]["total"], 70 * workspace["usage"]
+            )
+            self.assertGreater(workspace["bytes"]["total"], 0)
+            self.assertEqual(
+                sum(layer["usage"] for layer in workspace["layers"].values()),
+                workspace["usage"],
+            )
+        # Run again: the numbers come from the rollup database, nothing doubles.
+        again = geoserver.extract_workspaces_info(geoserver_configuration)
+        by_name = lambda workspace: workspace["workspace_name"]  # noqa: E731
+        self.assertEqual(sorted(again, key=by_name), sorted(workspaces, key=by_name))
+
+
+def test_tile():
+    params = {
+        "srs": "EPSG:3857",
+        "width": "256",
+        "height": "256",
+        "bbox": "626172.1357121639,6261721.357121641,939258.203568246,6574807.424977722",
+    }
+    assert geoserver.tile(params) == (7, 66, 43)
+    assert geoserver.tile(dict(params, srs="EPSG:28992")) is None
+    assert geoserver.tile(dict(params, width="512", height="512")) is None
+    # Not on the tile grid.
+    assert geoserver.tile(dict(params, bbox="100000,0,413086,313086")) is None
+    assert geoserver.tile(dict(params, bbox="not,a,bbox")) is None
+
+
+def test_extract_tile():
+    line = open(os.path.join(OUR_DIR, "no-workspace-in-url-cornercase.log"), "rb")
+    layer, zxy = geoserver.extract_tile(line.readline())
+    assert layer.startswith("nieuwegein_klimaatatlas:")
+    assert zxy == (15, 16844, 10817)
+
+
+TILE_LINE = (
+    '10.0.0.1 - - [%s:07:46:01 +0200] "GET /geoserver/ws/wms?service=WMS&'
+    "request=GetMap&layers=ws%%3A%s&WIDTH=256&HEIGHT=256&SRS=EPSG%%3A3857&"
+    'BBOX=%s,%s,%s,%s HTTP/1.1" 200 1796 "-" "Mozilla/5.0"\n'
+)
+
+
+def _tile_line(z, x, y, layer="layer", day="05/Oct/2022"):
+    size = 2 * geoserver.HALF_WORLD / 2**z
+    minx = x * size - geoserver.HALF_WORLD
+    maxy = geoserver.HALF_WORLD - y * size
+    return (TILE_LINE % (day, layer, minx, maxy - size, minx + size, maxy)).encode()
+
+
+class TileTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfile = os.path.join(self.tempdir, "access.log")
+        # One hot tile, a few warm ones and a long tail of single requests.
+        lines = [_tile_line(10, 525, 336)] * 50
+        for x in range(5):
+            lines += [_tile_line(12, 2100 + x, 1350)] * 10
+        for x in range(300):
+            lines.append(_tile_line(14, 8000 + x, 5000))
+        lines += [_tile_line(10, 525, 336, layer="other")] * 3
+        with open(self.logfile, "wb") as f:
+            f.writelines(lines[:200])
+        with gzip.open(self.logfile + ".1.gz", "wb") as f:
+            f.writelines(lines[200:])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_hot_tiles(self):
+        result = geoserver.hot_tiles(self.logfile, top=6)
+        self.assertEqual(result["ws:layer"]["requests"], 400)
+        tiles = result["ws:layer"]["tiles"]
+        self.assertEqual(tiles[0][:3], [10, 525, 336])
+        self.assertEqual(
+            sorted(tile[:3] for tile in tiles[1:]),
+            [[12, 2100 + x, 1350] for x in range(5)],
+        )
+        # Counts can be too high by at most requests / capacity.
+        for tile, expected in zip(tiles, [50, 10, 10, 10, 10, 10]):
+            self.assertGreaterEqual(tile[3], expected)
+            self.assertLessEqual(tile[3], expected + 400 / 60)
+        self.assertEqual(result["ws:other"]["tiles"], [[10, 525, 336, 3]])
+
+    def test_hot_tiles_exact_within_capacity(self):
+        result = geoserver.hot_tiles(self.logfile, top=1000)
+        self.assertEqual(result["ws:layer"]["tiles"][0], [10, 525, 336, 50])
+        self.assertEqual(result["ws:layer"]["share"], 1.0)
+        self.assertEqual(len(result["ws:layer"]["tiles"]), 306)
+
+    def test_hot_tiles_in_processes(self):
+        self.assertEqual(
+            geoserver.hot_tiles(self.logfile, workers=2, top=6),
+            geoserver.hot_tiles(self.logfile, top=6),
+        )
+
+    def test_hot_tiles_since(self):
+        with open(self.logfile, "ab") as f:
+            f.write(_tile_line(3, 4, 2, day="06/Oct/2022"))
+        result = geoserver.hot_tiles(self.logfile, since="2022-10-06")
+        self.assertEqual(
+            result, {"ws:layer": {"requests": 1, "share": 1.0, "tiles": [[3, 4, 2, 1]]}}
+        )
+
+
+class SketchTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.logfile = os.path.join(OUR_DIR, "example_geoserver_logs/access.log")
+        for module, name in [(geoserver, "VAR_DIR"), (cache, "CACHE_DIR")]:
+            patcher = mock.patch.object(module, name, self.tempdir)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_close_to_exact(self):
+        clients = {}
+        referers = {}
+        for logfile in glob.glob(self.logfile + "*"):
+            opener = gzip.open if logfile.endswith(".gz") else open
+            for line in opener(logfile, "rb"):
+                result = geoserver.extract_from_bytes(line)
+                if result and b"GetMap" in line:
+                    workspace = result["workspace"]
+                    clients.setdefault(workspace, set()).add(line.split()[0])
+                    referers.setdefault(workspace, Counter())[result["referer"]] += 1
+        day_sketches = geoserver.count_usage(self.logfile, workers=2, sketches=True)[2]
+        sketches = geoserver.sketches_per_workspace(day_sketches)
+        self.assertTrue(clients)
+        for workspace, addresses in clients.items():
+            estimate = sketches[workspace][0].count()
+            self.assertLessEqual(
+                abs(estimate - len(addresses)), 0.1 * len(addresses) + 1
+            )
+            most_common = sketches[workspace][1].most_common(1)[0]
+            self.assertEqual(
+                most_common[1] - most_common[2],
+                referers[workspace][None if most_common[0] == "-" else most_common[0]],
+            )
+
+    def test_no_referers_in_counts(self):
+        counts, _, day_sketches = geoserver.count_usage(self.logfile, sketches=True)
+        self.assertEqual(
+            {referer for _, _, _, referer in counts}, {geoserver.ANY_REFERER}
+        )
+        self.assertEqual(
+            sum(counts.values()),
+            sum(referers.total for _, referers in day_sketches.values()),
+        )
+
+    def test_sketches_are_checkpointed(self):
+        first = geoserver.count_usage(self.logfile, sketches=True)
+        with mock.patch.object(geoserver.gzip, "open", wraps=gzip.open) as mock_open:
+            second = geoserver.count_usage(self.logfile, sketches=True)
+        # The rotated files aren't read again.
+        self.assertFalse(mock_open.called)
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(
+            {key: clients.registers for key, (clients, _) in first[2].items()},
+            {key: clients.registers for key, (clients, _) in second[2].items()},
+        )
+        self.assertEqual(
+            {key: referers.counts for key, (_, referers) in first[2].items()},
+            {key: referers.counts for key, (_, referers) in second[2].items()},
+        )
+
+    def test_switching_doesnt_count_twice(self):
+        counts = geoserver.count_usage(self.logfile)[0]
+        sketched_counts = geoserver.count_usage(self.logfile, sketches=True)[0]
+        expected = Counter()
+        for (day, workspace, layer, referer), count in counts.items():
+            expected[workspace] += count
+        with closing(geoserver.open_rollup()) as connection:
+            for day_counts in [counts, sketched_counts, counts]:
+                geoserver.update_rollup(connection, "gs", day_counts)
+                self.assertEqual(
+                    geoserver.usage_from_rollup(connection, "gs", ""), expected
+                )
+
+    def test_workspaces_info(self):
+        geoserver_configuration = {
+            "geoserver_name": "geoserver.staging.lizard.net",
+            "logfile": self.logfile,
+            "data_dir": os.path.join(OUR_DIR, "example_geoserver_data/"),
+            "sketches": True,
+        }
+        workspaces = geoserver.extract_workspaces_info(geoserver_configuration)
+        used = [workspace for workspace in workspaces if workspace["usage"]]
+        self.assertTrue(used)
+        for workspace in used:
+            self.assertGreater(workspace["unique_clients"], 0)
+            self.assertEqual(workspace["unique_clients_error"], 0.0325)
+            self.assertTrue(workspace["referers"])
+            self.assertGreater(workspace["sketch_bytes"], 1024)
+        # Without sketches, the referer counts are the same (ties aside).
+        exact = geoserver.extract_workspaces_info(
+            geoserver_configuration, sketches=False
+        )
+        exact_referers = {
+            workspace["workspace_name"]: workspace["referers"] for workspace in exact
+        }
+        counts = lambda referers: [  # noqa: E731
+            referer.rsplit(" ", 1)[1] for referer in referers.split(" + ")
+        ]
+        for workspace in used:
+            if not workspace["referers_max_error"]:
+                self.assertEqual(
+                    counts(workspace["referers"]),
+                    counts(exact_referers[workspace["workspace_name"]]),
+                )
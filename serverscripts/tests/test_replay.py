@@ -0,0 +1,85 @@
+from serverscripts import replay
+from serverscripts import utils
+from unittest import TestCase
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+
+
+FAKE_MODULE = "serverscripts.tests.fake_replayed"
+
+
+def _collector():
+    """Fake collector that looks at files and runs commands"""
+    module = sys.modules[FAKE_MODULE]
+    config_dir = os.path.join(module.ROOT, "etc")
+    result = {"configs": {}}
+    for name in sorted(os.listdir(config_dir)):
+        with open(os.path.join(config_dir, name)) as config_file:
+            result["configs"][name] = config_file.read()
+    result["has_extra"] = os.path.exists(os.path.join(module.ROOT, "extra"))
+    result["unique"], _ = utils.run_command(["sh", "-c", "echo $$"])
+    result["lines"] = list(utils.stream_command(["printf", "a\\nb\\n"]))
+    output, error = utils.run_command(["sh", "-c", "exit 3"], fail_on_exit_code=False)
+    result["error"] = error
+    if not os.path.exists(module.OUTPUT_DIR):
+        os.mkdir(module.OUTPUT_DIR)
+    utils.write_json(module.OUTPUT_FILE, result)
+
+
+class ReplayTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tempdir, "server")
+        os.makedirs(os.path.join(self.root, "etc"))
+        for name in ["a.conf", "b.conf"]:
+            with open(os.path.join(self.root, "etc", name), "w") as f:
+                f.write("Config " + name)
+        open(os.path.join(self.root, "extra"), "w").close()
+        self.bundle = os.path.join(self.tempdir, "bundle")
+        self.module = types.ModuleType(FAKE_MODULE)
+        self.module.ROOT = self.root
+        self.module.OUTPUT_DIR = os.path.join(self.tempdir, "facts")
+        self.module.OUTPUT_FILE = os.path.join(self.module.OUTPUT_DIR, "fake.fact")
+        self.module.main = _collector
+        sys.modules[FAKE_MODULE] = self.module
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+        del sys.modules[FAKE_MODULE]
+
+    def test_record_and_replay(self):
+        replay.record(FAKE_MODULE, self.bundle, roots=[self.root + "/"])
+        recorded = json.load(open(self.module.OUTPUT_FILE))
+        self.assertEqual(recorded["configs"]["a.conf"], "Config a.conf")
+        info = json.load(open(os.path.join(self.bundle, replay.INFO_FILE)))
+        self.assertEqual(len(info["commands"]), 3)
+        self.assertEqual(info["commands"][2]["exit_code"], 3)
+
+        # The original files are gone, but we still have the bundle.
+        shutil.rmtree(self.root)
+        output_dir = os.path.join(self.tempdir, "replayed")
+        os.mkdir(output_dir)
+        replay.replay(FAKE_MODULE, self.bundle, output_dir)
+        replayed = json.load(open(os.path.join(output_dir, "fake.fact")))
+        self.assertEqual(replayed, recorded)
+        # The original output paths are restored.
+        self.assertEqual(self.module.OUTPUT_DIR, os.path.join(self.tempdir, "facts"))
+
+    def test_not_recorded(self):
+        os.makedirs(os.path.join(self.bundle, replay.FILES_DIR))
+        os.makedirs(os.path.join(self.bundle, replay.COMMANDS_DIR))
+        with open(os.path.join(self.bundle, replay.INFO_FILE), "w") as f:
+            json.dump({"roots": [self.root + "/"], "commands": []}, f)
+        replayer = replay.Replayer(self.bundle)
+        utils.command_hook = replayer
+        try:
+            output, error = utils.run_command(["ls"], fail_on_exit_code=False)
+        finally:
+            utils.command_hook = None
+        self.assertIn("Not recorded", error)
+        self.assertEqual(replayer.not_recorded, [["ls"]])
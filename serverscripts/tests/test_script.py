@@ -0,0 +1,181 @@
+from serverscripts import script
+from serverscripts import utils
+from unittest import TestCase
+
+import json
+import mock
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+
+OUR_DIR = os.path.dirname(__file__)
+
+
+def fake_collector(name, main):
+    """Register a fake collector module and return its entry for COLLECTORS"""
+    module_name = "serverscripts.tests.fake_" + name
+    module = types.ModuleType(module_name)
+    module.main = main
+    sys.modules[module_name] = module
+    return (name, module_name, OUR_DIR)
+
+
+def _ok():
+    pass
+
+
+def _crash():
+    raise ValueError("bloody murder")
+
+
+def _exit_with_error():
+    sys.exit(1)
+
+
+def _hang():
+    time.sleep(60)
+
+
+def _hang_in_command():
+    utils.run_command(["sleep", "4242"])
+
+
+def _sleep_4242_pids():
+    """Return the pids of "sleep 4242" commands"""
+    result = []
+    for pid in os.listdir("/proc"):
+        try:
+            with open(os.path.join("/proc", pid, "cmdline"), "rb") as f:
+                if f.read() == b"sleep\x004242\x00":
+                    result.append(pid)
+        except OSError:
+            pass
+    return result
+
+
+def _run_subprocess():
+    utils.get_output("echo hello")
+
+
+class RunCollectorsTestCase(TestCase):
+    def test_statuses(self):
+        collectors = [
+            fake_collector("ok", _ok),
+            fake_collector("crash", _crash),
+            fake_collector("exit", _exit_with_error),
+        ]
+        result = script.run_collectors(collectors, max_workers=2)
+        statuses = {name: info["status"] for name, info in result.items()}
+        self.assertEqual(
+            statuses,
+            {"ok": script.OK, "crash": script.FAILED, "exit": script.FAILED},
+        )
+        self.assertTrue(result["ok"]["success"])
+        self.assertFalse(result["crash"]["success"])
+
+    def test_resource_usage(self):
+        collectors = [fake_collector("subprocess", _run_subprocess)]
+        info = script.run_collectors(collectors)["subprocess"]
+        self.assertEqual(info["subprocesses"], 1)
+        self.assertEqual(info["subprocess_output_bytes"], len("hello\n"))
+        self.assertGreater(info["peak_rss"], 0)
+        self.assertIn("cpu_time", info)
+        self.assertIn("wall_time", info)
+
+    def test_hanging_collector_is_killed(self):
+        collectors = [
+            fake_collector("hang", _hang),
+            fake_collector("ok1", _ok),
+            fake_collector("ok2", _ok),
+        ]
+        start = time.time()
+        # Only one worker: the ok collectors have to wait for the hanging one.
+        result = script.run_collectors(
+            collectors, max_workers=1, timeouts={"hang": 0.5}
+        )
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual(result["hang"]["status"], script.TIMED_OUT)
+        self.assertEqual(result["ok1"]["status"], script.OK)
+        self.assertEqual(result["ok2"]["status"], script.OK)
+
+    def test_commands_of_hanging_collector_are_killed(self):
+        collectors = [fake_collector("hang_in_command", _hang_in_command)]
+        result = script.run_collectors(collectors, timeouts={"hang_in_command": 1})
+        self.assertEqual(result["hang_in_command"]["status"], script.TIMED_OUT)
+        # The sleep ran in its own process group, but is gone anyway.
+        time.sleep(0.1)
+        self.assertEqual(_sleep_4242_pids(), [])
+
+    def test_unavailable_collector(self):
+        collectors = [("missing", "serverscripts.tests.not_there", "/does/not/exist")]
+        result = script.run_collectors(collectors)
+        self.assertEqual(result["missing"]["status"], script.NOT_AVAILABLE)
+
+
+class CollectorRegistryTestCase(TestCase):
+    def test_probe_paths(self):
+        # The probe paths must match what the modules check themselves.
+        from serverscripts import apache
+        from serverscripts import checkouts
+        from serverscripts import database
+        from serverscripts import docker
+        from serverscripts import geoserver
+        from serverscripts import haproxy
+        from serverscripts import nginx
+
+        probe_paths = {name: probe_path for name, _, probe_path in script.COLLECTORS}
+        self.assertEqual(probe_paths["apache"], apache.APACHE_DIR)
+        self.assertEqual(probe_paths["checkouts"], checkouts.SRV_DIR)
+        self.assertEqual(probe_paths["database"], database.POSTGRES_CONFIG_DIR)
+        self.assertEqual(probe_paths["docker"], docker.DOCKER_CONFIG_DIR)
+        self.assertEqual(probe_paths["geoserver"], geoserver.CONFIG_FILE)
+        self.assertEqual(probe_paths["haproxy"], haproxy.HAPROXY_CFG)
+        self.assertEqual(probe_paths["nginx"], nginx.NGINX_DIR)
+
+    def test_no_collectors_imported_at_startup(self):
+        # Guard the startup cost of gather-all-info: importing the script must
+        # not import the collectors or pkg_resources (see
+        # benchmarks/importtime.py for the actual numbers).
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import serverscripts.script"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        imported = [line.split("|")[-1].strip() for line in process.stderr.split("\n")]
+        for name, module_name, probe_path in script.COLLECTORS:
+            self.assertNotIn(module_name, imported)
+        self.assertNotIn("pkg_resources", imported)
+
+
+class WriteCollectorsInfoTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_write_collectors_info(self):
+        output_file = os.path.join(self.tempdir, "collectors.fact")
+        with mock.patch.multiple(
+            script,
+            VAR_DIR=self.tempdir,
+            OUTPUT_DIR=self.tempdir,
+            OUTPUT_FILE=output_file,
+        ):
+            script.write_collectors_info(
+                {
+                    "nginx": {"status": script.OK, "success": True, "wall_time": 2},
+                    "docker": {"status": script.TIMED_OUT, "success": False},
+                }
+            )
+        self.assertEqual(json.load(open(output_file))["nginx"]["wall_time"], 2)
+        zabbix_file = os.path.join(self.tempdir, "nens.collector_docker.errors")
+        self.assertEqual(open(zabbix_file).read(), "1")
+        zabbix_file = os.path.join(self.tempdir, "nens.collector_nginx_wall_time.info")
+        self.assertEqual(open(zabbix_file).read(), "2")
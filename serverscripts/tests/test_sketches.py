@@ -0,0 +1,101 @@
+from collections import Counter
+from serverscripts import sketches
+
+import json
+import random
+
+
+def _skewed_stream(items=5000):
+    """Return a shuffled list of items where a few are very common (zipf-like)"""
+    stream = []
+    for item in range(items):
+        stream.extend([item] * (1 + 2000 // (item + 1)))
+    random.Random(42).shuffle(stream)
+    return stream
+
+
+def test_space_saving_exact_below_capacity():
+    summary = sketches.SpaceSaving(10)
+    for item in "abracadabra":
+        summary.add(item)
+    assert summary.counts == {"a": 5, "b": 2, "r": 2, "c": 1, "d": 1}
+    assert summary.most_common(1) == [("a", 5, 0)]
+    assert summary.total == 11
+    assert summary.minimum() == 0
+
+
+def test_space_saving_error_bounds():
+    stream = _skewed_stream()
+    exact = Counter(stream)
+    summary = sketches.SpaceSaving(100)
+    for item in stream:
+        summary.add(item)
+    assert len(summary) == 100
+    for item, count, error in summary.most_common():
+        assert count - error <= exact[item] <= count
+        assert error <= summary.total / 100
+    # Everything more common than total/capacity is in there.
+    for item, count in exact.items():
+        if count > summary.total / 100:
+            assert item in summary.counts
+    # The top of a skewed stream is right.
+    top = [item for item, _, _ in summary.most_common(5)]
+    assert top == [item for item, _ in exact.most_common(5)]
+
+
+def test_space_saving_merge():
+    stream = _skewed_stream()
+    exact = Counter(stream)
+    first, second = sketches.SpaceSaving(100), sketches.SpaceSaving(100)
+    for item in stream[: len(stream) // 3]:
+        first.add(item)
+    for item in stream[len(stream) // 3 :]:
+        second.add(item)
+    merged = first.merge(second)
+    assert merged.total == len(stream)
+    assert len(merged) == 100
+    for item, count, error in merged.most_common():
+        assert count - error <= exact[item] <= count
+    top = [item for item, _, _ in merged.most_common(5)]
+    assert top == [item for item, _ in exact.most_common(5)]
+
+
+def test_hyperloglog_small_numbers():
+    estimator = sketches.HyperLogLog()
+    assert estimator.count() == 0
+    for _ in range(3):
+        for number in range(20):
+            estimator.add("10.0.0.%d" % number)
+    # Nearly exact, only two addresses can end up in the same register.
+    assert 19 <= estimator.count() <= 20
+
+
+def test_hyperloglog_error_bounds():
+    first, second = sketches.HyperLogLog(), sketches.HyperLogLog()
+    for number in range(50000):
+        address = "10.%d.%d.%d" % (number // 65536, number // 256 % 256, number % 256)
+        (first if number % 3 else second).add(address)
+        first.add(address.encode())  # Some overlap, as bytes.
+    merged = first.merge(second)
+    # Three standard errors.
+    assert abs(merged.count() - 50000) < 3 * merged.error * 50000
+    assert merged.memory() < 2000
+
+
+def test_json():
+    summary = sketches.SpaceSaving(10)
+    estimator = sketches.HyperLogLog()
+    for item in _skewed_stream(100):
+        summary.add("referer %d" % item)
+        estimator.add("10.0.0.%d" % item)
+    summary_again = sketches.SpaceSaving.from_json(
+        json.loads(json.dumps(summary.to_json()))
+    )
+    assert summary_again.most_common() == summary.most_common()
+    assert summary_again.total == summary.total
+    summary_again.add("referer 1")
+    assert summary_again.counts["referer 1"] == summary.counts["referer 1"] + 1
+    estimator_again = sketches.HyperLogLog.from_json(
+        json.loads(json.dumps(estimator.to_json()))
+    )
+    assert estimator_again.registers == estimator.registers
@@ -0,0 +1,232 @@
+from serverscripts import utils
+from unittest import TestCase
+
+import json
+import mock
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+class WriteFileTestCase(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "something.fact")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_write_file(self):
+        self.assertTrue(utils.write_file(self.filename, "first"))
+        self.assertTrue(utils.write_file(self.filename, "second"))
+        self.assertEqual(open(self.filename).read(), "second")
+        # No temporary files are left behind.
+        self.assertEqual(os.listdir(self.tempdir), ["something.fact"])
+
+    def test_unchanged_content_is_not_written(self):
+        utils.write_file(self.filename, "same")
+        os.utime(self.filename, (0, 0))
+        self.assertFalse(utils.write_file(self.filename, "same"))
+        self.assertEqual(os.path.getmtime(self.filename), 0)
+        # Same length, different content.
+        self.assertTrue(utils.write_file(self.filename, "SAME"))
+
+    def test_write_json(self):
+        utils.write_json(self.filename, {"b": 1, "a": [1, 2]})
+        self.assertEqual(json.load(open(self.filename)), {"b": 1, "a": [1, 2]})
+        self.assertIn("\n", open(self.filename).read())
+
+    def test_write_json_compact(self):
+        utils.write_json(self.filename, {"b": 1, "a": [1, 2]}, compact=True)
+        self.assertEqual(open(self.filename).read(), '{"a":[1,2],"b":1}')
+
+
+class RunCommandTestCase(TestCase):
+    def test_output(self):
+        output, error = utils.run_command(["echo", "hello world"])
+        self.assertEqual(output, "hello world\n")
+        self.assertEqual(error, "")
+
+    def test_no_shell(self):
+        output, error = utils.run_command(["echo", "$HOME;", "|", "cat"])
+        self.assertEqual(output, "$HOME; | cat\n")
+
+    def test_cwd(self):
+        output, error = utils.run_command(["pwd"], cwd="/")
+        self.assertEqual(output, "/\n")
+
+    def test_exit_code(self):
+        with self.assertRaises(RuntimeError):
+            utils.run_command(["false"])
+        output, error = utils.run_command(["false"], fail_on_exit_code=False)
+        self.assertEqual(output, "")
+
+    def test_lots_of_error_output(self):
+        # Reading stdout before stderr used to block on this.
+        command = [sys.executable, "-c", "import sys; sys.stderr.write('x' * 10**6)"]
+        output, error = utils.run_command(command, timeout=10)
+        self.assertEqual(len(error), 10**6)
+
+    def test_timeout_kills_process_group(self):
+        start = time.time()
+        # The sleep is a child of the shell: it has to be killed, too, otherwise
+        # it keeps the pipe open.
+        command = ["/bin/sh", "-c", "sleep 30; echo done"]
+        with self.assertRaises(RuntimeError):
+            utils.run_command(command, timeout=0.5)
+        output, error = utils.run_command(command, timeout=0.5, fail_on_exit_code=False)
+        self.assertEqual(output, "")
+        self.assertLess(time.time() - start, 10)
+
+    def test_timeout_exception(self):
+        with self.assertRaises(utils.CommandTimeout):
+            utils.run_command(["sleep", "30"], timeout=0.2)
+
+    def test_missing_executable(self):
+        output, error = utils.run_command(["/does/not/exist"], fail_on_exit_code=False)
+        self.assertEqual(output, "")
+        self.assertIn("/does/not/exist", error)
+        with self.assertRaises(RuntimeError):
+            utils.run_command(["/does/not/exist"])
+
+    def test_output_bytes(self):
+        utils.stats.clear()
+        output, error = utils.run_command(["printf", "caf\\303\\251"])
+        self.assertEqual(output, "caf\u00e9")
+        self.assertEqual(utils.stats["subprocess_output_bytes"], 5)
+
+    def test_get_output(self):
+        output, error = utils.get_output("echo hello | tr h j")
+        self.assertEqual(output, "jello\n")
+
+
+class StreamCommandTestCase(TestCase):
+    def test_lines(self):
+        command = ["printf", "one\\ntwo\\nthree\\n"]
+        lines = list(utils.stream_command(command))
+        self.assertEqual(lines, ["one\n", "two\n", "three\n"])
+
+    def test_exit_code(self):
+        command = ["/bin/sh", "-c", "echo one; echo oops >&2; exit 3"]
+        lines = []
+        with self.assertRaises(RuntimeError):
+            for line in utils.stream_command(command):
+                lines.append(line)
+        # We got the output before the error.
+        self.assertEqual(lines, ["one\n"])
+        lines = list(utils.stream_command(command, fail_on_exit_code=False))
+        self.assertEqual(lines, ["one\n"])
+
+    def test_timeout(self):
+        start = time.time()
+        command = ["/bin/sh", "-c", "echo one; sleep 30; echo two"]
+        lines = list(
+            utils.stream_command(command, timeout=0.5, fail_on_exit_code=False)
+        )
+        self.assertEqual(lines, ["one\n"])
+        with self.assertRaises(RuntimeError):
+            list(utils.stream_command(command, timeout=0.5))
+        self.assertLess(time.time() - start, 10)
+
+    def test_output_bytes(self):
+        utils.stats.clear()
+        lines = list(utils.stream_command(["printf", "caf\\303\\251\\n"]))
+        self.assertEqual(lines, ["caf\u00e9\n"])
+        self.assertEqual(utils.stats["subprocess_output_bytes"], 6)
+
+    def test_missing_executable(self):
+        command = ["/does/not/exist"]
+        self.assertEqual(
+            list(utils.stream_command(command, fail_on_exit_code=False)), []
+        )
+        with self.assertRaises(RuntimeError):
+            list(utils.stream_command(command))
+
+    def test_stop_halfway(self):
+        start = time.time()
+        command = ["/bin/sh", "-c", "echo one; sleep 30; echo two"]
+        for line in utils.stream_command(command):
+            break
+        self.assertLess(time.time() - start, 10)
+
+
+def _slow_double(number):
+    time.sleep(0.3)
+    return number * 2
+
+
+def _crash(number):
+    raise ValueError("bloody murder")
+
+
+class RunConcurrentlyTestCase(TestCase):
+    def test_order_and_speed(self):
+        start = time.time()
+        result = utils.run_concurrently(_slow_double, range(8), max_workers=8)
+        self.assertEqual(result, [0, 2, 4, 6, 8, 10, 12, 14])
+        # Sequentially, it would take 2.4s.
+        self.assertLess(time.time() - start, 2)
+
+    def test_one_worker(self):
+        result = utils.run_concurrently(_slow_double, [1, 2], max_workers=1)
+        self.assertEqual(result, [2, 4])
+
+    def test_exception(self):
+        with self.assertRaises(ValueError):
+            utils.run_concurrently(_crash, [1, 2, 3])
+
+
+class RememberTestCase(TestCase):
+    def setUp(self):
+        utils.forget()
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        utils.forget()
+        shutil.rmtree(self.tempdir)
+
+    def test_remember(self):
+        function = mock.Mock(return_value=42)
+        self.assertEqual(utils.remember("key", function, 1, a=2), 42)
+        self.assertEqual(utils.remember("key", function, 1, a=2), 42)
+        function.assert_called_once_with(1, a=2)
+        utils.forget()
+        utils.remember("key", function, 1, a=2)
+        self.assertEqual(function.call_count, 2)
+
+    def test_exceptions_are_not_remembered(self):
+        function = mock.Mock(side_effect=[ValueError, 42])
+        with self.assertRaises(ValueError):
+            utils.remember("key", function)
+        self.assertEqual(utils.remember("key", function), 42)
+
+    def test_threads(self):
+        function = mock.Mock(side_effect=lambda: _slow_double(21))
+        result = utils.run_concurrently(
+            lambda item: utils.remember("key", function), range(4), max_workers=4
+        )
+        self.assertEqual(result, [42] * 4)
+        self.assertEqual(function.call_count, 1)
+
+    def test_remembered_run_command(self):
+        script = os.path.join(self.tempdir, "script")
+        with open(script, "w") as f:
+            f.write("#!/bin/sh\necho $$\n")
+        os.chmod(script, 0o755)
+        output1, _ = utils.remembered_run_command([script])
+        output2, _ = utils.remembered_run_command([script], cwd="/")
+        self.assertEqual(output1, output2)
+        # Other arguments: run again.
+        output3, _ = utils.remembered_run_command([script, "--other"])
+        self.assertNotEqual(output1, output3)
+        # A changed executable: run again.
+        os.utime(script, (0, 0))
+        output4, _ = utils.remembered_run_command([script])
+        self.assertNotEqual(output1, output4)
+
+    def test_remembered_run_command_via_path(self):
+        output1, _ = utils.remembered_run_command(["sh", "-c", "echo $$"])
+        output2, _ = utils.remembered_run_command(["sh", "-c", "echo $$"])
+        self.assertEqual(output1, output2)
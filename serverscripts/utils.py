@@ -1,31 +1,405 @@
+from collections import Counter
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+import hashlib
+import json
+import locale
+import logging
+import os
+import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import time
+
+
+# Per-process counters (number of subprocesses and so). gather-all-info
+# reports them per collector in collectors.fact.
+stats = Counter()
+
+_stats_lock = threading.Lock()
+# Results remembered for the duration of the run, see ``remember()``.
+_memory = {}
+_memory_lock = threading.Lock()
+# Process groups of the commands that are running, see ``kill_commands()``.
+_process_groups = set()
+
+# Seconds a command may take, unless the caller passes another timeout.
+COMMAND_TIMEOUT = 2 * 60
+# Number of threads for running independent commands at the same time.
+MAX_WORKERS = 8
+# Set by serverscripts.replay to record or replay the commands we run.
+command_hook = None
+
+logger = logging.getLogger(__name__)
 
 
 def get_output(command, cwd=".", fail_on_exit_code=True):
     """Run command and return output.
 
-    ``command`` is just a string like "cat something".
+    ``command`` is just a string like "cat something", it is run by the shell.
+    Prefer ``run_command()`` with a list of arguments.
 
     ``cwd`` is the directory where to execute the command.
 
     """
+    return run_command(
+        ["/bin/sh", "-c", command], cwd=cwd, fail_on_exit_code=fail_on_exit_code
+    )
+
+
+def increment(key, amount=1):
+    """Add to one of the ``stats``, also when called from several threads"""
+    # Commands can run in several threads, see ``run_concurrently()``.
+    with _stats_lock:
+        stats[key] += amount
+
+
+def _count_output(text):
+    """Count the bytes of (decoded) command output"""
+    # Popen decodes the output with the preferred encoding.
+    encoding = locale.getpreferredencoding(False)
+    increment("subprocess_output_bytes", len(text.encode(encoding, "replace")))
+
+
+def _start(argv, cwd):
+    """Start the command in its own process group
+
+    The group is remembered until the command finishes, so that
+    ``kill_commands()`` can kill it.
+
+    """
+    increment("subprocesses")
+    if command_hook is not None:
+        argv, cwd = command_hook.start(argv, cwd)
     process = subprocess.Popen(
-        command,
+        argv,
         cwd=cwd,
-        shell=True,
         universal_newlines=True,
-        stdin=subprocess.PIPE,
+        stdin=subprocess.DEVNULL,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
+        start_new_session=True,
     )
-    i, o, e = (process.stdin, process.stdout, process.stderr)
-    i.close()
-    output = o.read()
-    error_output = e.read()
-    o.close()
-    e.close()
-    exit_code = process.wait()
-    if exit_code and fail_on_exit_code:
+    _process_groups.add(process.pid)
+    return process
+
+
+def _kill(process, timed_out=None):
+    """Kill the process plus everything it started (like sudo's children)"""
+    if timed_out is not None:
+        timed_out.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        # Already gone.
+        pass
+
+
+def kill_commands():
+    """Kill the commands that are still running, including what they started
+
+    The commands run in their own process group, so killing our own group
+    doesn't reach them. gather-all-info's collectors call this when they're
+    terminated.
+
+    """
+    # No lock: this is called from a signal handler.
+    for process_group in list(_process_groups):
+        try:
+            os.killpg(process_group, signal.SIGKILL)
+        except OSError:
+            # Already gone.
+            pass
+
+
+class CommandTimeout(RuntimeError):
+    """Raised when a command is killed because it took too long"""
+
+
+# Exit code of a shell for a command that isn't there.
+NOT_FOUND = 127
+
+
+def _check(argv, exit_code, timed_out, timeout, output, error_output, fail):
+    if timed_out:
+        message = "Running %s timed out after %ss" % (" ".join(argv), timeout)
+    elif exit_code:
+        message = "Running %s failed: %s" % (" ".join(argv), error_output)
+    else:
+        return
+    if fail:
         print(output + error_output)
-        raise RuntimeError("Running %s failed: %s" % (command, error_output))
+        if timed_out:
+            raise CommandTimeout(message)
+        raise RuntimeError(message)
+    if timed_out:
+        logger.warning(message)
+    else:
+        logger.debug(message)
+
+
+def _not_started(argv, cwd, error, timeout, fail):
+    """Handle a command that couldn't be started like a shell does: exit code 127"""
+    error_output = "%s\n" % error
+    if command_hook is not None:
+        command_hook.finished(argv, cwd, "", error_output, NOT_FOUND, 0)
+    _check(argv, NOT_FOUND, False, timeout, "", error_output, fail)
+    return error_output
+
+
+def run_command(argv, cwd=".", timeout=COMMAND_TIMEOUT, fail_on_exit_code=True):
+    """Run command and return (output, error output).
+
+    ``argv`` is a list like ``["git", "status"]``, no shell is involved, so
+    no quoting problems either.
+
+    stdout and stderr are read at the same time, so a command that writes a
+    lot of error output doesn't block. When the command takes longer than
+    ``timeout`` seconds, it is killed including any processes it started.
+
+    A non-zero exit code raises a RuntimeError, a timeout a CommandTimeout
+    (which is a RuntimeError, too). With ``fail_on_exit_code=False``, you get
+    whatever output there was. A missing executable counts as exit code 127,
+    just like in a shell.
+
+    """
+    started = time.time()
+    try:
+        process = _start(argv, cwd)
+    except OSError as e:
+        return ("", _not_started(argv, cwd, e, timeout, fail_on_exit_code))
+    timed_out = False
+    try:
+        output, error_output = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        _kill(process)
+        output, error_output = process.communicate()
+    _process_groups.discard(process.pid)
+    _count_output(output + error_output)
+    if command_hook is not None:
+        command_hook.finished(
+            argv, cwd, output, error_output, process.returncode, time.time() - started
+        )
+    _check(
+        argv,
+        process.returncode,
+        timed_out,
+        timeout,
+        output,
+        error_output,
+        fail_on_exit_code,
+    )
     return (output, error_output)
+
+
+def stream_command(argv, cwd=".", timeout=COMMAND_TIMEOUT, fail_on_exit_code=True):
+    """Run command and yield its output line by line as it arrives.
+
+    Like ``run_command()``, but the output doesn't have to fit in memory:
+    handy for a zgrep over lots of logfiles. Error output is collected in the
+    background. Errors (and timeouts) are raised after the last line.
+
+    """
+    started = time.time()
+    try:
+        process = _start(argv, cwd)
+    except OSError as e:
+        _not_started(argv, cwd, e, timeout, fail_on_exit_code)
+        return
+    lines = []  # Only kept for the command hook.
+    error_lines = []
+    error_reader = threading.Thread(
+        target=lambda: error_lines.extend(process.stderr), daemon=True
+    )
+    error_reader.start()
+    timed_out = threading.Event()
+    killer = threading.Timer(timeout, _kill, args=(process, timed_out))
+    killer.start()
+    try:
+        for line in process.stdout:
+            _count_output(line)
+            if command_hook is not None:
+                lines.append(line)
+            yield line
+    except BaseException:
+        # Also when our caller stops iterating halfway.
+        _kill(process)
+        raise
+    finally:
+        process.stdout.close()
+        exit_code = process.wait()
+        _process_groups.discard(process.pid)
+        killer.cancel()
+        error_reader.join()
+        process.stderr.close()
+    error_output = "".join(error_lines)
+    _count_output(error_output)
+    if command_hook is not None:
+        command_hook.finished(
+            argv, cwd, "".join(lines), error_output, exit_code, time.time() - started
+        )
+    _check(
+        argv,
+        exit_code,
+        timed_out.is_set(),
+        timeout,
+        "",
+        error_output,
+        fail_on_exit_code,
+    )
+
+
+def remember(key, function, *args, **kwargs):
+    """Return ``function(*args, **kwargs)``, computed only once per key.
+
+    The result is kept in memory for the rest of the run (so: the rest of the
+    collector's process). When several threads ask for the same key at the
+    same time, only one of them does the work, the others wait for it.
+    Exceptions aren't remembered.
+
+    Hits and misses are counted in ``stats``.
+
+    """
+    with _memory_lock:
+        future = _memory.get(key)
+        is_new = future is None
+        if is_new:
+            future = _memory[key] = Future()
+    if not is_new:
+        increment("memory_hits")
+        return future.result()
+    increment("memory_misses")
+    try:
+        result = function(*args, **kwargs)
+    except BaseException as e:
+        with _memory_lock:
+            del _memory[key]
+        future.set_exception(e)
+        raise
+    future.set_result(result)
+    return result
+
+
+def forget():
+    """Forget everything ``remember()`` remembered"""
+    with _memory_lock:
+        _memory.clear()
+
+
+def _executable_key(executable, cwd):
+    """Return (resolved path, mtime) of the executable or None"""
+    if os.sep not in executable:
+        executable = shutil.which(executable)
+        if executable is None:
+            return
+    executable = os.path.realpath(os.path.join(cwd, executable))
+    try:
+        return (executable, os.stat(executable).st_mtime_ns)
+    except OSError:
+        return
+
+
+def remembered_run_command(argv, cwd=".", **kwargs):
+    """Like ``run_command()``, but run a specific command only once per run.
+
+    Meant for probes like ``python --version`` that we'd otherwise run for
+    every checkout that uses the same python. The output is remembered per
+    executable (resolved, including its modification time) plus arguments.
+    The working directory doesn't count, so don't use it for commands whose
+    output depends on it.
+
+    """
+    executable_key = _executable_key(argv[0], cwd)
+    if executable_key is None:
+        # We don't know what we're running, so we can't remember it.
+        return run_command(argv, cwd=cwd, **kwargs)
+    key = ("command", executable_key, tuple(argv[1:]))
+    return remember(key, run_command, argv, cwd=cwd, **kwargs)
+
+
+def log_memory_statistics():
+    """Log (in verbose mode) how often ``remember()`` saved us some work"""
+    logger.info(
+        "Remembered results: %s hits, %s misses",
+        stats["memory_hits"],
+        stats["memory_misses"],
+    )
+
+
+def run_concurrently(function, items, max_workers=MAX_WORKERS):
+    """Return ``[function(item) for item in items]``, computed in threads.
+
+    Meant for functions that mostly wait for external commands (git, pip,
+    docker exec): at most ``max_workers`` of them run at the same time, so the
+    total time is determined by the slowest commands instead of by their sum.
+
+    The results are in the same order as the items. An exception in one of the
+    calls is raised here.
+
+    """
+    if max_workers <= 1:
+        return [function(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, items))
+
+
+def _has_content(filename, content):
+    """Return whether the file already has exactly this content"""
+    try:
+        if os.path.getsize(filename) != len(content.encode()):
+            return False
+        with open(filename) as existing_file:
+            existing_content = existing_file.read()
+    except (OSError, UnicodeDecodeError):
+        return False
+    digest = hashlib.sha1(existing_content.encode()).digest()
+    return digest == hashlib.sha1(content.encode()).digest()
+
+
+def write_file(filename, content):
+    """Write content to filename atomically, return whether it was written.
+
+    The content is written to a temporary file in the same directory, which is
+    then renamed to ``filename``. A reader (or a killed run) never sees a
+    half-written file.
+
+    If the file already has this content, nothing is written. That saves disk
+    churn and downstream pollers don't see a new modification time, so they
+    don't re-ingest identical data.
+
+    """
+    if _has_content(filename, content):
+        increment("unchanged_files")
+        return False
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(
+        dir=directory, prefix="." + os.path.basename(filename) + "."
+    )
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.write(content)
+        os.chmod(temp_filename, 0o644)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    increment("written_files")
+    return True
+
+
+def write_json(filename, data, compact=False):
+    """Write data as json with ``write_file()``, return whether it was written.
+
+    Normally, the json is indented for readability. ``compact=True`` omits all
+    whitespace, which makes a big difference for large facts like checkouts.
+
+    """
+    if compact:
+        content = json.dumps(data, sort_keys=True, separators=(",", ":"))
+    else:
+        content = json.dumps(data, sort_keys=True, indent=4)
+    return write_file(filename, content)
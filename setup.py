@@ -57,6 +57,10 @@ setup(
             "nginx-info = serverscripts.nginx:main",
             # The one below runs all above ones, except for cifsfixer
             "gather-all-info = serverscripts.script:main",
+            # Long-running alternative for gather-all-info + cifsfixer
+            "serverscripts-agent = serverscripts.agent:main",
+            # Development tool for recording/replaying a collector run
+            "serverscripts-replay = serverscripts.replay:main",
         ]
     },
 )